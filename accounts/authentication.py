@@ -0,0 +1,170 @@
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.db.models import F
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from myproject.tracing import traced
+
+from .models import User, RevokedToken
+
+TOKEN_VERSION_CLAIM = 'ver'
+GROUPS_CLAIM = 'groups'
+
+# What request.user needs; the password hash never goes into the cache
+AUTH_USER_FIELDS = [
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {
+        'id', 'username', 'email', 'phone', 'first_name', 'last_name',
+        'is_active', 'is_staff', 'is_superuser', 'token_version',
+    }
+]
+# Backends that keep entries in each process, so a revocation would only
+# reach the worker that handled it
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _version_key(user_id):
+    return f"token_version_{user_id}"
+
+
+def _user_key(user_id):
+    return f"auth_user_fields_{user_id}"
+
+
+def cache_is_shared():
+    return settings.CACHES['default']['BACKEND'] not in LOCAL_CACHE_BACKENDS
+
+
+def get_token_version(user_id):
+    """Current token version for a user, or None if the user is gone.
+
+    Cached only in a shared cache; with a per-process one every check reads
+    the row, so revocations take effect in all workers at once.
+    """
+    shared = cache_is_shared()
+    key = _version_key(user_id)
+    version = cache.get(key) if shared else None
+    if version is None:
+        version = User.objects.filter(id=user_id).values_list('token_version', flat=True).first()
+        if version is not None and shared:
+            cache.set(key, version, settings.TOKEN_VERSION_CACHE_TTL)
+    return version
+
+
+def revoke_user_tokens(user_id):
+    """Invalidate every access and refresh token issued to a user so far."""
+    User.objects.filter(id=user_id).update(token_version=F('token_version') + 1)
+    cache.delete_many([_version_key(user_id), _user_key(user_id)])
+
+
+def revoke_tokens_for_users(user_ids):
+    """Bulk version of revoke_user_tokens: one UPDATE for all users."""
+    user_ids = list(user_ids)
+    User.objects.filter(id__in=user_ids).update(token_version=F('token_version') + 1)
+    cache.delete_many([key for user_id in user_ids for key in (_version_key(user_id), _user_key(user_id))])
+
+
+def forget_cached_user(user_id):
+    cache.delete(_user_key(user_id))
+
+
+def issue_tokens(user):
+    """Refresh token (and, via access_token, its access token) carrying stable claims."""
+    refresh = RefreshToken.for_user(user)
+    refresh[GROUPS_CLAIM] = list(user.groups.values_list('name', flat=True))
+    refresh[TOKEN_VERSION_CLAIM] = user.token_version
+    return refresh
+
+
+def _revoked_key(jti):
+    return f"revoked_jti_{jti}"
+
+
+def is_token_revoked(token):
+    """Revocation check: cache hit first, then the unique jti index."""
+    jti = token['jti']
+    if cache.get(_revoked_key(jti)):
+        return True
+    return RevokedToken.objects.filter(jti=jti).exists()
+
+
+def revoke_token(token):
+    """
+    Record a refresh token's jti as revoked until it expires.
+
+    Returns False if it was already revoked, which lets callers detect reuse
+    of a rotated-out token.
+    """
+    jti = token['jti']
+    expires_at = datetime.fromtimestamp(token['exp'], tz=timezone.utc)
+    remaining = int((expires_at - datetime.now(tz=timezone.utc)).total_seconds())
+    if remaining > 0:
+        cache.set(_revoked_key(jti), True, remaining)
+    try:
+        with transaction.atomic():
+            RevokedToken.objects.create(jti=jti, expires_at=expires_at)
+    except IntegrityError:
+        return False
+    return True
+
+
+def check_token_version(token):
+    if token.get(TOKEN_VERSION_CLAIM) != get_token_version(token['user_id']):
+        raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+
+
+@traced('permission.has_group')
+def has_group(user, name):
+    """Group check that uses the token's group claim when available."""
+    groups = getattr(user, 'token_groups', None)
+    if groups is None:
+        return user.groups.filter(name=name).exists()
+    return name in groups
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user without hitting the database.
+
+    Tokens issued by ``issue_tokens`` carry the user's groups and a token
+    version. The version is checked against the user's current one (revocation), and the
+    user is rebuilt from a short-TTL cache entry of ``AUTH_USER_FIELDS``
+    (other fields load on first access). Tokens without a version claim fall
+    back to the stock per-request lookup.
+    """
+
+    @traced('authenticate')
+    def authenticate(self, request):
+        return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        if TOKEN_VERSION_CLAIM not in validated_token:
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token['user_id']
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        check_token_version(validated_token)
+
+        key = _user_key(user_id)
+        values = cache.get(key)
+        if values is None:
+            values = User.objects.filter(id=user_id).values_list(*AUTH_USER_FIELDS).first()
+            if values is None:
+                raise AuthenticationFailed('User not found', code='user_not_found')
+            cache.set(key, values, settings.AUTH_USER_CACHE_TTL)
+        user = User.from_db(DEFAULT_DB_ALIAS, AUTH_USER_FIELDS, values)
+
+        if not user.is_active:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        user.token_groups = validated_token.get(GROUPS_CLAIM, [])
+        return user
@@ -0,0 +1,15 @@
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    # Imported here so app loading doesn't pull in DRF and simplejwt
+    from .authentication import cache_is_shared
+    if cache_is_shared():
+        return []
+    return [Warning(
+        'The default cache is per process, so sign-in throttles and lockouts '
+        'are counted separately in every worker.',
+        hint='Set CACHE_BACKEND to a shared cache such as Redis when running more than one worker.',
+        id='accounts.W001',
+    )]
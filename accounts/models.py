@@ -3,6 +3,7 @@ from django.db import models
 
 class User(AbstractUser):
     phone = models.CharField(max_length=15, unique=True)
+    token_version = models.PositiveIntegerField(default=0)  # bump to revoke all issued JWTs
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -11,5 +12,22 @@ class User(AbstractUser):
     
     class Meta:
         db_table = 'users'
+        indexes = [
+            # Signup duplicate check (phone is already indexed by its unique constraint)
+            models.Index(fields=['email'], name='users_email_idx'),
+        ]
 
 
+class RevokedToken(models.Model):
+    # Only revoked refresh tokens are stored, and only until they would have
+    # expired anyway (see the purge_revoked_tokens command)
+    jti = models.CharField(max_length=64, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    revoked_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.jti} (expires {self.expires_at})"
+
+    class Meta:
+        db_table = 'revoked_tokens'
+
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    # Imported here so app loading doesn't pull in DRF and simplejwt
+    from .authentication import forget_cached_user
+    forget_cached_user(instance.id)
+
+
+# Group names are embedded in tokens and a deactivated user must lose access
+# at once, so every change to either revokes the users' tokens. Bulk inserts
+# into the groups table (decide_member_requests) revoke explicitly instead.
+
+def _revoke(user_ids, instance=None):
+    from .authentication import revoke_tokens_for_users
+    if user_ids:
+        revoke_tokens_for_users(user_ids)
+    # A later save() of this instance must not write the old version back
+    if isinstance(instance, User) and instance.pk in user_ids:
+        instance.refresh_from_db(fields=['token_version'])
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def revoke_on_group_change(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        # The members are gone by post_clear
+        instance._cleared_user_ids = list(instance.user_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        _revoke(list(pk_set) if reverse else [instance.pk], instance)
+    elif action == 'post_clear':
+        _revoke(getattr(instance, '_cleared_user_ids', []) if reverse else [instance.pk], instance)
+
+
+@receiver(pre_delete, sender=Group)
+def revoke_on_group_delete(sender, instance, **kwargs):
+    _revoke(list(instance.user_set.values_list('id', flat=True)))
+
+
+@receiver(pre_save, sender=User)
+def note_deactivation(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or instance.is_active or (update_fields is not None and 'is_active' not in update_fields):
+        return
+    instance._deactivated = User.objects.filter(pk=instance.pk, is_active=True).exists()
+
+
+@receiver(post_save, sender=User)
+def revoke_on_deactivation(sender, instance, **kwargs):
+    if getattr(instance, '_deactivated', False):
+        instance._deactivated = False
+        _revoke([instance.pk], instance)
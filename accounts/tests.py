@@ -1,3 +1,356 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import _user_key, _version_key, issue_tokens
+from .models import RevokedToken, User
+from .throttles import (
+    EmailRateThrottle, IPRateThrottle, SlidingWindowThrottle, clear_signin_failures, is_signin_locked,
+    record_signin_failure,
+)
+
+MANAGE_USERS = '/api/auth/manage-users/'
+SIGNIN = '/api/auth/signin/'
+REFRESH = '/api/auth/refresh/'
+
+
+def make_user(i):
+    return User.objects.create_user(
+        username=f"user{i}@example.com", email=f"user{i}@example.com", password='test-pass-123',
+        phone=f"0170000{i:04d}", first_name=f"User{i}", last_name='Test',
+    )
+
+
+class TokenRevocationTests(TestCase):
+    """Access tokens stop working as soon as what they vouch for changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.admin_group = Group.objects.create(name='Super_Admin')
+        self.user = make_user(1)
+        self.user.groups.add(self.admin_group)
+        self.user.refresh_from_db()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {issue_tokens(user).access_token}")
+        return client
+
+    def test_current_token_is_accepted(self):
+        self.assertEqual(self.client_for(self.user).get(MANAGE_USERS).status_code, 200)
+
+    def test_version_mismatch_is_rejected(self):
+        client = self.client_for(self.user)
+        self.assertEqual(client.get(MANAGE_USERS).status_code, 200)
+        # Another worker's revocation: the row changes, this process's cache doesn't
+        User.objects.filter(pk=self.user.pk).update(token_version=self.user.token_version + 1)
+        response = client.get(MANAGE_USERS)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_revoked')
+
+    def test_version_is_not_cached_per_process(self):
+        self.client_for(self.user).get(MANAGE_USERS)
+        self.assertIsNone(cache.get(_version_key(self.user.pk)))
+
+    def test_version_is_cached_in_a_shared_cache(self):
+        with mock.patch('accounts.authentication.cache_is_shared', return_value=True):
+            self.client_for(self.user).get(MANAGE_USERS)
+        self.assertEqual(cache.get(_version_key(self.user.pk)), self.user.token_version)
+
+    def test_group_change_revokes_old_tokens(self):
+        for change in (
+            lambda: self.user.groups.remove(self.admin_group),
+            lambda: self.admin_group.user_set.remove(self.user),
+            lambda: self.user.groups.clear(),
+            lambda: self.admin_group.user_set.clear(),
+            lambda: self.admin_group.delete(),
+        ):
+            self.admin_group, _ = Group.objects.get_or_create(name='Super_Admin')
+            self.user.groups.add(self.admin_group)
+            client = self.client_for(self.user)
+            self.assertEqual(client.get(MANAGE_USERS).status_code, 200)
+            change()
+            self.assertEqual(client.get(MANAGE_USERS).status_code, 401)
+
+    def test_group_change_survives_a_later_save(self):
+        client = self.client_for(self.user)
+        self.user.groups.remove(self.admin_group)
+        # A stale in-memory version must not be written back
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        self.assertEqual(client.get(MANAGE_USERS).status_code, 401)
+
+    def test_manage_users_revokes_the_target(self):
+        target = make_user(2)
+        target.groups.add(self.admin_group)
+        target_client = self.client_for(target)
+        response = self.client_for(self.user).post(
+            MANAGE_USERS, {'user_id': target.pk, 'group_names': ['Member']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(target_client.get(MANAGE_USERS).status_code, 401)
+
+    def test_deactivation_revokes_tokens(self):
+        client = self.client_for(self.user)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(client.get(MANAGE_USERS).status_code, 401)
+        version = User.objects.get(pk=self.user.pk).token_version
+        # Saving an already inactive user doesn't bump again
+        self.user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).token_version, version)
+
+    def test_cached_user_has_no_password(self):
+        self.client_for(self.user).get(MANAGE_USERS)
+        cached = cache.get(_user_key(self.user.pk))
+        self.assertIsNotNone(cached)
+        self.assertNotIn(self.user.password, cached)
+
+
+class Clock:
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def fake_request(ip='10.0.0.1', email=None):
+    return SimpleNamespace(META={'REMOTE_ADDR': ip}, data={'email': email} if email else {})
+
+
+class TenPerMinute(IPRateThrottle):
+    scope = 'test'
+    rate = '10/min'
+
+
+class TenPerMinuteByEmail(EmailRateThrottle):
+    scope = 'test_email'
+    rate = '10/min'
+
+
+class SlidingWindowThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.clock = Clock(600.0)
+
+    def allowed(self, throttle_class, request, count):
+        allowed = 0
+        for _ in range(count):
+            throttle = throttle_class()
+            throttle.timer = self.clock
+            allowed += throttle.allow_request(request, None)
+        return allowed
+
+    def test_limit_within_a_window(self):
+        self.assertEqual(self.allowed(TenPerMinute, fake_request(), 15), 10)
+
+    def test_previous_window_is_weighted_by_overlap(self):
+        self.allowed(TenPerMinute, fake_request(), 10)
+        # Halfway through the next window half of the old count still applies
+        self.clock.now += 90
+        self.assertEqual(self.allowed(TenPerMinute, fake_request(), 10), 5)
+        # Two windows later the old counts no longer apply
+        self.clock.now += 120
+        self.assertEqual(self.allowed(TenPerMinute, fake_request(), 15), 10)
+
+    def test_wait_is_the_rest_of_the_window(self):
+        self.clock.now += 15
+        self.allowed(TenPerMinute, fake_request(), 10)
+        throttle = TenPerMinute()
+        throttle.timer = self.clock
+        self.assertFalse(throttle.allow_request(fake_request(), None))
+        self.assertEqual(throttle.wait(), 45)
+
+    def test_ip_limit_is_per_address(self):
+        self.assertEqual(self.allowed(TenPerMinute, fake_request('10.0.0.1'), 12), 10)
+        self.assertEqual(self.allowed(TenPerMinute, fake_request('10.0.0.2'), 12), 10)
+
+    def test_email_limit_spans_addresses_and_case(self):
+        for i in range(12):
+            email = 'Victim@Example.com' if i % 2 else ' victim@example.com'
+            self.allowed(TenPerMinuteByEmail, fake_request(f"10.0.0.{i}", email), 1)
+        self.assertEqual(self.allowed(TenPerMinuteByEmail, fake_request('10.0.1.1', 'victim@example.com'), 1), 0)
+        self.assertEqual(self.allowed(TenPerMinuteByEmail, fake_request('10.0.1.1', 'other@example.com'), 1), 1)
+
+    def test_email_limit_ignores_requests_without_email(self):
+        self.assertEqual(self.allowed(TenPerMinuteByEmail, fake_request(), 20), 20)
+
+    def test_unset_rate_allows_everything(self):
+        class Unlimited(SlidingWindowThrottle):
+            scope = 'unlimited'
+            rate = None
+
+            def __init__(self):
+                pass
+
+            def get_cache_key(self, request, view):
+                return 'unlimited'
+
+        self.assertEqual(self.allowed(Unlimited, fake_request(), 50), 50)
+
+
+@override_settings(SIGNIN_MAX_FAILURES=3, SIGNIN_LOCKOUT_SECONDS=60)
+class SigninLockoutTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_locks_after_max_failures(self):
+        for _ in range(2):
+            record_signin_failure('victim@example.com')
+        self.assertFalse(is_signin_locked('victim@example.com'))
+        record_signin_failure('VICTIM@example.com ')
+        self.assertTrue(is_signin_locked('victim@example.com'))
+        self.assertFalse(is_signin_locked('other@example.com'))
+
+    def test_success_clears_failures(self):
+        for _ in range(3):
+            record_signin_failure('victim@example.com')
+        clear_signin_failures('victim@example.com')
+        self.assertFalse(is_signin_locked('victim@example.com'))
+
+    def test_missing_email_is_never_locked(self):
+        record_signin_failure('')
+        self.assertFalse(is_signin_locked(None))
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.PBKDF2PasswordHasher'],
+    SIGNIN_MAX_FAILURES=5,
+)
+class SigninUnderAttackTests(TestCase):
+    """
+    Load check: a password-guessing run against one email from rotating
+    addresses hashes at most SIGNIN_MAX_FAILURES times, so every later
+    attempt is answered without hashing and latency stays flat.
+    """
+
+    ATTEMPTS = 200
+
+    def setUp(self):
+        cache.clear()
+        self.victim = make_user(1)
+        self.bystander = make_user(2)
+
+    def test_attack_latency_stays_flat(self):
+        client = APIClient()
+        with mock.patch.object(PBKDF2PasswordHasher, 'verify', autospec=True,
+                               side_effect=PBKDF2PasswordHasher.verify) as verify:
+            started = time.perf_counter()
+            response = client.post(SIGNIN, {'email': 'user2@example.com', 'password': 'test-pass-123'},
+                                   REMOTE_ADDR='192.0.2.1')
+            hashed_latency = time.perf_counter() - started
+            self.assertEqual(response.status_code, 200)
+            verify.reset_mock()
+
+            latencies = []
+            for i in range(self.ATTEMPTS):
+                started = time.perf_counter()
+                response = client.post(SIGNIN, {'email': 'user1@example.com', 'password': f"guess-{i}"},
+                                       REMOTE_ADDR=f"198.51.100.{i % 250}")
+                latencies.append(time.perf_counter() - started)
+                self.assertIn(response.status_code, (400, 429))
+
+            self.assertEqual(verify.call_count, 5)
+            latencies.sort()
+            # Everything after the lockout skips the hasher
+            self.assertLess(latencies[-6], hashed_latency)
+
+            # The right password is refused too while locked
+            response = client.post(SIGNIN, {'email': 'user1@example.com', 'password': 'test-pass-123'},
+                                   REMOTE_ADDR='192.0.2.2')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(verify.call_count, 5)
+
+            # Other accounts are unaffected
+            response = client.post(SIGNIN, {'email': 'user2@example.com', 'password': 'test-pass-123'},
+                                   REMOTE_ADDR='192.0.2.3')
+            self.assertEqual(response.status_code, 200)
+
+
+class RefreshRotationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user(1)
+
+    def sign_in(self):
+        client = APIClient()
+        response = client.post(SIGNIN, {'email': 'user1@example.com', 'password': 'test-pass-123'})
+        self.assertEqual(response.status_code, 200)
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access_token']}")
+        return client
+
+    def test_refresh_rotates_the_token(self):
+        client = self.sign_in()
+        old = client.cookies['refresh_token'].value
+        response = client.post(REFRESH)
+        self.assertEqual(response.status_code, 200)
+        new = client.cookies['refresh_token'].value
+        self.assertNotEqual(new, old)
+        self.assertTrue(RevokedToken.objects.filter(jti=RefreshToken(old)['jti']).exists())
+        # The new pair works
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access_token']}")
+        self.assertEqual(client.post(REFRESH).status_code, 200)
+
+    def test_replaying_a_rotated_token_revokes_every_session(self):
+        client = self.sign_in()
+        other = self.sign_in()
+        stolen = client.cookies['refresh_token'].value
+        self.assertEqual(client.post(REFRESH).status_code, 200)
+
+        attacker = APIClient()
+        attacker.cookies['refresh_token'] = stolen
+        self.assertEqual(attacker.post(REFRESH).status_code, 401)
+
+        # The legitimate rotation and the untouched session are both gone
+        self.assertEqual(client.post(REFRESH).status_code, 401)
+        self.assertEqual(other.post(REFRESH).status_code, 401)
+        self.assertEqual(other.post('/api/auth/logout-all/').status_code, 401)
+
+    def test_replay_is_detected_without_the_cache(self):
+        client = self.sign_in()
+        stolen = client.cookies['refresh_token'].value
+        client.post(REFRESH)
+        cache.clear()
+        attacker = APIClient()
+        attacker.cookies['refresh_token'] = stolen
+        self.assertEqual(attacker.post(REFRESH).status_code, 401)
+        self.assertEqual(client.post(REFRESH).status_code, 401)
+
+    def test_logout_revokes_only_that_session(self):
+        client = self.sign_in()
+        other = self.sign_in()
+        refresh = client.cookies['refresh_token'].value
+        self.assertEqual(client.post('/api/auth/logout/').status_code, 200)
+        self.assertTrue(RevokedToken.objects.filter(jti=RefreshToken(refresh)['jti']).exists())
+        self.assertEqual(other.post(REFRESH).status_code, 200)
+
+    def test_logout_all_revokes_every_session(self):
+        client = self.sign_in()
+        other = self.sign_in()
+        self.assertEqual(client.post('/api/auth/logout-all/').status_code, 200)
+        self.assertEqual(other.post(REFRESH).status_code, 401)
+        self.assertEqual(other.post('/api/auth/logout-all/').status_code, 401)
+        # Signing in again starts a fresh session
+        self.assertEqual(self.sign_in().post(REFRESH).status_code, 200)
+
+
+class PurgeRevokedTokensTests(TestCase):
+    def test_purges_only_expired_tokens(self):
+        now = timezone.now()
+        RevokedToken.objects.create(jti='expired', expires_at=now - timedelta(seconds=1))
+        RevokedToken.objects.create(jti='live', expires_at=now + timedelta(days=1))
+        out = StringIO()
+        call_command('purge_revoked_tokens', stdout=out)
+        self.assertEqual(list(RevokedToken.objects.values_list('jti', flat=True)), ['live'])
+        self.assertIn('Purged 1 expired revoked tokens', out.getvalue())
@@ -0,0 +1,109 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class SlidingWindowThrottle(SimpleRateThrottle):
+    """
+    Sliding-window counter throttle.
+
+    Keeps one counter per fixed window and weights the previous window by how
+    much of it still overlaps the sliding one, so each check costs a single
+    get_many plus an incr instead of storing a timestamp history.
+    """
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        window = int(self.now // self.duration)
+        current_key = f"{self.key}:{window}"
+        previous_key = f"{self.key}:{window - 1}"
+        counts = self.cache.get_many([current_key, previous_key])
+
+        self.window_elapsed = (self.now % self.duration) / self.duration
+        estimated = counts.get(previous_key, 0) * (1 - self.window_elapsed) + counts.get(current_key, 0)
+        if estimated >= self.num_requests:
+            return self.throttle_failure()
+
+        self.cache.add(current_key, 0, self.duration * 2)
+        try:
+            self.cache.incr(current_key)
+        except ValueError:
+            # Key expired between add and incr
+            self.cache.set(current_key, 1, self.duration * 2)
+        return True
+
+    def wait(self):
+        return self.duration * (1 - self.window_elapsed)
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class EmailRateThrottle(SlidingWindowThrottle):
+    def get_cache_key(self, request, view):
+        email = normalize_email(request.data.get('email') if hasattr(request.data, 'get') else None)
+        if not email:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': email}
+
+
+class SigninRateThrottle(IPRateThrottle):
+    scope = 'signin'
+
+
+class SigninEmailRateThrottle(EmailRateThrottle):
+    scope = 'signin_email'
+
+
+class SignupRateThrottle(IPRateThrottle):
+    scope = 'signup'
+
+
+class SignupEmailRateThrottle(EmailRateThrottle):
+    scope = 'signup_email'
+
+
+class RefreshTokenRateThrottle(IPRateThrottle):
+    scope = 'refresh_token'
+
+
+# Failed sign-in tracking. Checked before authenticate() so a locked-out
+# email never reaches the password hasher.
+
+def normalize_email(email):
+    return str(email).strip().lower() if email else ''
+
+
+def _failure_key(email):
+    return f"signin_failures_{normalize_email(email)}"
+
+
+def is_signin_locked(email):
+    if not email:
+        return False
+    return cache.get(_failure_key(email), 0) >= settings.SIGNIN_MAX_FAILURES
+
+
+def record_signin_failure(email):
+    if not email:
+        return
+    key = _failure_key(email)
+    cache.add(key, 0, settings.SIGNIN_LOCKOUT_SECONDS)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, settings.SIGNIN_LOCKOUT_SECONDS)
+
+
+def clear_signin_failures(email):
+    if email:
+        cache.delete(_failure_key(email))
@@ -6,5 +6,6 @@ urlpatterns = [
     path('signin/', views.signin, name='signin'),
     path('refresh/', views.refresh_token, name='refresh_token'),
     path('logout/', views.logout, name='logout'),
+    path('logout-all/', views.logout_all, name='logout_all'),
     path('manage-users/', views.manage_users, name='manage_users'),
 ]
\ No newline at end of file
@@ -1,17 +1,27 @@
 from rest_framework import status
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
 from django.conf import settings
 from .serializers import UserRegistrationSerializer, UserLoginSerializer, UserSerializer
 from django.contrib.auth.models import Group
 from .models import User
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
+from myproject.tracing import serialize, span
+from .authentication import (
+    issue_tokens, check_token_version, revoke_user_tokens, has_group, is_token_revoked, revoke_token
+)
+from .throttles import (
+    SigninRateThrottle, SigninEmailRateThrottle, SignupRateThrottle, SignupEmailRateThrottle,
+    RefreshTokenRateThrottle, is_signin_locked, record_signin_failure, clear_signin_failures
+)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([SignupRateThrottle, SignupEmailRateThrottle])
 def signup(request):
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
@@ -19,17 +29,30 @@ def signup(request):
         user_serializer = UserSerializer(user)
         return Response({
             'message': 'User created successfully',
-            'user': user_serializer.data
+            'user': serialize(user_serializer)
         }, status=status.HTTP_201_CREATED)
     return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([SigninRateThrottle, SigninEmailRateThrottle])
 def signin(request):
+    email = request.data.get('email')
+    # Reject locked-out emails before any password hashing happens
+    if is_signin_locked(email):
+        return Response(
+            {'error': 'Too many failed sign-in attempts. Try again later.'},
+            status=status.HTTP_429_TOO_MANY_REQUESTS
+        )
+    
     serializer = UserLoginSerializer(data=request.data)
-    if serializer.is_valid():
+    # Password hashing dominates sign-in
+    with span('signin.check_password'):
+        valid = serializer.is_valid()
+    if valid:
         user = serializer.validated_data['user']
-        refresh = RefreshToken.for_user(user)
+        clear_signin_failures(email)
+        refresh = issue_tokens(user)
         access_token = str(refresh.access_token)
         refresh_token = str(refresh)
         
@@ -39,24 +62,29 @@ def signin(request):
         response = Response({
             'access_token': access_token,
             'refresh_token': refresh_token,
-            'user': user_serializer.data
+            'user': serialize(user_serializer)
         }, status=status.HTTP_200_OK)
         
         # Set refresh token in httpOnly cookie
-        response.set_cookie(
-            'refresh_token',
-            refresh_token,
-            max_age=settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds(),
-            httponly=True,
-            secure=not settings.DEBUG,
-            samesite='Lax'
-        )
+        set_refresh_cookie(response, refresh_token)
         
         return response
+    record_signin_failure(email)
     return Response({'error': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
 
+def set_refresh_cookie(response, refresh_token):
+    response.set_cookie(
+        'refresh_token',
+        refresh_token,
+        max_age=settings.SIMPLE_JWT['REFRESH_TOKEN_LIFETIME'].total_seconds(),
+        httponly=True,
+        secure=not settings.DEBUG,
+        samesite='Lax'
+    )
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@throttle_classes([RefreshTokenRateThrottle])
 def refresh_token(request):
     refresh_token = request.COOKIES.get('refresh_token')
     if not refresh_token:
@@ -64,17 +92,51 @@ def refresh_token(request):
     
     try:
         refresh = RefreshToken(refresh_token)
-        access_token = str(refresh.access_token)
-        return Response({'access_token': access_token}, status=status.HTTP_200_OK)
+        if 'ver' in refresh:
+            check_token_version(refresh)
+        user = User.objects.get(id=refresh['user_id'], is_active=True)
+    except AuthenticationFailed:
+        return Response({'error': 'Refresh token has been revoked'}, status=status.HTTP_401_UNAUTHORIZED)
     except Exception:
         return Response({'error': 'Invalid refresh token'}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    # Rotate: the presented token is revoked and a fresh pair is issued.
+    # A token that was already revoked is being replayed, so every session
+    # of that user is revoked as a precaution.
+    if is_token_revoked(refresh) or not revoke_token(refresh):
+        revoke_user_tokens(user.id)
+        response = Response({'error': 'Refresh token has been revoked'}, status=status.HTTP_401_UNAUTHORIZED)
+        response.delete_cookie('refresh_token')
+        return response
+    
+    new_refresh = issue_tokens(user)
+    response = Response({'access_token': str(new_refresh.access_token)}, status=status.HTTP_200_OK)
+    set_refresh_cookie(response, str(new_refresh))
+    return response
+
+def revoke_cookie_token(request):
+    refresh_token = request.COOKIES.get('refresh_token')
+    if refresh_token:
+        try:
+            revoke_token(RefreshToken(refresh_token))
+        except Exception:
+            pass
 
 @api_view(['POST'])
 def logout(request):
+    revoke_cookie_token(request)
     response = Response({'message': 'Logged out successfully'}, status=status.HTTP_200_OK)
     response.delete_cookie('refresh_token')
     return response
 
+@api_view(['POST'])
+def logout_all(request):
+    revoke_cookie_token(request)
+    revoke_user_tokens(request.user.id)
+    response = Response({'message': 'Logged out of all sessions'}, status=status.HTTP_200_OK)
+    response.delete_cookie('refresh_token')
+    return response
+
 
 @api_view(['GET', 'POST'])
 @permission_classes([IsAuthenticated])
@@ -82,15 +144,15 @@ def manage_users(request):
     user = request.user
 
     # Only Super_Admin can access
-    if not user.groups.filter(name="Super_Admin").exists():
+    if not has_group(user, "Super_Admin"):
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
 
     # GET → list users
     if request.method == "GET":
-        users = User.objects.filter(is_staff=False)
+        users = User.objects.filter(is_staff=False).prefetch_related('groups')
         from .serializers import UserSerializer  # ensure serializer has groups
         serializer = UserSerializer(users, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serialize(serializer), status=status.HTTP_200_OK)
 
     # POST → assign user to groups
     if request.method == "POST":
@@ -111,9 +173,9 @@ def manage_users(request):
             group, _ = Group.objects.get_or_create(name=name)
             groups.append(group)
 
-        # Overwrite groups with the provided list
+        # Overwrite groups with the provided list; changing them revokes the
+        # user's tokens (see accounts.signals)
         target_user.groups.set(groups)
-        target_user.save()
 
         return Response(
             {'message': f'User assigned to groups {", ".join(group_names)}'},
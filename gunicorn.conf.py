@@ -0,0 +1,90 @@
+"""
+Gunicorn settings, tuned through environment variables.
+
+gunicorn picks this file up from the working directory, so production runs
+plain ``gunicorn``. Worker classes:
+
+    GUNICORN_WORKER_CLASS=gthread  threaded WSGI workers (default)
+    GUNICORN_WORKER_CLASS=uvicorn  ASGI workers for myproject.asgi, needed for
+                                   the live meal board; requires ``uvicorn``
+    GUNICORN_WORKER_CLASS=sync     gunicorn's stock one-request-per-worker
+
+The app is preloaded in the master so workers share its memory pages and a
+broken deploy fails before any worker forks; workers are recycled after
+about GUNICORN_MAX_REQUESTS requests (with jitter, so they don't all restart
+together) to cap slow memory growth.
+"""
+import os
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+os.environ.setdefault('DJANGO_PROFILE', 'web')
+
+
+def env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def env_bool(name, default):
+    value = os.environ.get(name)
+    return default if value is None else value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def cpu_count():
+    # Respect CPU affinity / container cpusets where the platform exposes it
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+WORKER_CLASSES = {
+    'gthread': ('gthread', 'myproject.wsgi:application'),
+    'sync': ('sync', 'myproject.wsgi:application'),
+    'uvicorn': ('uvicorn.workers.UvicornWorker', 'myproject.asgi:application'),
+}
+kind = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if kind not in WORKER_CLASSES:
+    raise ValueError(f"GUNICORN_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, got {kind!r}")
+worker_class, wsgi_app = WORKER_CLASSES[kind]
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# Requests here mostly wait on PostgreSQL. Sync workers need 2 x CPU + 1 to
+# keep the CPUs busy; threaded and async workers overlap that wait
+# themselves, so about one per CPU (plus one spare) is enough.
+if kind == 'sync':
+    workers = env_int('GUNICORN_WORKERS', cpu_count() * 2 + 1)
+else:
+    workers = env_int('GUNICORN_WORKERS', cpu_count() + 1)
+threads = env_int('GUNICORN_THREADS', 4 if kind == 'gthread' else 1)
+
+preload_app = env_bool('GUNICORN_PRELOAD', True)
+max_requests = env_int('GUNICORN_MAX_REQUESTS', 2000)
+max_requests_jitter = env_int('GUNICORN_MAX_REQUESTS_JITTER', max_requests // 10)
+
+timeout = env_int('GUNICORN_TIMEOUT', 30)
+graceful_timeout = env_int('GUNICORN_GRACEFUL_TIMEOUT', 30)
+keepalive = env_int('GUNICORN_KEEPALIVE', 5)
+
+# Worker heartbeats on tmpfs instead of a possibly slow container disk
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+# '-' is stderr; set it empty to turn the access log off
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def pre_fork(server, worker):
+    # A connection opened while preloading would be shared by every forked
+    # worker; close it in the master so each worker opens its own
+    from django.db import connections
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    # Threads don't survive fork: let each worker start its own mess events
+    # listener instead of inheriting the master's "already started" flag
+    from mess_management import events
+    events.reset_after_fork()
@@ -2,11 +2,52 @@
 """Django's command-line utility for administrative tasks."""
 import os
 import sys
+import time
+
+STARTED = time.perf_counter()
+
+
+def resident_mb():
+    # ru_maxrss survives fork+exec, so a child would report its parent's
+    # peak; VmRSS is this process's own resident size
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def report_startup():
+    """
+    With DJANGO_STARTUP_TIMING set, print how long loading Django took and
+    the resident memory afterwards. DJANGO_STARTUP_TIMING=wsgi also builds
+    the WSGI handler and URLconf, as gunicorn --preload does.
+    """
+    import django
+    django.setup()
+    if os.environ['DJANGO_STARTUP_TIMING'] == 'wsgi':
+        from django.core.wsgi import get_wsgi_application
+        from django.urls import get_resolver
+        get_wsgi_application()
+        get_resolver().url_patterns
+    elapsed = (time.perf_counter() - STARTED) * 1000
+    sys.stderr.write(
+        f"startup profile={os.environ['DJANGO_PROFILE']} setup_ms={elapsed:.1f} rss_mb={resident_mb():.1f}\n"
+    )
 
 
 def main():
     """Run administrative tasks."""
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+    # runserver serves HTTP and test exercises the app as served (admin
+    # included); every other command gets the lighter cli profile
+    os.environ.setdefault('DJANGO_PROFILE', 'web' if sys.argv[1:2] in (['runserver'], ['test']) else 'cli')
+    if os.environ.get('DJANGO_STARTUP_TIMING'):
+        report_startup()
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
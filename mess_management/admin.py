@@ -1,50 +1,230 @@
+from datetime import date, datetime
+
 from django.contrib import admin
-from .models import Mess, Meal, MonthlyCalculation, MemberMealSummary,MemberRequest,MemberContribution
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from . import history
+from .dashboard import touch
+from .events import publish_on_commit
+from .models import Mess, Meal, MonthlyCalculation, MemberMealSummary,MemberRequest,MemberContribution,Membership,ChangeLogEntry
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that trusts PostgreSQL's row estimate for unfiltered changelists.
+
+    An exact COUNT(*) over a multi-million-row table is a full scan on every
+    page load; the planner's estimate is free. Filtered or searched lists,
+    small tables and other databases still get an exact count.
+    """
+    exact_count_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is not None and not query.where and connections[queryset.db].vendor == 'postgresql':
+            with connections[queryset.db].cursor() as cursor:
+                cursor.execute(
+                    "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                    [queryset.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            # reltuples is -1 until the table has been analyzed
+            if row and row[0] > self.exact_count_threshold:
+                return row[0]
+        return super().count
+
+
+class RecentMonthFilter(admin.SimpleListFilter):
+    """
+    Month filter over the last ``months`` months.
+
+    The lookups are computed in Python, unlike the stock field filters which
+    run a DISTINCT over the whole table to build the sidebar. Filters a
+    YYYY-MM ``field``, or a range on ``date_field`` when that is set.
+    """
+    title = 'month'
+    parameter_name = 'month'
+    field = 'month'
+    date_field = None
+    months = 12
+
+    def lookups(self, request, model_admin):
+        year, month = date.today().year, date.today().month
+        choices = []
+        for _ in range(self.months):
+            value = f"{year:04d}-{month:02d}"
+            choices.append((value, value))
+            year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+        return choices
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        try:
+            start = datetime.strptime(value, '%Y-%m').date()
+        except ValueError:
+            raise IncorrectLookupParameters(f"Invalid month: {value}")
+        if self.date_field is None:
+            return queryset.filter(**{self.field: value})
+        end = date(start.year + start.month // 12, start.month % 12 + 1, 1)
+        return queryset.filter(**{f"{self.date_field}__gte": start, f"{self.date_field}__lt": end})
+
+
+class MealMonthFilter(RecentMonthFilter):
+    date_field = 'date'
+
+
+class CalculationMonthFilter(RecentMonthFilter):
+    field = 'calculation__month'
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist defaults for tables that grow with every mess-day."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+
+
+class ChangeLoggedAdmin(LargeTableAdmin):
+    """
+    Treats admin edits like the API's write paths: records them in the change
+    history, refreshes the mess's dashboards and publishes an event.
+
+    Subclasses name the ``history`` builder for their model, the field with
+    the day or month it takes, the field whose value is tracked, and the
+    event for a changed row (``value`` is None once it is deleted).
+    """
+    change = None
+    period_field = None
+    value_field = None
+
+    def history_entry(self, obj, old, new, user):
+        return self.change(obj.mess_id, obj.member_id, getattr(obj, self.period_field), old, new, user)
+
+    def event(self, obj, value):
+        raise NotImplementedError
+
+    def changed(self, objs, deleted=False):
+        touch({obj.mess_id for obj in objs})
+        for obj in objs:
+            publish_on_commit(obj.mess_id, self.event(obj, None if deleted else getattr(obj, self.value_field)))
+
+    def save_model(self, request, obj, form, change):
+        old = form.initial.get(self.value_field) if change else None
+        super().save_model(request, obj, form, change)
+        history.record([self.history_entry(obj, old, getattr(obj, self.value_field), request.user)])
+        self.changed([obj])
+
+    def delete_model(self, request, obj):
+        entry = self.history_entry(obj, getattr(obj, self.value_field), None, request.user)
+        super().delete_model(request, obj)
+        history.record([entry])
+        self.changed([obj], deleted=True)
+
+    def delete_queryset(self, request, queryset):
+        objs = list(queryset)
+        entries = [self.history_entry(obj, getattr(obj, self.value_field), None, request.user) for obj in objs]
+        super().delete_queryset(request, queryset)
+        history.record(entries)
+        self.changed(objs, deleted=True)
+
+
+class MembershipInline(admin.TabularInline):
+    model = Membership
+    extra = 0
+    raw_id_fields = ('user',)
+    readonly_fields = ('joined_at',)
 
 
 @admin.register(Mess)
 class MessAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'member_count', 'manager_count', 'created_at')
     list_filter = ('created_at',)
+    list_select_related = ('owner',)
+    autocomplete_fields = ('owner',)
     search_fields = ('name', 'owner__email', 'owner__first_name', 'owner__last_name')
-    filter_horizontal = ('members', 'managers')
-    
-    def member_count(self, obj):
-        return obj.members.count()
-    member_count.short_description = 'Members'
-    
-    def manager_count(self, obj):
-        return obj.managers.count()
-    manager_count.short_description = 'Managers'
+    readonly_fields = ('member_count', 'manager_count')
+    inlines = (MembershipInline,)
 
 @admin.register(Meal)
-class MealAdmin(admin.ModelAdmin):
+class MealAdmin(ChangeLoggedAdmin):
     list_display = ('member', 'mess', 'date', 'meal_count', 'added_by', 'created_at')
-    list_filter = ('date', 'meal_count', 'created_at')
+    list_filter = (MealMonthFilter, 'meal_count')
+    list_select_related = ('member', 'mess', 'added_by')
     search_fields = ('member__email', 'member__first_name', 'mess__name')
-    date_hierarchy = 'date'
+    autocomplete_fields = ('mess', 'member', 'added_by')
+    change = staticmethod(history.meal_change)
+    period_field = 'date'
+    value_field = 'meal_count'
+
+    def event(self, obj, value):
+        if value is None:
+            # The day falls back to the member's schedule; clients reload the month
+            return {'type': 'meals', 'month': obj.date.strftime('%Y-%m')}
+        return {'type': 'meal', 'member_id': obj.member_id, 'date': str(obj.date), 'meal_count': value}
 
 @admin.register(MonthlyCalculation)
-class MonthlyCalculationAdmin(admin.ModelAdmin):
+class MonthlyCalculationAdmin(LargeTableAdmin):
     list_display = ('mess', 'month', 'total_cost', 'total_meals', 'cost_per_meal', 'calculated_by', 'calculated_at')
-    list_filter = ('month', 'calculated_at')
+    list_filter = (RecentMonthFilter, 'calculated_at')
+    list_select_related = ('mess', 'calculated_by')
     search_fields = ('mess__name', 'calculated_by__email')
+    autocomplete_fields = ('mess', 'calculated_by')
     readonly_fields = ('total_cost', 'cost_per_meal', 'calculated_at')
 
 @admin.register(MemberRequest)
-class MemberRequestAdmin(admin.ModelAdmin):
+class MemberRequestAdmin(LargeTableAdmin):
     list_display = ('user', 'first_name', 'last_name', 'phone', 'status', 'created_at')
     list_filter = ('status', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('user__email', 'first_name', 'last_name', 'phone')
+    autocomplete_fields = ('user',)
 
 @admin.register(MemberContribution)
-class MemberContributionAdmin(admin.ModelAdmin):
+class MemberContributionAdmin(ChangeLoggedAdmin):
     list_display = ('member', 'mess', 'month', 'amount', 'added_by', 'created_at')
-    list_filter = ('month', 'created_at', 'mess')
+    list_filter = (RecentMonthFilter, 'created_at')
+    list_select_related = ('member', 'mess', 'added_by')
     search_fields = ('member__email', 'member__first_name', 'mess__name')
+    autocomplete_fields = ('mess', 'member', 'added_by')
+    change = staticmethod(history.contribution_change)
+    period_field = 'month'
+    value_field = 'amount'
+
+    def event(self, obj, value):
+        return {
+            'type': 'contribution', 'member_id': obj.member_id, 'month': obj.month,
+            'amount': None if value is None else str(value),
+        }
 
 @admin.register(MemberMealSummary)
-class MemberMealSummaryAdmin(admin.ModelAdmin):
+class MemberMealSummaryAdmin(LargeTableAdmin):
     list_display = ('member', 'calculation', 'total_meals', 'total_cost', 'contributed_amount', 'balance')
-    list_filter = ('calculation__month', 'calculation__mess')
-    search_fields = ('member__email', 'member__first_name', 'calculation__mess__name')
\ No newline at end of file
+    list_filter = (CalculationMonthFilter,)
+    # calculation renders as "<mess name> - <month>", so fetch its mess too
+    list_select_related = ('member', 'calculation__mess')
+    search_fields = ('member__email', 'member__first_name', 'calculation__mess__name')
+    autocomplete_fields = ('member',)
+    raw_id_fields = ('calculation',)
+
+@admin.register(ChangeLogEntry)
+class ChangeLogEntryAdmin(LargeTableAdmin):
+    list_display = ('mess', 'kind', 'member', 'month', 'day', 'old_value', 'new_value', 'changes', 'changed_by', 'changed_at')
+    list_filter = ('kind', RecentMonthFilter)
+    list_select_related = ('mess', 'member', 'changed_by')
+    search_fields = ('mess__name', 'member__email')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Entries only go away through compact_change_log, which keeps the totals
+        return False
@@ -0,0 +1,161 @@
+"""
+"My messes" dashboard: one payload covering every mess a user belongs to.
+
+``build_dashboard`` runs a fixed number of grouped queries however many
+messes the user is in. ``get_dashboard`` caches the payload per user and
+month next to version tokens for the user and each of their messes; writes
+call ``touch`` to replace those tokens, so stale entries are simply ignored
+instead of having to be found and deleted.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import OuterRef, Prefetch, Q, Subquery, Sum
+
+from myproject import sharding
+
+from .models import MemberContribution, MemberMealSummary, Membership, MonthlyCalculation
+from .schedules import meal_totals_for
+from .settlement import divide_round, from_paisa, to_paisa
+
+
+def _mess_key(mess_id):
+    return f"dashboard_mess_{mess_id}"
+
+
+def _user_key(user_id):
+    return f"dashboard_user_{user_id}"
+
+
+def _entry_key(user_id, month):
+    return f"dashboard_{user_id}_{month}"
+
+
+def replace_tokens(keys):
+    """Give version tokens new values once the current transaction commits."""
+    if keys:
+        transaction.on_commit(
+            lambda: cache.set_many({key: uuid.uuid4().hex for key in keys}, None), using=sharding.current_db()
+        )
+
+
+def touch(mess_ids=(), user_ids=()):
+    """Invalidate the dashboards a write affects, once its transaction commits."""
+    replace_tokens([_mess_key(mess_id) for mess_id in mess_ids] + [_user_key(user_id) for user_id in user_ids])
+
+
+def current_tokens(keys):
+    """{key: token} for version token keys, creating the missing ones."""
+    tokens = cache.get_many(keys)
+    for key in keys:
+        if key not in tokens:
+            token = uuid.uuid4().hex
+            tokens[key] = token if cache.add(key, token, None) else cache.get(key)
+    return tokens
+
+
+def _money(paisa):
+    return str(from_paisa(paisa))
+
+
+def build_dashboard(user, memberships, month, month_bounds):
+    mess_ids = [membership.mess_id for membership in memberships]
+
+    meals = meal_totals_for(mess_ids, *month_bounds)
+    contributions = {
+        row['mess_id']: row
+        for row in MemberContribution.objects.filter(
+            mess_id__in=mess_ids, month=month
+        ).values('mess_id').annotate(
+            total=Sum('amount'), own=Sum('amount', filter=Q(member_id=user.id))
+        ).order_by()
+    }
+
+    # The latest calculation of each mess, plus this month's (for its extra
+    # cost) when that is an older one
+    latest = MonthlyCalculation.objects.filter(mess_id=OuterRef('mess_id')).order_by('-month').values('id')[:1]
+    calculations, month_calculations = {}, {}
+    for calculation in MonthlyCalculation.objects.filter(
+        Q(id=Subquery(latest)) | Q(month=month), mess_id__in=mess_ids
+    ).order_by('month').prefetch_related(
+        Prefetch('member_summaries', queryset=MemberMealSummary.objects.filter(member_id=user.id),
+                 to_attr='own_summaries')
+    ):
+        calculations[calculation.mess_id] = calculation
+        if calculation.month == month:
+            month_calculations[calculation.mess_id] = calculation
+
+    messes = []
+    for membership in memberships:
+        mess = membership.mess
+        contribution_row = contributions.get(mess.id, {})
+        own_meals = meals[mess.id].get(user.id, 0)
+        total_meals = sum(meals[mess.id].values())
+        own_paid = to_paisa(contribution_row.get('own') or 0)
+        total_paid = to_paisa(contribution_row.get('total') or 0)
+        # Projected as if the month were settled now: bazaar cost so far plus
+        # the extra cost, shared by meals so far. Extra costs are only entered
+        # when a month is calculated, so before that they are left out
+        # (projected_extra_cost is None)
+        month_calculation = month_calculations.get(mess.id)
+        extra_cost = to_paisa(month_calculation.extra_cost) if month_calculation else None
+        total_cost = total_paid + (extra_cost or 0)
+        own_cost = divide_round(total_cost * own_meals, total_meals) if total_meals else 0
+
+        calculation = calculations.get(mess.id)
+        last_calculation = None
+        if calculation is not None:
+            summary = calculation.own_summaries[0] if calculation.own_summaries else None
+            last_calculation = {
+                'month': calculation.month,
+                'total_cost': str(calculation.total_cost),
+                'total_meals': calculation.total_meals,
+                'cost_per_meal': str(calculation.cost_per_meal),
+                'own_meals': summary.total_meals if summary else 0,
+                'own_cost': str(summary.total_cost) if summary else None,
+                'balance': str(summary.balance) if summary else None,
+            }
+
+        messes.append({
+            'id': mess.id,
+            'name': mess.name,
+            'role': membership.role,
+            'member_count': mess.member_count,
+            'meals': own_meals,
+            'mess_meals': total_meals,
+            'contribution': _money(own_paid),
+            'mess_contributions': _money(total_paid),
+            'projected_cost_per_meal': _money(divide_round(total_cost, total_meals) if total_meals else 0),
+            'projected_extra_cost': None if extra_cost is None else _money(extra_cost),
+            'projected_balance': _money(own_paid - own_cost),
+            'last_calculation': last_calculation,
+        })
+    return {'month': month, 'messes': messes}
+
+
+def get_dashboard(user, month, month_bounds):
+    key = _entry_key(user.id, month)
+    entry = cache.get(key)
+    if entry is not None and cache.get_many(list(entry['tokens'])) == entry['tokens']:
+        return entry['data']
+
+    # Tokens are read before the data so a write that lands mid-build
+    # leaves this entry already stale
+    tokens = current_tokens([_user_key(user.id)])
+    # Each shard's memberships are built on that shard, then merged in name order
+    groups = sharding.fan_out(lambda alias: list(
+        Membership.objects.filter(user_id=user.id).select_related('mess').order_by('mess__name', 'mess_id')
+    ))
+    messes = []
+    for memberships in groups:
+        if memberships:
+            tokens.update(current_tokens([_mess_key(membership.mess_id) for membership in memberships]))
+            with sharding.use(memberships[0]._state.db):
+                messes += build_dashboard(user, memberships, month, month_bounds)['messes']
+    if len(groups) > 1:
+        messes.sort(key=lambda mess: (mess['name'], mess['id']))
+    data = {'month': month, 'messes': messes}
+    cache.set(key, {'tokens': tokens, 'data': data}, settings.DASHBOARD_CACHE_TTL)
+    return data
@@ -0,0 +1,132 @@
+"""
+Live mess events for the Server-Sent Events board.
+
+Views call ``publish_on_commit`` after a meal or contribution changes. Events
+are fanned out to subscribers by an in-process ``BroadcastHub``; with
+``MESS_EVENTS_BACKEND = 'postgres'`` they go through ``pg_notify`` instead and
+every worker's listener thread feeds its own hub, so all workers see them.
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from myproject import sharding
+
+logger = logging.getLogger(__name__)
+
+NOTIFY_CHANNEL = 'mess_events'
+
+
+class BroadcastHub:
+    """Fans events out to per-subscriber asyncio queues, keyed by mess id."""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, mess_id):
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self._lock:
+            self._subscribers[mess_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, mess_id, subscriber):
+        with self._lock:
+            self._subscribers[mess_id].discard(subscriber)
+            if not self._subscribers[mess_id]:
+                del self._subscribers[mess_id]
+
+    def dispatch(self, mess_id, event):
+        """Deliver an event to local subscribers; safe to call from any thread."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(mess_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._offer, queue, event)
+
+    @staticmethod
+    def _offer(queue, event):
+        # A client that stopped reading loses old events rather than
+        # growing memory without bound
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+
+hub = BroadcastHub()
+
+
+def _use_postgres():
+    return getattr(settings, 'MESS_EVENTS_BACKEND', 'local') == 'postgres'
+
+
+def publish(mess_id, event):
+    if _use_postgres():
+        payload = json.dumps({'mess_id': mess_id, 'event': event})
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [NOTIFY_CHANNEL, payload])
+    else:
+        hub.dispatch(mess_id, event)
+
+
+def publish_on_commit(mess_id, event):
+    """Publish once the surrounding transaction commits (immediately in autocommit)."""
+    transaction.on_commit(lambda: publish(mess_id, event), using=sharding.current_db())
+
+
+_listener_started = False
+_listener_lock = threading.Lock()
+
+
+def ensure_listener():
+    """Start this process's LISTEN thread once, when the postgres backend is used."""
+    global _listener_started
+    if not _use_postgres() or _listener_started:
+        return
+    with _listener_lock:
+        if _listener_started:
+            return
+        thread = threading.Thread(target=_listen_forever, name='mess-events-listener', daemon=True)
+        thread.start()
+        _listener_started = True
+
+
+def reset_after_fork():
+    """In a freshly forked worker: the parent's listener thread did not come along."""
+    global _listener_started, _listener_lock
+    _listener_started = False
+    _listener_lock = threading.Lock()
+
+
+def _listen_forever():
+    import psycopg2
+    from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+    db = settings.DATABASES['default']
+    while True:
+        try:
+            conn = psycopg2.connect(
+                dbname=db['NAME'], user=db['USER'], password=db['PASSWORD'],
+                host=db['HOST'], port=db['PORT'],
+            )
+            conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    message = json.loads(notify.payload)
+                    hub.dispatch(message['mess_id'], message['event'])
+        except Exception:
+            logger.exception("Mess events listener lost its connection, reconnecting")
+            threading.Event().wait(5)
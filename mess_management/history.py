@@ -0,0 +1,86 @@
+"""
+Change history for meals and contributions.
+
+Write paths already know a row's previous value (they read it to decide
+between insert, update and delete), so each change costs one extra INSERT:
+callers collect ``meal_change``/``contribution_change`` entries and pass
+them to ``record``, which writes them with a single bulk_create inside the
+caller's transaction and skips no-op changes.
+"""
+from collections import defaultdict
+
+from myproject import sharding
+
+from .models import CHANGE_CONTRIBUTION, CHANGE_MEAL, ChangeLogEntry
+
+MAX_PAGE = 200
+
+
+def meal_change(mess_id, member_id, day, old, new, changed_by):
+    """Entry for a stored meal count going from ``old`` to ``new`` (None = no row)."""
+    return ChangeLogEntry(
+        mess_id=mess_id, kind=CHANGE_MEAL, member_id=member_id, month=day.strftime('%Y-%m'), day=day,
+        old_value=old, new_value=new, changed_by=changed_by,
+    )
+
+
+def contribution_change(mess_id, member_id, month, old, new, changed_by):
+    return ChangeLogEntry(
+        mess_id=mess_id, kind=CHANGE_CONTRIBUTION, member_id=member_id, month=month,
+        old_value=old, new_value=new, changed_by=changed_by,
+    )
+
+
+def record(entries):
+    """Insert the entries whose value actually changed, in one statement."""
+    changed = [entry for entry in entries if entry.old_value != entry.new_value]
+    if changed:
+        ChangeLogEntry.objects.bulk_create(changed)
+    return len(changed)
+
+
+def page(mess_id, before=None, limit=50, kind=None, member_id=None, month=None):
+    """
+    (entries, next_before): up to ``limit`` entries newest first, older than
+    id ``before``. Keyset pagination on the id, so deep pages cost the same
+    as the first one.
+    """
+    entries = ChangeLogEntry.objects.filter(mess_id=mess_id)
+    if before is not None:
+        entries = entries.filter(id__lt=before)
+    if kind:
+        entries = entries.filter(kind=kind)
+    if member_id:
+        entries = entries.filter(member_id=member_id)
+    if month:
+        entries = entries.filter(month=month)
+    limit = max(1, min(limit, MAX_PAGE))
+    rows = list(entries.select_related('member', 'changed_by').order_by('-id')[:limit + 1])
+    next_before = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_before
+
+
+def compact(mess_id, month):
+    """
+    Fold a month's entries down to one per member and day (or member, for
+    contributions): the newest entry is kept with the oldest ``old_value``
+    and the total ``changes``; the rest are deleted. Returns entries removed.
+    """
+    with sharding.atomic(mess_id):
+        groups = defaultdict(list)
+        for entry in ChangeLogEntry.objects.select_for_update().filter(mess_id=mess_id, month=month).order_by('id'):
+            groups[(entry.kind, entry.member_id, entry.day)].append(entry)
+
+        kept, removed = [], []
+        for entries in groups.values():
+            if len(entries) < 2:
+                continue
+            newest = entries[-1]
+            newest.old_value = entries[0].old_value
+            newest.changes = sum(entry.changes for entry in entries)
+            kept.append(newest)
+            removed.extend(entry.id for entry in entries[:-1])
+
+        ChangeLogEntry.objects.bulk_update(kept, ['old_value', 'changes'])
+        ChangeLogEntry.objects.filter(id__in=removed).delete()
+    return len(removed)
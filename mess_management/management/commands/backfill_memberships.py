@@ -0,0 +1,77 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from mess_management.models import (
+    MANAGER_ROLES, ROLE_MANAGER, ROLE_MEMBER, ROLE_OWNER, Membership, Mess, _invalidate_caches,
+)
+from myproject import sharding
+
+# A user listed in several places keeps the strongest role
+ROLE_RANK = {ROLE_MEMBER: 0, ROLE_MANAGER: 1, ROLE_OWNER: 2}
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the old Mess.members/Mess.managers join tables into Membership rows and '
+        'recount member_count/manager_count (run once after deploying Membership; safe to re-run)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members-table', default='messes_members')
+        parser.add_argument('--managers-table', default='messes_managers')
+
+    def handle(self, *args, **options):
+        results = sharding.fan_out(lambda alias: self.backfill(alias, options))
+        created = sum(created for created, _, _ in results)
+        promoted = sum(promoted for _, promoted, _ in results)
+        recounted = sum(recounted for _, _, recounted in results)
+        self.stdout.write(
+            f"Created {created} memberships, promoted {promoted}, recounted {recounted} messes"
+        )
+
+    def backfill(self, alias, options):
+        connection = connections[alias]
+        tables = set(connection.introspection.table_names())
+        with transaction.atomic(using=alias):
+            # Lock the messes so the counters can't move under the recount
+            owners = dict(Mess.objects.select_for_update().values_list('id', 'owner_id'))
+            wanted = {(mess_id, owner_id): ROLE_OWNER for mess_id, owner_id in owners.items()}
+            for table, role in ((options['members_table'], ROLE_MEMBER), (options['managers_table'], ROLE_MANAGER)):
+                if table not in tables:
+                    continue
+                with connection.cursor() as cursor:
+                    cursor.execute(f"SELECT mess_id, user_id FROM {connection.ops.quote_name(table)}")
+                    for mess_id, user_id in cursor.fetchall():
+                        key = (mess_id, user_id)
+                        if mess_id in owners and ROLE_RANK[role] > ROLE_RANK.get(wanted.get(key), -1):
+                            wanted[key] = role
+
+            existing = {
+                (mess_id, user_id): role
+                for mess_id, user_id, role in Membership.objects.values_list('mess_id', 'user_id', 'role')
+            }
+            # Counters are recounted below, so the bulk paths are fine here
+            missing = [key for key in wanted if key not in existing]
+            Membership.objects.bulk_create([
+                Membership(mess_id=mess_id, user_id=user_id, role=wanted[mess_id, user_id])
+                for mess_id, user_id in missing
+            ], batch_size=1000)
+            promoted = [
+                key for key, role in existing.items()
+                if key in wanted and ROLE_RANK[wanted[key]] > ROLE_RANK[role]
+            ]
+            for mess_id, user_id in promoted:
+                Membership.objects.filter(mess_id=mess_id, user_id=user_id).update(role=wanted[mess_id, user_id])
+
+            counts = Membership.objects.filter(mess_id=OuterRef('pk')).values('mess_id')
+            recounted = Mess.objects.update(
+                member_count=Coalesce(Subquery(counts.annotate(n=Count('pk')).values('n')), Value(0)),
+                manager_count=Coalesce(Subquery(
+                    counts.annotate(n=Count('pk', filter=Q(role__in=MANAGER_ROLES))).values('n')
+                ), Value(0)),
+            )
+            # Cached payloads carry the counts, member lists carry the new rows
+            _invalidate_caches(list(owners), sorted({user_id for _, user_id in missing + promoted}))
+        return len(missing), len(promoted), recounted
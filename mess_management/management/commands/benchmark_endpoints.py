@@ -0,0 +1,338 @@
+import calendar
+import json
+import math
+import platform
+import subprocess
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import date, datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework.throttling import SimpleRateThrottle
+
+from accounts.authentication import issue_tokens
+from mess_management import matrix
+from mess_management.models import Mess, MemberRequest
+
+User = get_user_model()
+
+# Endpoints that revoke the caller's tokens get fresh ones before every request
+REISSUE_TOKENS = ('auth.refresh', 'auth.logout', 'auth.logout_all')
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, queries=None, elapsed=None, statuses=None):
+    values = sorted(latencies)
+    statuses = list(statuses or ())
+    summary = {
+        'requests': len(values),
+        'mean_ms': round(sum(values) / len(values), 3) if values else None,
+        'p50_ms': round(percentile(values, 50), 3) if values else None,
+        'p95_ms': round(percentile(values, 95), 3) if values else None,
+        'p99_ms': round(percentile(values, 99), 3) if values else None,
+        'throughput_rps': round(len(values) / elapsed, 1) if elapsed else None,
+        'status_codes': dict(sorted(Counter(statuses).items())),
+        # Timings of error responses don't measure the endpoint
+        'failed': sum(1 for code in statuses if not 200 <= code < 300),
+    }
+    if queries is not None:
+        summary['queries_per_request'] = round(sum(queries) / len(queries), 2) if queries else None
+    return summary
+
+
+@contextmanager
+def throttles_disabled():
+    original = SimpleRateThrottle.THROTTLE_RATES
+    SimpleRateThrottle.THROTTLE_RATES = {scope: None for scope in original}
+    try:
+        yield
+    finally:
+        SimpleRateThrottle.THROTTLE_RATES = original
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark every API endpoint through the Django test client (inside a '
+        'rolled-back transaction) and optionally against a running server, '
+        'writing latency percentiles, queries per request and throughput as JSON'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Requests per endpoint')
+        parser.add_argument('--mess-id', type=int, help='Mess to benchmark (default: the one with most members)')
+        parser.add_argument('--month', help='YYYY-MM (default: current month)')
+        parser.add_argument('--password', default='synthetic-pass-123', help='Password of the seeded users')
+        parser.add_argument('--only', nargs='*', help='Only run endpoints whose name contains one of these')
+        parser.add_argument('--url', help='Also load test a running server, e.g. http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of HTTP load per endpoint')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+        parser.add_argument('--compare', help='Previous JSON report to print deltas against')
+
+    def handle(self, *args, **options):
+        if options['mess_id']:
+            mess = Mess.objects.filter(id=options['mess_id']).first()
+        else:
+            mess = Mess.objects.order_by('-member_count', 'id').first()
+        if mess is None:
+            raise CommandError('No mess found; run seed_synthetic_data first')
+        month = options['month'] or date.today().strftime('%Y-%m')
+
+        report = {
+            'meta': {
+                'revision': git_revision(),
+                'timestamp': datetime.now(tz=timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'mess_id': mess.id,
+                'members': mess.member_count,
+                'month': month,
+                'requests_per_endpoint': options['requests'],
+            },
+            'endpoints': self.run_test_client(mess, month, options),
+        }
+        if options['url']:
+            report['http'] = self.run_http(mess, month, options)
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(f"Report written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                self.print_comparison(json.load(f), report)
+
+        failed = sorted(
+            f"{section}/{name}" for section in ('endpoints', 'http')
+            for name, summary in report.get(section, {}).items() if summary['failed']
+        )
+        if failed:
+            raise CommandError(f"Non-2xx responses from: {', '.join(failed)}")
+
+    def endpoint_cases(self, mess, month, owner, outsiders, member, applicant_requests):
+        base = f"/api/mess/{mess.id}"
+        member_phones = iter(u.phone for u in outsiders)
+        bulk_phones = [u.phone for u in outsiders[:20]]
+        contributions = [{'member_id': member.id, 'amount': '1000'}, {'member_id': owner.id, 'amount': '500'}]
+        days = calendar.monthrange(*map(int, month.split('-')))[1]
+        member_request = applicant_requests[0]
+        return [
+            ('auth.signup', 'post', '/api/auth/signup/', lambda i: {
+                'email': f"bench{i}@example.com", 'first_name': 'Bench', 'last_name': 'User',
+                'phone': f"98{i:011d}", 'password': 'bench-pass-123', 'confirm_password': 'bench-pass-123',
+            }),
+            ('auth.signin', 'post', '/api/auth/signin/', lambda i: {'email': owner.email, 'password': self.password}),
+            ('auth.refresh', 'post', '/api/auth/refresh/', None),
+            ('auth.manage_users', 'get', '/api/auth/manage-users/', None),
+            ('mess.list', 'get', '/api/mess/', None),
+            ('mess.dashboard', 'get', '/api/mess/dashboard/', None),
+            ('mess.create', 'post', '/api/mess/', lambda i: {'name': f"Bench {i}", 'description': ''}),
+            ('mess.retrieve', 'get', f"{base}/", None),
+            ('mess.add_member', 'post', f"{base}/add_member/", lambda i: {'phone': next(member_phones)}),
+            ('mess.add_manager', 'post', f"{base}/add_manager/", lambda i: {'user_id': member.id}),
+            ('mess.bulk_add_members', 'post', f"{base}/bulk_add_members/", lambda i: {'phones': bulk_phones}),
+            ('mess.bulk_remove_members', 'post', f"{base}/bulk_remove_members/", lambda i: {
+                'user_ids': [u.id for u in outsiders[:20]],
+            }),
+            ('mess.bulk_add_managers', 'post', f"{base}/bulk_add_managers/", lambda i: {'user_ids': [member.id]}),
+            ('mess.bulk_remove_managers', 'post', f"{base}/bulk_remove_managers/", lambda i: {
+                'user_ids': [member.id],
+            }),
+            ('meals.add', 'post', f"{base}/meals/", lambda i: {
+                'date': f"{month}-{i % 28 + 1:02d}", 'member_id': member.id, 'meal_count': i % 4,
+            }),
+            ('meals.list', 'get', f"{base}/meals/{month}/", None),
+            ('meals.matrix', 'get', f"{base}/meals/{month}/matrix/", None),
+            ('meals.matrix_write', 'post', f"{base}/meals/{month}/matrix/", lambda i: {
+                'members': [member.id], 'cells': matrix.pack(bytes([i % 4]) * days),
+            }),
+            ('schedules.list', 'get', f"{base}/schedules/", None),
+            ('schedules.set', 'post', f"{base}/schedules/", lambda i: {
+                'member_id': member.id, 'starts_on': f"{month}-01", 'weekday_meals': [i % 4] * 5 + [0, 0],
+            }),
+            ('calculation.calculate', 'post', f"{base}/calculate/{month}/", lambda i: {
+                'extra_cost': '250', 'member_contributions': contributions,
+            }),
+            ('calculation.simulate', 'post', f"{base}/calculate/{month}/simulate/", lambda i: {
+                'scenarios': [{'extra_cost': '250'}, {'extra_cost': str(i), 'member_contributions': contributions}],
+            }),
+            ('calculation.get', 'get', f"{base}/calculation/{month}/", None),
+            ('calculation.settlement', 'get', f"{base}/settlement/{month}/", None),
+            ('contributions.list', 'get', f"{base}/contributions/{month}/", None),
+            ('contributions.add', 'post', f"{base}/contributions/{month}/", lambda i: {
+                'member_id': member.id, 'month': month, 'amount': str(100 + i),
+            }),
+            ('history.list', 'get', f"{base}/history/", None),
+            ('members.become_member', 'post', '/api/members/become-member/', lambda i: {
+                'first_name': 'Bench', 'last_name': 'User', 'email': owner.email,
+                'phone': owner.phone, 'tran_id': f"TX{i}", 'description': '',
+            }),
+            ('members.my_requests', 'get', '/api/members/become-member/', None),
+            ('members.all_requests', 'get', '/api/members/all-requests/', None),
+            ('members.approve', 'patch', f"/api/members/request/{member_request.id}/approve/", lambda i: {
+                'status': 'Approved' if i % 2 else 'Pending',
+            }),
+            ('members.bulk_decide', 'post', '/api/members/requests/bulk/', lambda i: {
+                'ids': [r.id for r in applicant_requests[1 + i % 5::5]], 'status': 'Rejected',
+            }),
+            ('auth.logout', 'post', '/api/auth/logout/', None),
+            ('auth.logout_all', 'post', '/api/auth/logout-all/', None),
+        ]
+
+    def run_test_client(self, mess, month, options):
+        self.password = options['password']
+        results = {}
+        requests = options['requests']
+        with throttles_disabled(), transaction.atomic():
+            owner = mess.owner
+            member = User.objects.filter(memberships__mess=mess).exclude(id=owner.id).first() or owner
+            outsiders = User.objects.bulk_create([
+                User(username=f"outsider{i}@example.com", email=f"outsider{i}@example.com",
+                     phone=f"97{i:011d}", first_name='Out', last_name='Sider')
+                for i in range(requests)
+            ])
+            # Deciding a request revokes its user's tokens, so the requests
+            # belong to an applicant rather than the user making the calls
+            applicant = outsiders[0]
+            applicant_requests = MemberRequest.objects.bulk_create([
+                MemberRequest(
+                    user=applicant, first_name=applicant.first_name, last_name=applicant.last_name,
+                    email=applicant.email, phone=applicant.phone, tran_id=f"BENCH{i}",
+                )
+                for i in range(requests + 1)
+            ])
+
+            # manage_users is Super_Admin only
+            owner.groups.add(Group.objects.get_or_create(name='Super_Admin')[0])
+
+            client = APIClient()
+
+            def authenticate():
+                # Tokens carry the version they were issued at
+                owner.refresh_from_db(fields=['token_version'])
+                refresh = issue_tokens(owner)
+                client.credentials(HTTP_AUTHORIZATION=f"Bearer {refresh.access_token}")
+                client.cookies['refresh_token'] = str(refresh)
+
+            authenticate()
+            cases = self.endpoint_cases(mess, month, owner, outsiders, member, applicant_requests)
+            for name, method, path, body in cases:
+                if options['only'] and not any(part in name for part in options['only']):
+                    continue
+                latencies, queries, statuses = [], [], []
+                started = time.perf_counter()
+                for i in range(requests):
+                    if name in REISSUE_TOKENS:
+                        authenticate()
+                    data = body(i) if body else None
+                    with CaptureQueriesContext(connection) as captured:
+                        t0 = time.perf_counter()
+                        response = getattr(client, method)(path, data, format='json')
+                        latencies.append((time.perf_counter() - t0) * 1000)
+                    queries.append(len(captured))
+                    statuses.append(response.status_code)
+                results[name] = summarize(latencies, queries, time.perf_counter() - started, statuses)
+                line = (f"{name}: p50 {results[name]['p50_ms']} ms, "
+                        f"{results[name]['queries_per_request']} queries")
+                if results[name]['failed']:
+                    line = self.style.ERROR(f"{line}, {results[name]['failed']} non-2xx {results[name]['status_codes']}")
+                self.stderr.write(line)
+
+            transaction.set_rollback(True)
+        return results
+
+    def run_http(self, mess, month, options):
+        """Concurrent GET load against a live server using only the stdlib."""
+        base_url = options['url'].rstrip('/')
+        signin = urllib.request.Request(
+            f"{base_url}/api/auth/signin/",
+            data=json.dumps({'email': mess.owner.email, 'password': options['password']}).encode(),
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(signin) as response:
+            token = json.load(response)['access_token']
+        headers = {'Authorization': f"Bearer {token}"}
+
+        paths = {
+            'mess.list': '/api/mess/',
+            'mess.retrieve': f"/api/mess/{mess.id}/",
+            'meals.list': f"/api/mess/{mess.id}/meals/{month}/",
+            'calculation.get': f"/api/mess/{mess.id}/calculation/{month}/",
+            'contributions.list': f"/api/mess/{mess.id}/contributions/{month}/",
+        }
+
+        def fetch(url):
+            t0 = time.perf_counter()
+            try:
+                with urllib.request.urlopen(urllib.request.Request(url, headers=headers)) as response:
+                    response.read()
+                    code = response.status
+            except urllib.error.HTTPError as exc:
+                code = exc.code
+            return (time.perf_counter() - t0) * 1000, code
+
+        results = {}
+        for name, path in paths.items():
+            if options['only'] and not any(part in name for part in options['only']):
+                continue
+            url = base_url + path
+            deadline = time.perf_counter() + options['duration']
+            latencies, statuses = [], []
+
+            def worker():
+                samples = []
+                while time.perf_counter() < deadline:
+                    samples.append(fetch(url))
+                return samples
+
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                for samples in pool.map(lambda _: worker(), range(options['concurrency'])):
+                    for latency, code in samples:
+                        latencies.append(latency)
+                        statuses.append(code)
+            results[name] = summarize(latencies, elapsed=time.perf_counter() - started, statuses=statuses)
+            results[name]['concurrency'] = options['concurrency']
+        return results
+
+    def print_comparison(self, old, new):
+        self.stdout.write(f"\nChange vs {old['meta'].get('revision')}:")
+        for section in ('endpoints', 'http'):
+            for name, current in new.get(section, {}).items():
+                previous = old.get(section, {}).get(name)
+                if not previous or not previous.get('p50_ms') or not current.get('p50_ms'):
+                    continue
+                change = (current['p50_ms'] - previous['p50_ms']) / previous['p50_ms'] * 100
+                line = f"  {section}/{name}: p50 {previous['p50_ms']} -> {current['p50_ms']} ms ({change:+.1f}%)"
+                if 'queries_per_request' in current and 'queries_per_request' in previous:
+                    line += f", queries {previous['queries_per_request']} -> {current['queries_per_request']}"
+                self.stdout.write(line)
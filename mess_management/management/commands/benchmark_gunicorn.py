@@ -0,0 +1,165 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mess_management.management.commands.benchmark_endpoints import Command as EndpointBenchmark
+from mess_management.models import Mess
+
+# Environment for gunicorn.conf.py per profile; 'sync' is the old setup
+# (sync workers, no preload, no recycling) for comparison
+PROFILES = {
+    'sync': {'GUNICORN_WORKER_CLASS': 'sync', 'GUNICORN_PRELOAD': 'false', 'GUNICORN_MAX_REQUESTS': '0'},
+    'gthread': {'GUNICORN_WORKER_CLASS': 'gthread'},
+    'gthread-no-preload': {'GUNICORN_WORKER_CLASS': 'gthread', 'GUNICORN_PRELOAD': 'false'},
+    'uvicorn': {'GUNICORN_WORKER_CLASS': 'uvicorn'},
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def tree_rss_mb(pid):
+    """Resident memory of a process and its children (Linux /proc), or None."""
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as status:
+                for line in status:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as children:
+                pending.extend(int(child) for child in children.read().split())
+    except OSError:
+        return None
+    return round(total / 1024, 1)
+
+
+class Command(BaseCommand):
+    help = (
+        'Start gunicorn with each gunicorn.conf.py profile against the current '
+        'database (e.g. after seed_synthetic_data) and compare startup time, '
+        'memory and HTTP latency/throughput'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='*', default=list(PROFILES), choices=list(PROFILES))
+        parser.add_argument('--workers', type=int, help='Same worker count for every profile (default: heuristic)')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds of load per endpoint')
+        parser.add_argument('--mess-id', type=int)
+        parser.add_argument('--month', help='YYYY-MM (default: current month)')
+        parser.add_argument('--password', default='synthetic-pass-123', help='Password of the seeded users')
+        parser.add_argument('--only', nargs='*', help='Only load endpoints whose name contains one of these')
+        parser.add_argument('--startup-timeout', type=float, default=60.0)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['mess_id']:
+            mess = Mess.objects.filter(id=options['mess_id']).first()
+        else:
+            mess = Mess.objects.order_by('-member_count', 'id').first()
+        if mess is None:
+            raise CommandError('No mess found; run seed_synthetic_data first')
+        month = options['month'] or date.today().strftime('%Y-%m')
+
+        report = {'meta': {'mess_id': mess.id, 'members': mess.member_count, 'month': month,
+                           'concurrency': options['concurrency'], 'duration': options['duration']},
+                  'profiles': {}}
+        for profile in options['profiles']:
+            self.stderr.write(f"== {profile}")
+            result = self.run_profile(profile, mess, month, options)
+            if result is not None:
+                report['profiles'][profile] = result
+
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+        self.print_summary(report['profiles'])
+
+    def run_profile(self, profile, mess, month, options):
+        if profile == 'uvicorn':
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                self.stderr.write('   skipped: uvicorn is not installed')
+                return None
+
+        port = free_port()
+        env = {**os.environ, **PROFILES[profile], 'GUNICORN_BIND': f"127.0.0.1:{port}",
+               'GUNICORN_ACCESS_LOG': '', 'DJANGO_PROFILE': 'web'}
+        if options['workers']:
+            env['GUNICORN_WORKERS'] = str(options['workers'])
+        # Throttles would turn a load test into a 429 test
+        env.setdefault('THROTTLE_SIGNIN', '10000/min')
+        env.setdefault('THROTTLE_SIGNIN_EMAIL', '10000/min')
+
+        log = tempfile.TemporaryFile(mode='w+')
+        started = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', str(settings.BASE_DIR / 'gunicorn.conf.py')],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log, text=True,
+        )
+        try:
+            ready_s = self.wait_until_ready(server, port, log, options['startup_timeout'])
+            idle_rss = tree_rss_mb(server.pid)
+            bench = EndpointBenchmark(stdout=self.stdout, stderr=self.stderr)
+            http = bench.run_http(mess, month, {**options, 'url': f"http://127.0.0.1:{port}"})
+            return {
+                'ready_s': round(ready_s - started, 2),
+                'rss_idle_mb': idle_rss,
+                'rss_loaded_mb': tree_rss_mb(server.pid),
+                'env': PROFILES[profile],
+                'http': http,
+            }
+        finally:
+            server.send_signal(signal.SIGTERM)
+            try:
+                server.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.kill()
+            log.close()
+
+    def wait_until_ready(self, server, port, log, timeout):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            if server.poll() is not None:
+                log.seek(0)
+                raise CommandError(f"gunicorn exited:\n{log.read()[-2000:]}")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/api/", timeout=1)
+                return time.perf_counter()
+            except urllib.error.HTTPError:
+                # Any HTTP answer (401 here) means a worker is serving
+                return time.perf_counter()
+            except OSError:
+                time.sleep(0.05)
+        raise CommandError(f"gunicorn did not answer within {timeout}s")
+
+    def print_summary(self, profiles):
+        self.stderr.write('')
+        for profile, result in profiles.items():
+            throughput = sum(r['throughput_rps'] or 0 for r in result['http'].values())
+            p95 = max((r['p95_ms'] or 0 for r in result['http'].values()), default=0)
+            self.stderr.write(
+                f"{profile:>20}: ready {result['ready_s']} s, RSS {result['rss_idle_mb']} -> "
+                f"{result['rss_loaded_mb']} MB, {throughput:.0f} req/s summed, worst p95 {p95} ms"
+            )
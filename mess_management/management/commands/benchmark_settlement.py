@@ -0,0 +1,75 @@
+import random
+import timeit
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from mess_management.settlement import settle, settle_many, to_paisa
+
+
+def decimal_settle(member_meals, contributions, extra_cost):
+    """The previous Decimal-based calculate_month math, kept for comparison."""
+    total_cost = sum(Decimal(amount) for amount in contributions.values()) + Decimal(extra_cost)
+    total_meals = sum(member_meals.values())
+    cost_per_meal = (total_cost / total_meals) if total_meals > 0 else Decimal("0")
+    balances = {}
+    for member_id, meals in member_meals.items():
+        member_cost = meals * cost_per_meal
+        balances[member_id] = Decimal(contributions.get(member_id, 0)) - member_cost
+    return balances
+
+
+class Command(BaseCommand):
+    help = 'Microbenchmark the integer settlement engine against the old Decimal path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=50)
+        parser.add_argument('--repeat', type=int, default=2000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--scenarios', type=int, default=20, help='What-if scenarios per simulate call')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        members = range(1, options['members'] + 1)
+        member_meals = {m: rng.randint(0, 93) for m in members}
+        raw_contributions = {m: f"{rng.randint(0, 500000) / 100:.2f}" for m in members}
+        raw_extra = f"{rng.randint(0, 100000) / 100:.2f}"
+
+        def run_decimal():
+            decimal_settle(member_meals, raw_contributions, raw_extra)
+
+        def run_integer():
+            contributions = {m: to_paisa(amount) for m, amount in raw_contributions.items()}
+            settle(member_meals, contributions, to_paisa(raw_extra))
+
+        repeat = options['repeat']
+        decimal_time = timeit.timeit(run_decimal, number=repeat)
+        integer_time = timeit.timeit(run_integer, number=repeat)
+
+        result = settle(
+            member_meals,
+            {m: to_paisa(amount) for m, amount in raw_contributions.items()},
+            to_paisa(raw_extra),
+        )
+        drift = sum(result.member_costs.values()) - result.total_cost
+
+        self.stdout.write(f"members={options['members']} repeat={repeat}")
+        self.stdout.write(f"decimal: {decimal_time / repeat * 1e6:.1f} us/call")
+        self.stdout.write(f"integer: {integer_time / repeat * 1e6:.1f} us/call")
+        self.stdout.write(f"integer cost drift: {drift} paisa")
+
+        # A simulate request: the same meals under varying extra costs and contributions
+        contributions = {m: to_paisa(amount) for m, amount in raw_contributions.items()}
+        scenarios = [
+            (contributions if i % 2 else {m: paisa + i * 100 for m, paisa in contributions.items()}, i * 5000)
+            for i in range(options['scenarios'])
+        ]
+        simulate_repeat = max(1, repeat // options['scenarios'])
+        one_by_one = timeit.timeit(
+            lambda: [settle(member_meals, c, extra) for c, extra in scenarios], number=simulate_repeat
+        )
+        batched = timeit.timeit(lambda: settle_many(member_meals, scenarios), number=simulate_repeat)
+        self.stdout.write(
+            f"{options['scenarios']} scenarios: settle each {one_by_one / simulate_repeat * 1e3:.2f} ms, "
+            f"settle_many {batched / simulate_repeat * 1e3:.2f} ms"
+        )
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import statistics
+import tempfile
+import timeit
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from mess_management.management.commands.benchmark_endpoints import Command as EndpointBenchmark
+from mess_management.models import Mess
+from myproject import tracing
+
+# TRACING_FILE / TRACING_SAMPLE_RATE per mode; None means the trace file
+MODES = {
+    'off': ('', 1.0),
+    'unsampled': (None, 0.0),
+    'sampled': (None, 1.0),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the cost of request tracing: every endpoint through the test '
+        'client with tracing off, on but unsampled, and sampling every request, '
+        'plus the per-call cost of the disabled span/traced hooks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=30, help='Requests per endpoint per round')
+        parser.add_argument('--rounds', type=int, default=3, help='Rounds of all modes, interleaved against drift')
+        parser.add_argument('--mess-id', type=int)
+        parser.add_argument('--month', help='YYYY-MM (default: current month)')
+        parser.add_argument('--password', default='synthetic-pass-123', help='Password of the seeded users')
+        parser.add_argument('--only', nargs='*', help='Only run endpoints whose name contains one of these')
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['mess_id']:
+            mess = Mess.objects.filter(id=options['mess_id']).first()
+        else:
+            mess = Mess.objects.order_by('-member_count', 'id').first()
+        if mess is None:
+            raise CommandError('No mess found; run seed_synthetic_data first')
+        month = options['month'] or date.today().strftime('%Y-%m')
+
+        fd, trace_file = tempfile.mkstemp(suffix='.jsonl')
+        os.close(fd)
+        p50s = {mode: {} for mode in MODES}
+        try:
+            for round_number in range(options['rounds']):
+                for mode, (path, sample_rate) in MODES.items():
+                    self.stderr.write(f"round {round_number + 1}: {mode}")
+                    with override_settings(TRACING_FILE=trace_file if path is None else path,
+                                           TRACING_SAMPLE_RATE=sample_rate):
+                        results = EndpointBenchmark(stdout=io.StringIO(), stderr=io.StringIO()).run_test_client(
+                            mess, month, options
+                        )
+                    for name, result in results.items():
+                        p50s[mode].setdefault(name, []).append(result['p50_ms'])
+            with open(trace_file) as f:
+                spans = sum(1 for _ in f)
+            trace_bytes = os.path.getsize(trace_file)
+        finally:
+            os.unlink(trace_file)
+
+        endpoints = {}
+        for name, baseline in p50s['off'].items():
+            off = statistics.median(baseline)
+            endpoints[name] = {'off_p50_ms': round(off, 3)}
+            for mode in ('unsampled', 'sampled'):
+                value = statistics.median(p50s[mode][name])
+                endpoints[name][f"{mode}_p50_ms"] = round(value, 3)
+                endpoints[name][f"{mode}_overhead_pct"] = round((value - off) / off * 100, 1) if off else None
+
+        sampled_requests = options['rounds'] * options['requests'] * len(endpoints)
+        report = {
+            'meta': {'mess_id': mess.id, 'members': mess.member_count, 'month': month,
+                     'requests_per_endpoint': options['requests'], 'rounds': options['rounds']},
+            'disabled_hooks_ns': self.hook_costs(),
+            'endpoints': endpoints,
+            'trace_output': {
+                'spans_per_request': round(spans / sampled_requests, 1) if sampled_requests else None,
+                'bytes_per_request': round(trace_bytes / sampled_requests) if sampled_requests else None,
+            },
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        for mode in ('unsampled', 'sampled'):
+            overheads = [e[f"{mode}_overhead_pct"] for e in endpoints.values() if e[f"{mode}_overhead_pct"] is not None]
+            if overheads:
+                self.stderr.write(f"{mode}: median p50 overhead {statistics.median(overheads):+.1f}% "
+                                  f"across {len(overheads)} endpoints")
+        hooks = report['disabled_hooks_ns']
+        self.stderr.write(f"disabled hooks: span {hooks['span']} ns, traced {hooks['traced']} ns per call")
+
+    def hook_costs(self, number=200000):
+        """Nanoseconds per call the hooks add outside a traced request."""
+        def bare():
+            return None
+        wrapped = tracing.traced('benchmark')(bare)
+
+        def with_span():
+            with tracing.span('benchmark'):
+                pass
+
+        def per_call(func):
+            return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e9
+
+        baseline = per_call(bare)
+        return {
+            'span': round(per_call(with_span) - baseline, 1),
+            'traced': round(per_call(wrapped) - baseline, 1),
+        }
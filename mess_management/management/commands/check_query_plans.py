@@ -0,0 +1,61 @@
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Sum
+
+from mess_management.models import Mess, Meal, MemberContribution, MemberRequest
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN the hot queries on the current (seeded) database and fail if '
+        'any of them does not use the index added for it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def plan_cases(self):
+        mess = Mess.objects.order_by('id').first()
+        user = User.objects.order_by('id').first()
+        if mess is None or user is None:
+            raise CommandError('Database is empty; run seed_synthetic_data first')
+        start = date.today().replace(day=1)
+        end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+        month = start.strftime('%Y-%m')
+        return [
+            ('member_req_user_created_idx',
+             MemberRequest.objects.filter(user=user).order_by('-created_at')),
+            ('member_req_pending_idx',
+             MemberRequest.objects.filter(status='Pending').order_by('-created_at')),
+            ('meal_mess_date_idx',
+             Meal.objects.filter(mess=mess, date__gte=start, date__lt=end)
+             .values('member').annotate(total_meals=Sum('meal_count'))),
+            ('contrib_mess_month_idx',
+             MemberContribution.objects.filter(mess=mess, month=month)),
+            ('users_email_idx',
+             User.objects.filter(email=user.email)),
+        ]
+
+    def handle(self, *args, **options):
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Small or freshly seeded tables make sequential scans look
+                # cheapest; this checks the index is usable for the query shape
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for index_name, queryset in self.plan_cases():
+                plan = queryset.explain()
+                used = index_name in plan
+                self.stdout.write(f"{'ok  ' if used else 'FAIL'} {index_name}")
+                if options['verbose_plans'] or not used:
+                    self.stdout.write('    ' + plan.replace('\n', '\n    '))
+                if not used:
+                    failures.append(index_name)
+        if failures:
+            raise CommandError(f"Indexes not used: {', '.join(failures)}")
@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from mess_management import history
+from mess_management.models import ChangeLogEntry, MonthlyCalculation
+from myproject import sharding
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold the change log of closed months (calculated, and before the current month) '
+        'down to one entry per member and day (run periodically, e.g. from cron)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='YYYY-MM: compact every month before this one, calculated or not')
+        parser.add_argument('--mess-id', type=int)
+
+    def handle(self, *args, **options):
+        if options['before']:
+            try:
+                datetime.strptime(options['before'], '%Y-%m')
+            except ValueError:
+                raise CommandError('--before must be YYYY-MM')
+        # Every shard's closed months
+        closed = [
+            pair for pairs in sharding.fan_out(lambda alias: self.closed_months(options)) for pair in pairs
+        ]
+        removed = 0
+        for mess_id, month in closed:
+            removed += history.compact(mess_id, month)
+        self.stdout.write(f"Compacted {len(closed)} mess months, removed {removed} change log entries")
+
+    def closed_months(self, options):
+        if options['before']:
+            months = ChangeLogEntry.objects.filter(month__lt=options['before'])
+        else:
+            months = MonthlyCalculation.objects.filter(month__lt=timezone.localdate().strftime('%Y-%m'))
+        if options['mess_id']:
+            months = months.filter(mess_id=options['mess_id'])
+        return list(months.values_list('mess_id', 'month').distinct().order_by('mess_id', 'month'))
@@ -0,0 +1,118 @@
+import random
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mess_management.models import Mess, Meal, MemberContribution, Membership, ROLE_MEMBER, ROLE_OWNER
+
+User = get_user_model()
+
+
+def recent_months(count, today=None):
+    """The last ``count`` months as (year, month), oldest first, ending with the current one."""
+    today = today or date.today()
+    year, month = today.year, today.month
+    months = []
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return list(reversed(months))
+
+
+def month_days(year, month):
+    day = date(year, month, 1)
+    while day.month == month:
+        yield day
+        day += timedelta(days=1)
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic users, messes, meals and contributions for benchmarking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--messes', type=int, default=20)
+        parser.add_argument('--months', type=int, default=3)
+        parser.add_argument('--messes-per-user', type=int, default=2,
+                            help='Upper bound on how many messes one user joins (membership overlap)')
+        parser.add_argument('--password', default='synthetic-pass-123')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        # Users: hash the shared password once instead of per user
+        password = make_password(options['password'])
+        offset = User.objects.count()
+        users = User.objects.bulk_create([
+            User(
+                username=f"synthetic{offset + i}@example.com",
+                email=f"synthetic{offset + i}@example.com",
+                first_name=f"User{offset + i}",
+                last_name='Synthetic',
+                phone=f"99{offset + i:011d}",
+                password=password,
+            )
+            for i in range(options['users'])
+        ], batch_size=batch_size)
+
+        # Messes: bulk_create skips Mess.save, so owner membership is added below
+        owners = rng.sample(users, min(options['messes'], len(users)))
+        messes = Mess.objects.bulk_create([
+            Mess(name=f"Synthetic Mess {i}", description='Generated for benchmarks', owner=owner)
+            for i, owner in enumerate(owners)
+        ], batch_size=batch_size)
+
+        # Memberships: every user joins 1..messes-per-user messes, so members overlap
+        members_of = {mess.id: {mess.owner_id} for mess in messes}
+        for user in users:
+            count = rng.randint(1, max(1, options['messes_per_user']))
+            for mess in rng.sample(messes, min(count, len(messes))):
+                members_of[mess.id].add(user.id)
+
+        Membership.objects.bulk_create([
+            Membership(mess=mess, user_id=user_id, role=ROLE_OWNER if user_id == mess.owner_id else ROLE_MEMBER)
+            for mess in messes for user_id in members_of[mess.id]
+        ], batch_size=batch_size, ignore_conflicts=True)
+        for mess in messes:
+            mess.member_count = len(members_of[mess.id])
+            mess.manager_count = 1
+        Mess.objects.bulk_update(messes, ['member_count', 'manager_count'], batch_size=batch_size)
+
+        # Meals and contributions, streamed to the database in batches
+        meal_total = 0
+        contribution_total = 0
+        meals = []
+        contributions = []
+        for mess in messes:
+            for year, month in recent_months(options['months']):
+                for user_id in members_of[mess.id]:
+                    for day in month_days(year, month):
+                        meals.append(Meal(
+                            mess=mess, member_id=user_id, date=day,
+                            meal_count=rng.choice((0, 1, 2, 2, 3, 3)), added_by_id=mess.owner_id,
+                        ))
+                    contributions.append(MemberContribution(
+                        mess=mess, member_id=user_id, month=f"{year:04d}-{month:02d}",
+                        amount=rng.randint(500, 5000), added_by_id=mess.owner_id,
+                    ))
+                    if len(meals) >= batch_size:
+                        Meal.objects.bulk_create(meals, batch_size=batch_size, ignore_conflicts=True)
+                        meal_total += len(meals)
+                        meals = []
+        Meal.objects.bulk_create(meals, batch_size=batch_size, ignore_conflicts=True)
+        meal_total += len(meals)
+        MemberContribution.objects.bulk_create(contributions, batch_size=batch_size, ignore_conflicts=True)
+        contribution_total += len(contributions)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users, {len(messes)} messes, "
+            f"{sum(len(m) for m in members_of.values())} memberships, "
+            f"{meal_total} meals and {contribution_total} contributions"
+        ))
@@ -0,0 +1,86 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+PROFILES = ('web', 'cli', 'worker')
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+STARTUP_LINE = re.compile(r'startup profile=(\S+) setup_ms=([\d.]+) rss_mb=([\d.]+)')
+
+
+def parse_importtime(stderr):
+    """{top-level package: self microseconds} and the number of modules imported."""
+    packages = defaultdict(int)
+    modules = 0
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match:
+            modules += 1
+            packages[match.group(4).split('.')[0]] += int(match.group(1))
+    return packages, modules
+
+
+class Command(BaseCommand):
+    help = (
+        'Cold-start each settings profile in fresh interpreters (python -X importtime '
+        'manage.py <command>) and report setup time, resident memory and the packages that '
+        'dominate import time'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', nargs='*', default=list(PROFILES), choices=PROFILES)
+        parser.add_argument('--runs', type=int, default=5, help='Cold starts per profile (median is reported)')
+        parser.add_argument('--command', default='version',
+                            help='manage.py command to start (default: version, which only loads Django)')
+        parser.add_argument('--wsgi', action='store_true',
+                            help="Also build the WSGI handler and load the URLconf, as gunicorn --preload does")
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def cold_start(self, profile, options):
+        env = {
+            **os.environ, 'DJANGO_PROFILE': profile,
+            'DJANGO_STARTUP_TIMING': 'wsgi' if options['wsgi'] else '1',
+        }
+        args = [sys.executable, '-X', 'importtime', str(settings.BASE_DIR / 'manage.py'), options['command']]
+        result = subprocess.run(args, env=env, cwd=settings.BASE_DIR, capture_output=True, text=True)
+        timing = STARTUP_LINE.search(result.stderr)
+        if result.returncode != 0 or timing is None:
+            raise CommandError(f"{profile} failed to start:\n{result.stderr[-2000:]}")
+        packages, modules = parse_importtime(result.stderr)
+        return float(timing.group(2)), float(timing.group(3)), packages, modules
+
+    def handle(self, *args, **options):
+        report = {}
+        for profile in options['profiles']:
+            runs = [self.cold_start(profile, options) for _ in range(options['runs'])]
+            packages = defaultdict(list)
+            for _, _, run_packages, _ in runs:
+                for package, micros in run_packages.items():
+                    packages[package].append(micros)
+            top = sorted(
+                ((package, statistics.median(values) / 1000) for package, values in packages.items()),
+                key=lambda item: -item[1],
+            )[:options['top']]
+            report[profile] = {
+                'setup_ms': round(statistics.median(run[0] for run in runs), 1),
+                'rss_mb': round(statistics.median(run[1] for run in runs), 1),
+                'modules': runs[0][3],
+                'top_packages_ms': {package: round(ms, 1) for package, ms in top},
+            }
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for profile, result in report.items():
+            self.stdout.write(
+                f"{profile:>6}: {result['setup_ms']:7.1f} ms  {result['rss_mb']:6.1f} MB  "
+                f"{result['modules']} modules"
+            )
+            self.stdout.write('        ' + ', '.join(f"{name} {ms}" for name, ms in result['top_packages_ms'].items()))
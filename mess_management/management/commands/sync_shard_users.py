@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from mess_management.signals import copy_users_to_shards
+from myproject import sharding
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy every user from default to the other shards (after adding a shard, '
+        'or after bulk inserts that skipped the post_save copy)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError('Sharding is off: SHARDS only lists default')
+        copied = 0
+        last_id = 0
+        while True:
+            batch = list(User.objects.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            copy_users_to_shards(batch)
+            copied += len(batch)
+            last_id = batch[-1].id
+        targets = [alias for alias in sharding.shards() if alias != DEFAULT_DB_ALIAS]
+        self.stdout.write(f"Copied {copied} users to {', '.join(targets)}")
@@ -0,0 +1,153 @@
+"""
+Packed member-by-day meal matrix for a month.
+
+A month of meals is at most members x 31 small integers (0-3), so it travels
+as one base64 string instead of a JSON object per meal: row-major by member
+(in the order of the ``members`` header), one cell per day of the month.
+With the ``2bit`` encoding four cells share a byte, lowest bits first; with
+``byte`` each cell is one byte and ``UNCHANGED`` marks cells a write should
+leave alone.
+"""
+import base64
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db.models import Q
+
+from myproject import sharding
+
+from . import history
+from .models import Meal, MealSchedule
+from .schedules import load, segments
+
+ENCODINGS = ('2bit', 'byte')
+UNCHANGED = 0xFF
+NO_SCHEDULE = 0xFE
+
+# byte value -> its four 2-bit cells
+_UNPACK_2BIT = [bytes((value >> shift) & 3 for shift in (0, 2, 4, 6)) for value in range(256)]
+
+
+def pack(cells, encoding='2bit'):
+    if encoding == 'byte':
+        return base64.b64encode(bytes(cells)).decode()
+    padded = bytes(cells) + bytes(-len(cells) % 4)
+    packed = bytes(
+        a | b << 2 | c << 4 | d << 6
+        for a, b, c, d in zip(padded[0::4], padded[1::4], padded[2::4], padded[3::4])
+    )
+    return base64.b64encode(packed).decode()
+
+
+def unpack(data, count, encoding='2bit'):
+    """Decode ``count`` cells; raises ValueError on malformed input."""
+    try:
+        raw = base64.b64decode(data, validate=True)
+    except (TypeError, ValueError):
+        raise ValueError('cells is not valid base64')
+    expected = count if encoding == 'byte' else (count + 3) // 4
+    if len(raw) != expected:
+        raise ValueError(f"Expected {expected} bytes of cells, got {len(raw)}")
+    if encoding == 'byte':
+        cells = bytearray(raw)
+        if any(value > 3 and value != UNCHANGED for value in cells):
+            raise ValueError('Meal counts must be 0-3')
+        return cells
+    return bytearray(b''.join(_UNPACK_2BIT[value] for value in raw)[:count])
+
+
+def _schedule_cells(schedules, rows, start, end, fill=0):
+    """
+    Cells for ``rows`` (member_id -> row offset) from their schedule segments,
+    copied in as repeated weeks; days no schedule covers keep ``fill``.
+    """
+    days = (end - start).days
+    cells = bytearray([fill]) * (len(rows) * days)
+    for member_id, member_schedules in schedules.items():
+        if member_id not in rows:
+            continue
+        for lo, hi, weekday_meals in segments(member_schedules, start, end):
+            week = bytes(int(weekday_meals[(lo.weekday() + i) % 7]) for i in range(7))
+            length = (hi - lo).days
+            offset = rows[member_id] + (lo - start).days
+            cells[offset:offset + length] = (week * (length // 7 + 1))[:length]
+    return cells
+
+
+def build_matrix(mess_id, start, end, member_ids=()):
+    """
+    (members, cells) with the effective meals of [start, end), in two queries.
+
+    ``members`` is ``member_ids`` plus anyone with a schedule or entry in the
+    month, sorted. Stored entries overwrite the scheduled cells.
+    """
+    days = (end - start).days
+    schedules, stored = load([mess_id], start, end)
+    schedules, stored = schedules.get(mess_id, {}), stored.get(mess_id, [])
+    members = sorted(set(member_ids) | set(schedules) | {member_id for member_id, _, _ in stored})
+    rows = {member_id: index * days for index, member_id in enumerate(members)}
+
+    cells = _schedule_cells(schedules, rows, start, end)
+    for member_id, day, meal_count in stored:
+        cells[rows[member_id] + (day - start).days] = meal_count
+    return members, cells
+
+
+def listed_members(mess_id, start, end):
+    """Ids build_matrix lists besides the current members: anyone with a schedule or entry by the month."""
+    scheduled = MealSchedule.objects.filter(mess_id=mess_id, starts_on__lt=end).values_list('member_id', flat=True)
+    entered = Meal.objects.filter(mess_id=mess_id, date__gte=start, date__lt=end).values_list('member_id', flat=True)
+    return set(scheduled.distinct()) | set(entered.distinct())
+
+
+def write_matrix(mess_id, start, end, member_ids, cells, added_by):
+    """
+    Apply a month of cells for ``member_ids`` as add_meal would, cell by cell:
+    entries equal to the schedule are cleared, others stored, and cells that
+    already hold the wanted value are not touched; nor are empty cells on
+    days no schedule covers, so writing back an unchanged matrix stores
+    nothing. Returns (stored, cleared).
+
+    The month's entries are read and locked in the same transaction as the
+    writes, so a concurrent add_meal can't slip in between and be
+    overwritten or logged with a stale old value.
+    """
+    days = (end - start).days
+    rows = {member_id: index * days for index, member_id in enumerate(member_ids)}
+    with sharding.atomic(mess_id):
+        schedules, stored = load([mess_id], start, end, lock=True)
+        scheduled = _schedule_cells(schedules.get(mess_id, {}), rows, start, end, fill=NO_SCHEDULE)
+        current = {(member_id, day): meal_count for member_id, day, meal_count in stored.get(mess_id, [])}
+
+        upserts = []
+        clears = defaultdict(list)
+        changes = []
+        for member_id, offset in rows.items():
+            for i in range(days):
+                wanted = cells[offset + i]
+                if wanted == UNCHANGED:
+                    continue
+                day = start + timedelta(days=i)
+                existing = current.get((member_id, day))
+                if existing is None and wanted == 0 and scheduled[offset + i] == NO_SCHEDULE:
+                    continue
+                if wanted == scheduled[offset + i]:
+                    if existing is not None:
+                        clears[member_id].append(day)
+                        changes.append(history.meal_change(mess_id, member_id, day, existing, None, added_by))
+                elif wanted != existing:
+                    upserts.append(Meal(mess_id=mess_id, member_id=member_id, date=day,
+                                        meal_count=wanted, added_by=added_by))
+                    changes.append(history.meal_change(mess_id, member_id, day, existing, wanted, added_by))
+
+        Meal.objects.bulk_create(
+            upserts, update_conflicts=True,
+            unique_fields=['mess', 'member', 'date'], update_fields=['meal_count', 'added_by'],
+        )
+        if clears:
+            matches = Q()
+            for member_id, member_days in clears.items():
+                matches |= Q(member_id=member_id, date__in=member_days)
+            Meal.objects.filter(mess_id=mess_id).filter(matches).delete()
+        history.record(changes)
+    return len(upserts), sum(len(member_days) for member_days in clears.values())
@@ -0,0 +1,214 @@
+"""
+Two-tier cache for the mess list and detail payloads.
+
+Serialized ``MessSerializer`` payloads are stored under the mess's current
+version token, and each user's list of mess ids under the user's token.
+Tokens live in Django's shared cache and are replaced when membership or the
+mess changes (``invalidate``, called from the model methods that already
+refresh dashboards), so stale payloads are never looked up again and just
+expire.
+
+Payloads are read from a per-process LRU (``MESS_CACHE_LOCAL_SIZE`` entries,
+``MESS_CACHE_LOCAL_TTL`` seconds) before the shared cache; only the small
+tokens cost a shared-cache round trip per request. On a miss one process
+takes a short ``cache.add`` lock per entry and builds it while the others
+wait for its result instead of all querying the database at once.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
+
+from myproject import sharding
+from myproject.tracing import traced
+
+from .dashboard import current_tokens, replace_tokens
+from .models import Mess, Membership
+
+LOCK_TIMEOUT = 10
+LOCK_WAIT = 2.0
+LOCK_POLL = 0.02
+
+stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _count(name, value=1):
+    if value:
+        with _stats_lock:
+            stats[name] += value
+
+
+def get_stats():
+    """This process's counters: hits_local, hits_shared, misses, builds, lock_waits, evictions, expired."""
+    with _stats_lock:
+        return {**dict(stats), 'local_entries': len(local)}
+
+
+_MISSING = object()
+
+
+class LocalLRU:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                _count('expired')
+                return _MISSING
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        _count('evictions', evicted)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+local = LocalLRU(settings.MESS_CACHE_LOCAL_SIZE, settings.MESS_CACHE_LOCAL_TTL)
+
+
+def _mess_version_key(mess_id):
+    return f"mess_version_{mess_id}"
+
+
+def _user_version_key(user_id):
+    return f"user_messes_version_{user_id}"
+
+
+def invalidate(mess_ids=(), user_ids=()):
+    """New tokens for changed messes (payloads) and users (mess id lists), once the transaction commits."""
+    replace_tokens(
+        [_mess_version_key(mess_id) for mess_id in mess_ids] + [_user_version_key(user_id) for user_id in user_ids]
+    )
+
+
+def _lookup(keys):
+    found = {}
+    missing = []
+    for key in keys:
+        value = local.get(key)
+        if value is _MISSING:
+            missing.append(key)
+        else:
+            found[key] = value
+    _count('hits_local', len(found))
+    if missing:
+        shared = cache.get_many(missing)
+        for key, value in shared.items():
+            local.set(key, value)
+        found.update(shared)
+        _count('hits_shared', len(shared))
+    _count('misses', len(keys) - len(found))
+    return found
+
+
+def _store(values):
+    cache.set_many(values, settings.MESS_CACHE_TTL)
+    for key, value in values.items():
+        local.set(key, value)
+
+
+def _get_or_build(keys, build):
+    """
+    {id: value} for ``keys`` ({id: cache key}). Missing ids are built with
+    ``build(ids) -> {id: value}``, each by one process at a time: ids whose
+    lock another process holds are waited for, then built here if it gave up.
+    """
+    found = _lookup(list(keys.values()))
+    result = {item_id: found[key] for item_id, key in keys.items() if key in found}
+    missing = [item_id for item_id in keys if item_id not in result]
+    if not missing:
+        return result
+
+    locks = {item_id: f"{keys[item_id]}_lock" for item_id in missing}
+    mine = {item_id for item_id in missing if cache.add(locks[item_id], 1, LOCK_TIMEOUT)}
+    if mine:
+        try:
+            built = build(mine)
+            _store({keys[item_id]: value for item_id, value in built.items()})
+            _count('builds', len(built))
+            result.update(built)
+        finally:
+            cache.delete_many([locks[item_id] for item_id in mine])
+
+    waiting = [item_id for item_id in missing if item_id not in mine]
+    if waiting:
+        _count('lock_waits', len(waiting))
+        deadline = time.monotonic() + LOCK_WAIT
+        while waiting and time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            arrived = cache.get_many([keys[item_id] for item_id in waiting])
+            for item_id in list(waiting):
+                if keys[item_id] in arrived:
+                    result[item_id] = arrived[keys[item_id]]
+                    local.set(keys[item_id], result[item_id])
+                    waiting.remove(item_id)
+        if waiting:
+            built = build(waiting)
+            _store({keys[item_id]: value for item_id, value in built.items()})
+            _count('builds', len(built))
+            result.update(built)
+    return result
+
+
+def with_members(queryset):
+    """What MessSerializer reads: the owner and every membership's user, in join order."""
+    return queryset.select_related('owner').prefetch_related(
+        Prefetch('memberships', queryset=Membership.objects.select_related('user').order_by('joined_at', 'id'))
+    )
+
+
+def _build_payloads(mess_ids):
+    # Imported here so app loading doesn't pull in DRF
+    from .serializers import MessSerializer
+    built = {}
+    for alias, ids in sharding.by_shard(mess_ids).items():
+        with sharding.use(alias):
+            for mess in with_members(Mess.objects.filter(id__in=ids)):
+                built[mess.id] = dict(MessSerializer(mess).data)
+    return built
+
+
+@traced('mess_cache.mess_ids_for')
+def mess_ids_for(user_id):
+    """Ids of the messes a user belongs to, ascending (from every shard)."""
+    token = current_tokens([_user_version_key(user_id)])[_user_version_key(user_id)]
+    key = f"user_messes_{user_id}_{token}"
+    return _get_or_build({user_id: key}, lambda ids: {
+        user_id: sorted(mess_id for mess_ids in sharding.fan_out(
+            lambda alias: list(Membership.objects.filter(user_id=user_id).values_list('mess_id', flat=True))
+        ) for mess_id in mess_ids)
+    })[user_id]
+
+
+@traced('mess_cache.payloads')
+def payloads(mess_ids):
+    """{mess_id: serialized mess} for the given messes; ids that no longer exist are left out."""
+    tokens = current_tokens([_mess_version_key(mess_id) for mess_id in mess_ids])
+    keys = {mess_id: f"mess_payload_{mess_id}_{tokens[_mess_version_key(mess_id)]}" for mess_id in mess_ids}
+    return _get_or_build(keys, _build_payloads)
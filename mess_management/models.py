@@ -1,12 +1,18 @@
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 
+from myproject import sharding
+from myproject.tracing import traced
+
 User = get_user_model()
 
 
 STATUS_CHOICES = [
     ("Pending", "Pending"),
     ("Approved", "Approved"),
+    ("Rejected", "Rejected"),
 ]
 
 class MemberRequest(models.Model):
@@ -22,13 +28,60 @@ class MemberRequest(models.Model):
 
     def __str__(self):
         return f"{self.user.email} - {self.status}"
+    
+    class Meta:
+        indexes = [
+            # become_member_request: a user's own requests, newest first
+            models.Index(fields=['user', '-created_at'], name='member_req_user_created_idx'),
+            # all_member_requests / approval queue: only the pending subset is hot
+            models.Index(
+                fields=['-created_at'], name='member_req_pending_idx',
+                condition=models.Q(status='Pending'),
+            ),
+        ]
+
+ROLE_OWNER = 'owner'
+ROLE_MANAGER = 'manager'
+ROLE_MEMBER = 'member'
+ROLE_CHOICES = [
+    (ROLE_OWNER, 'Owner'),
+    (ROLE_MANAGER, 'Manager'),
+    (ROLE_MEMBER, 'Member'),
+]
+MANAGER_ROLES = (ROLE_OWNER, ROLE_MANAGER)
+
+def _invalidate_caches(mess_ids=(), user_ids=()):
+    # Dashboards plus the cached mess payloads and per-user mess lists;
+    # imported here because those modules query these models
+    from .dashboard import touch
+    from .mess_cache import invalidate
+    touch(mess_ids, user_ids)
+    invalidate(mess_ids, user_ids)
+
+class MessShard(models.Model):
+    """
+    Directory of messes on ``default``: allocates mess ids that are unique
+    across shards and records which shard each mess lives on (only used when
+    ``SHARDS`` lists more than one database; see ``myproject.sharding``).
+    """
+    alias = models.CharField(max_length=50, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.id} on {self.alias}"
+    
+    class Meta:
+        db_table = 'mess_shards'
 
 class Mess(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_messes')
-    members = models.ManyToManyField(User, related_name='joined_messes', blank=True)
-    managers = models.ManyToManyField(User, related_name='managed_messes', blank=True)
+    members = models.ManyToManyField(User, through='Membership', related_name='joined_messes', blank=True)
+    # Denormalized from Membership; kept in step by the Membership/Mess
+    # methods below inside the same transaction as the membership change
+    member_count = models.PositiveIntegerField(default=0)
+    manager_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -37,16 +90,154 @@ class Mess(models.Model):
     
     def save(self, *args, **kwargs):
         is_new = self.pk is None
-        super().save(*args, **kwargs)
         if is_new:
-            # Add owner as member and manager
-            self.members.add(self.owner)
-            self.managers.add(self.owner)
+            self.member_count = 1
+            self.manager_count = 1
+            if sharding.enabled():
+                self.pk = sharding.allocate_mess_id()
+        if sharding.enabled():
+            # A mess's id decides its shard, whatever database was asked for
+            kwargs['using'] = sharding.shard_for(self.pk)
+        with sharding.atomic(self.pk):
+            super().save(*args, **kwargs)
+            if is_new:
+                # Owner is a member and a manager; counts were set above
+                Membership.objects.bulk_create([Membership(mess=self, user=self.owner, role=ROLE_OWNER)])
+            _invalidate_caches([self.pk], [self.owner_id] if is_new else ())
+    
+    def delete(self, *args, **kwargs):
+        mess_id = self.pk
+        with sharding.atomic(mess_id):
+            # Every member's mess list loses this mess; the new cache tokens
+            # are only published if the delete commits
+            _invalidate_caches([mess_id], list(self.memberships.values_list('user_id', flat=True)))
+            result = super().delete(*args, **kwargs)
+        # The directory row lives on default; drop it once the mess is gone
+        if sharding.enabled():
+            MessShard.objects.filter(id=mess_id).delete()
+        return result
+    
+    @property
+    def managers(self):
+        return User.objects.filter(memberships__mess=self, memberships__role__in=MANAGER_ROLES)
+    
+    @traced('permission.is_member')
+    def is_member(self, user):
+        return Membership.objects.filter(mess_id=self.pk, user_id=user.pk).exists()
+    
+    @traced('permission.is_manager')
+    def is_manager(self, user):
+        return Membership.objects.filter(mess_id=self.pk, user_id=user.pk, role__in=MANAGER_ROLES).exists()
+    
+    @traced('permission.roles_of')
+    def roles_of(self, user_ids):
+        """{user_id: role} for the given users that belong to this mess."""
+        return dict(Membership.objects.filter(mess_id=self.pk, user_id__in=user_ids).values_list('user_id', 'role'))
+    
+    def _lock(self):
+        # Serializes membership changes per mess so the counters stay exact
+        list(Mess.objects.select_for_update().filter(pk=self.pk).values_list('pk'))
+    
+    def add_members(self, user_ids):
+        """Add users that are not members yet. Returns (added_ids, existing_ids)."""
+        user_ids = set(user_ids)
+        with sharding.atomic(self.pk):
+            self._lock()
+            existing = set(self.roles_of(user_ids))
+            added = sorted(user_ids - existing)
+            Membership.objects.bulk_create([
+                Membership(mess_id=self.pk, user_id=user_id, role=ROLE_MEMBER) for user_id in added
+            ])
+            if added:
+                Mess.objects.filter(pk=self.pk).update(member_count=F('member_count') + len(added))
+                _invalidate_caches([self.pk], added)
+        return added, sorted(existing)
+    
+    def remove_members(self, user_ids):
+        """Remove members (never the owner). Returns the removed ids."""
+        with sharding.atomic(self.pk):
+            self._lock()
+            memberships = Membership.objects.filter(mess_id=self.pk, user_id__in=user_ids).exclude(role=ROLE_OWNER)
+            removed = dict(memberships.values_list('user_id', 'role'))
+            memberships.filter(user_id__in=removed).delete()
+            if removed:
+                Mess.objects.filter(pk=self.pk).update(
+                    member_count=F('member_count') - len(removed),
+                    manager_count=F('manager_count') - sum(role in MANAGER_ROLES for role in removed.values()),
+                )
+                # Stop their default schedules from today on, including any
+                # set to start later
+                today = timezone.localdate()
+                MealSchedule.objects.filter(mess_id=self.pk, member_id__in=removed, starts_on__gt=today).delete()
+                MealSchedule.objects.bulk_create([
+                    MealSchedule(mess_id=self.pk, member_id=member_id, starts_on=today, weekday_meals=NO_MEALS)
+                    for member_id in MealSchedule.objects.filter(
+                        mess_id=self.pk, member_id__in=removed
+                    ).values_list('member_id', flat=True).distinct()
+                ], update_conflicts=True, unique_fields=['mess', 'member', 'starts_on'], update_fields=['weekday_meals'])
+                _invalidate_caches([self.pk], removed)
+        return sorted(removed)
+    
+    def set_managers(self, user_ids, is_manager=True):
+        """Promote members to managers (or demote managers). Returns the changed ids."""
+        from_role, to_role = (ROLE_MEMBER, ROLE_MANAGER) if is_manager else (ROLE_MANAGER, ROLE_MEMBER)
+        with sharding.atomic(self.pk):
+            self._lock()
+            memberships = Membership.objects.filter(mess_id=self.pk, user_id__in=user_ids, role=from_role)
+            changed = sorted(memberships.values_list('user_id', flat=True))
+            Membership.objects.filter(mess_id=self.pk, user_id__in=changed).update(role=to_role)
+            if changed:
+                delta = len(changed) if is_manager else -len(changed)
+                Mess.objects.filter(pk=self.pk).update(manager_count=F('manager_count') + delta)
+                _invalidate_caches([self.pk])
+        return changed
     
     class Meta:
         db_table = 'messes'
         verbose_name_plural = 'Messes'
 
+class Membership(models.Model):
+    mess = models.ForeignKey(Mess, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='memberships')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=ROLE_MEMBER)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user_id} in {self.mess_id} ({self.role})"
+    
+    def save(self, *args, **kwargs):
+        # Single-row edits (e.g. the admin inline) keep the counters in step;
+        # bulk paths on Mess update them directly
+        with sharding.atomic(self.mess_id):
+            previous_role = None
+            if not self._state.adding:
+                previous_role = Membership.objects.filter(pk=self.pk).values_list('role', flat=True).first()
+            super().save(*args, **kwargs)
+            manager_delta = int(self.role in MANAGER_ROLES) - int(previous_role in MANAGER_ROLES)
+            Mess.objects.filter(pk=self.mess_id).update(
+                member_count=F('member_count') + (1 if previous_role is None else 0),
+                manager_count=F('manager_count') + manager_delta,
+            )
+            _invalidate_caches([self.mess_id], [self.user_id])
+    
+    def delete(self, *args, **kwargs):
+        with sharding.atomic(self.mess_id):
+            result = super().delete(*args, **kwargs)
+            Mess.objects.filter(pk=self.mess_id).update(
+                member_count=F('member_count') - 1,
+                manager_count=F('manager_count') - int(self.role in MANAGER_ROLES),
+            )
+            _invalidate_caches([self.mess_id], [self.user_id])
+        return result
+    
+    class Meta:
+        db_table = 'mess_memberships'
+        unique_together = ('mess', 'user')
+        indexes = [
+            # "my messes" lookups go from the user side
+            models.Index(fields=['user', 'role'], name='membership_user_role_idx'),
+        ]
+
 class Meal(models.Model):
     mess = models.ForeignKey(Mess, on_delete=models.CASCADE, related_name='meals')
     member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='meals')
@@ -64,6 +255,35 @@ class Meal(models.Model):
     class Meta:
         db_table = 'meals'
         unique_together = ('mess', 'member', 'date')
+        indexes = [
+            # Month scans (get_meals, calculate_month): range on date within a
+            # mess; member and meal_count are included so the per-member
+            # aggregate is answered from the index alone on PostgreSQL
+            models.Index(fields=['mess', 'date'], include=['member', 'meal_count'], name='meal_mess_date_idx'),
+        ]
+
+NO_MEALS = '0000000'
+
+class MealSchedule(models.Model):
+    """
+    A member's default meals per weekday from ``starts_on`` until their next
+    schedule. Meal rows only record the days that differ from it.
+    """
+    mess = models.ForeignKey(Mess, on_delete=models.CASCADE, related_name='meal_schedules')
+    member = models.ForeignKey(User, on_delete=models.CASCADE, related_name='meal_schedules')
+    starts_on = models.DateField()
+    weekday_meals = models.CharField(max_length=7)  # one digit (0-3) per weekday, Monday first
+    created_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, null=True, blank=True, related_name='created_meal_schedules'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.member_id} in {self.mess_id} from {self.starts_on}: {self.weekday_meals}"
+    
+    class Meta:
+        db_table = 'meal_schedules'
+        unique_together = ('mess', 'member', 'starts_on')
 
 class MonthlyCalculation(models.Model):
     mess = models.ForeignKey(Mess, on_delete=models.CASCADE, related_name='calculations')
@@ -75,6 +295,7 @@ class MonthlyCalculation(models.Model):
     cost_per_meal = models.DecimalField(max_digits=8, decimal_places=2)
     calculated_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='calculations')
     calculated_at = models.DateTimeField(auto_now_add=True)
+    transfer_plan = models.JSONField(null=True, blank=True)  # [{'from': id, 'to': id, 'amount': paisa}, ...]
 
     def __str__(self):
         return f"{self.mess.name} - {self.month}"
@@ -98,6 +319,46 @@ class MemberContribution(models.Model):
     class Meta:
         db_table = 'member_contributions'
         unique_together = ('mess', 'member', 'month')
+        indexes = [
+            # manage_contributions / calculate_month read a whole (mess, month)
+            models.Index(fields=['mess', 'month'], include=['member', 'amount'], name='contrib_mess_month_idx'),
+        ]
+
+CHANGE_MEAL = 'meal'
+CHANGE_CONTRIBUTION = 'contribution'
+
+class ChangeLogEntry(models.Model):
+    """
+    Append-only history of stored meal counts and contribution amounts:
+    ``old_value``/``new_value`` are None where no row existed (a meal back on
+    its schedule, a removed contribution). Written by ``history.record`` in
+    the same transaction as the change; ``compact_change_log`` folds closed
+    months down to one entry per member and day (``changes`` counts the
+    entries folded in).
+    """
+    mess = models.ForeignKey(Mess, on_delete=models.CASCADE, related_name='change_log')
+    kind = models.CharField(max_length=12, choices=[(CHANGE_MEAL, 'Meal'), (CHANGE_CONTRIBUTION, 'Contribution')])
+    # No database constraint, so history outlives the users it mentions
+    member = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    month = models.CharField(max_length=7)  # YYYY-MM format
+    day = models.DateField(null=True)  # meals only
+    old_value = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    new_value = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+    changed_by = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='+')
+    changed_at = models.DateTimeField(default=timezone.now)
+    changes = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.kind} {self.member_id} {self.day or self.month}: {self.old_value} -> {self.new_value}"
+    
+    class Meta:
+        db_table = 'change_log'
+        indexes = [
+            # History endpoint: newest first, keyset on id
+            models.Index(fields=['mess', '-id'], name='change_log_mess_id_idx'),
+            # Month filter and per-month compaction
+            models.Index(fields=['mess', 'month', 'id'], name='change_log_mess_month_idx'),
+        ]
 
 class MemberMealSummary(models.Model):
     calculation = models.ForeignKey(MonthlyCalculation, on_delete=models.CASCADE, related_name='member_summaries')
@@ -0,0 +1,227 @@
+"""
+Default meal schedules merged with explicit meal entries.
+
+A member's meals come from their ``MealSchedule`` (one digit per weekday,
+Monday first, valid until their next schedule) and ``Meal`` rows are only
+stored for the days that differ. Totals are computed without materializing
+a row per member-day: each schedule segment contributes its weekday meals
+times how often each weekday occurs in the segment, and every stored entry
+then corrects its day by (entered - scheduled).
+
+The pure functions take plain data so they can be checked against a fully
+materialized month (see ``MealScheduleEquivalenceTests``); ``load`` and
+``meal_totals_for`` fetch that data with two queries for any number of messes.
+"""
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Meal, MealSchedule, MonthlyCalculation
+
+User = get_user_model()
+
+
+def weekday_counts(start, end):
+    """How many Mondays, Tuesdays, ... Sundays fall in [start, end)."""
+    days = (end - start).days
+    if days <= 0:
+        return [0] * 7
+    full_weeks, rest = divmod(days, 7)
+    counts = [full_weeks] * 7
+    first = start.weekday()
+    for offset in range(rest):
+        counts[(first + offset) % 7] += 1
+    return counts
+
+
+def segments(schedules, start, end):
+    """(from, until, weekday_meals) for one member's schedules clipped to [start, end).
+
+    ``schedules`` is a list of (starts_on, weekday_meals) sorted by date.
+    """
+    for i, (starts_on, weekday_meals) in enumerate(schedules):
+        until = schedules[i + 1][0] if i + 1 < len(schedules) else end
+        lo, hi = max(starts_on, start), min(until, end)
+        if lo < hi:
+            yield lo, hi, weekday_meals
+
+
+def scheduled_meals(schedules, day):
+    """Meals the schedule gives ``day`` (0 before the first schedule)."""
+    i = bisect_right(schedules, (day, '9999999'))
+    if i == 0:
+        return 0
+    return int(schedules[i - 1][1][day.weekday()])
+
+
+def meal_totals(schedules_by_member, entries, start, end):
+    """
+    {member_id: effective meals in [start, end)}.
+
+    Members appear if they have a stored entry in the span or a schedule that
+    gives them meals in it, the same members a fully materialized month has.
+    """
+    totals = defaultdict(int)
+    for member_id, schedules in schedules_by_member.items():
+        total = 0
+        for lo, hi, weekday_meals in segments(schedules, start, end):
+            total += sum(int(meals) * count for meals, count in zip(weekday_meals, weekday_counts(lo, hi)))
+        if total:
+            totals[member_id] = total
+    for member_id, day, meal_count in entries:
+        totals[member_id] += meal_count - scheduled_meals(schedules_by_member.get(member_id, []), day)
+    return dict(totals)
+
+
+def effective_days(schedules_by_member, entries, start, end):
+    """
+    {member_id: {date: meals}} for [start, end): the days a schedule gives
+    meals plus every stored entry, which wins over the schedule.
+    """
+    days = defaultdict(dict)
+    for member_id, schedules in schedules_by_member.items():
+        for lo, hi, weekday_meals in segments(schedules, start, end):
+            day = lo
+            while day < hi:
+                meals = int(weekday_meals[day.weekday()])
+                if meals:
+                    days[member_id][day] = meals
+                day += timedelta(days=1)
+    for member_id, day, meal_count in entries:
+        days[member_id][day] = meal_count
+    return dict(days)
+
+
+def load(mess_ids, start, end, lock=False):
+    """
+    ({mess_id: {member_id: [(starts_on, weekday_meals), ...]}},
+     {mess_id: [(member_id, date, meal_count), ...]}) for [start, end).
+
+    ``lock`` selects the meal entries FOR UPDATE; call it inside a transaction.
+    """
+    schedules = defaultdict(lambda: defaultdict(list))
+    for mess_id, member_id, starts_on, weekday_meals in MealSchedule.objects.filter(
+        mess_id__in=mess_ids, starts_on__lt=end
+    ).order_by('starts_on').values_list('mess_id', 'member_id', 'starts_on', 'weekday_meals'):
+        schedules[mess_id][member_id].append((starts_on, weekday_meals))
+
+    meals = Meal.objects.filter(mess_id__in=mess_ids, date__gte=start, date__lt=end)
+    if lock:
+        meals = meals.select_for_update()
+    entries = defaultdict(list)
+    for mess_id, member_id, day, meal_count in meals.values_list('mess_id', 'member_id', 'date', 'meal_count'):
+        entries[mess_id].append((member_id, day, meal_count))
+    return schedules, entries
+
+
+def meal_totals_for(mess_ids, start, end):
+    """{mess_id: {member_id: effective meals}} for [start, end)."""
+    schedules, entries = load(mess_ids, start, end)
+    return {
+        mess_id: meal_totals(schedules.get(mess_id, {}), entries.get(mess_id, []), start, end)
+        for mess_id in mess_ids
+    }
+
+
+def weekday_lookup(weekday_meals):
+    """{week_day: meals} keyed for Django's ``__week_day`` lookup (Sunday = 1)."""
+    return {(weekday + 1) % 7 + 1: int(meals) for weekday, meals in enumerate(weekday_meals)}
+
+
+def scheduled_meals_on(mess_id, member_id, day):
+    """
+    Meals a member's schedule gives one day (one query), or None when no
+    schedule covers it, so an explicit 0 is still stored and a schedule
+    backdated later cannot fill that day in.
+    """
+    weekday_meals = MealSchedule.objects.filter(
+        mess_id=mess_id, member_id=member_id, starts_on__lte=day
+    ).order_by('-starts_on').values_list('weekday_meals', flat=True).first()
+    return int(weekday_meals[day.weekday()]) if weekday_meals else None
+
+
+def month_meals(mess_id, start, end):
+    """
+    Meal objects for every effective member-day in [start, end): the stored
+    entries plus unsaved Meals (pk None) for the days a schedule fills in.
+    """
+    stored = list(Meal.objects.filter(
+        mess_id=mess_id, date__gte=start, date__lt=end
+    ).select_related('member', 'added_by'))
+    schedules = defaultdict(list)
+    for member_id, starts_on, weekday_meals in MealSchedule.objects.filter(
+        mess_id=mess_id, starts_on__lt=end
+    ).order_by('starts_on').values_list('member_id', 'starts_on', 'weekday_meals'):
+        schedules[member_id].append((starts_on, weekday_meals))
+
+    users = {meal.member_id: meal.member for meal in stored}
+    missing = set(schedules) - set(users)
+    if missing:
+        users.update(User.objects.in_bulk(missing))
+
+    taken = {(meal.member_id, meal.date) for meal in stored}
+    meals = list(stored)
+    for member_id, days in effective_days(schedules, [], start, end).items():
+        for day, meal_count in days.items():
+            if (member_id, day) not in taken:
+                meals.append(Meal(mess_id=mess_id, member=users[member_id], date=day, meal_count=meal_count))
+    meals.sort(key=lambda meal: (meal.date, meal.member_id))
+    return meals
+
+
+def redundant_entries(mess_id, member_id, starts_on, weekday_meals):
+    """Stored entries a new schedule makes redundant (same meals as it gives)."""
+    next_start = MealSchedule.objects.filter(
+        mess_id=mess_id, member_id=member_id, starts_on__gt=starts_on
+    ).order_by('starts_on').values_list('starts_on', flat=True).first()
+    matches = Q()
+    for week_day, meals in weekday_lookup(weekday_meals).items():
+        matches |= Q(date__week_day=week_day, meal_count=meals)
+    entries = Meal.objects.filter(mess_id=mess_id, member_id=member_id, date__gte=starts_on).filter(matches)
+    if next_start is not None:
+        entries = entries.filter(date__lt=next_start)
+    return entries
+
+
+def pin_settled_days(mess_id, member_id, starts_on, weekday_meals, added_by):
+    """
+    Before a schedule from ``starts_on`` is saved, store the current meals of
+    each day it would change that must keep them: days before today and days
+    in months already calculated. Unstored days only follow the schedule
+    because add_meal skips entries equal to it, so without this a backdated
+    schedule would silently rewrite them. Returns the entries stored.
+    """
+    today = timezone.localdate()
+    schedules = list(MealSchedule.objects.filter(
+        mess_id=mess_id, member_id=member_id
+    ).order_by('starts_on').values_list('starts_on', 'weekday_meals'))
+    next_start = next((day for day, _ in schedules if day > starts_on), None)
+    calculated = set(MonthlyCalculation.objects.filter(
+        mess_id=mess_id, month__gte=starts_on.strftime('%Y-%m')
+    ).values_list('month', flat=True))
+
+    end = today
+    if calculated:
+        last = max(calculated)
+        year, month = int(last[:4]), int(last[5:])
+        end = max(end, starts_on.replace(year=year + month // 12, month=month % 12 + 1, day=1))
+    if next_start is not None:
+        end = min(end, next_start)
+
+    stored = set(Meal.objects.filter(
+        mess_id=mess_id, member_id=member_id, date__gte=starts_on, date__lt=end
+    ).values_list('date', flat=True))
+    pins = []
+    day = starts_on
+    while day < end:
+        if day not in stored and (day < today or day.strftime('%Y-%m') in calculated):
+            meals = scheduled_meals(schedules, day)
+            if meals != int(weekday_meals[day.weekday()]):
+                pins.append(Meal(mess_id=mess_id, member_id=member_id, date=day, meal_count=meals, added_by=added_by))
+        day += timedelta(days=1)
+    Meal.objects.bulk_create(pins)
+    return len(pins)
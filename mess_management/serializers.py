@@ -1,8 +1,65 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Mess, Meal, MonthlyCalculation, MemberMealSummary,MemberContribution,MemberRequest
+from django.db.models import Exists, OuterRef, Q
+from myproject import sharding
+from .models import Mess, Meal, MealSchedule, MonthlyCalculation, MemberMealSummary,MemberContribution,MemberRequest,Membership,ChangeLogEntry,MANAGER_ROLES
+from .settlement import from_paisa, to_paisa
+from . import matrix
 
 User = get_user_model()
+
+# One member can end up owing a month's whole cost, so amounts and month
+# totals are capped at what the per-member summary fields (8 digits, 2
+# places) can hold
+MAX_MONTH_PAISA = 10 ** MemberMealSummary._meta.get_field('total_cost').max_digits - 1
+MAX_MONTH_AMOUNT = from_paisa(MAX_MONTH_PAISA)
+
+
+class MessLookupMixin:
+    """
+    Resolves the users a write request refers to in a single query.
+
+    The view passes the target mess as ``context['mess']``; every resolved
+    user is annotated with ``is_mess_member`` so existence and membership are
+    checked in the same round trip, and the User objects end up in
+    ``validated_data`` for the view to reuse.
+    """
+
+    def resolve_users(self, ids=(), phones=()):
+        queryset = User.objects.filter(Q(id__in=ids) | Q(phone__in=phones))
+        mess = self.context.get('mess')
+        if mess is not None and sharding.enabled():
+            # Memberships live on the mess's shard, so check them separately
+            users = list(queryset)
+            members = mess.roles_of([user.id for user in users])
+            for user in users:
+                user.is_mess_member = user.id in members
+            return users
+        if mess is not None:
+            queryset = queryset.annotate(is_mess_member=Exists(
+                Membership.objects.filter(mess_id=mess.id, user_id=OuterRef('pk'))
+            ))
+        return list(queryset)
+
+    def resolve_member(self, member_id, field='member_id'):
+        users = self.resolve_users(ids=[member_id])
+        if not users:
+            raise serializers.ValidationError({field: "Member not found"})
+        user = users[0]
+        if not getattr(user, 'is_mess_member', True):
+            raise serializers.ValidationError({field: "User is not a member of this mess"})
+        return user
+
+    def resolve_members(self, member_ids, field):
+        """{id: User} for ids that must all be members of the mess, in one query."""
+        members = {user.id: user for user in self.resolve_users(ids=member_ids)}
+        for member_id in sorted(member_ids):
+            if member_id not in members:
+                raise serializers.ValidationError({field: f"Member with ID {member_id} not found"})
+            if not getattr(members[member_id], 'is_mess_member', True):
+                raise serializers.ValidationError({field: f"User with ID {member_id} is not a member of this mess"})
+        return members
+
 class MemberRequestSerializer(serializers.ModelSerializer):
     class Meta:
         model = MemberRequest
@@ -49,77 +106,159 @@ class MemberContributionSerializer(serializers.ModelSerializer):
         fields = ('id', 'mess', 'member', 'month', 'amount', 'description', 'added_by', 'created_at')
         read_only_fields = ('id', 'mess', 'added_by', 'created_at')
 
-class MemberContributionCreateSerializer(serializers.ModelSerializer):
+class ChangeLogEntrySerializer(serializers.ModelSerializer):
+    member = UserBasicSerializer(read_only=True)
+    changed_by = UserBasicSerializer(read_only=True)
+    
+    class Meta:
+        model = ChangeLogEntry
+        fields = ('id', 'kind', 'member', 'month', 'day', 'old_value', 'new_value', 'changed_by', 'changed_at', 'changes')
+
+class MemberContributionCreateSerializer(MessLookupMixin, serializers.ModelSerializer):
     member_id = serializers.IntegerField()
     
     class Meta:
         model = MemberContribution
         fields = ('member_id', 'month', 'amount', 'description')
+        extra_kwargs = {'amount': {'min_value': 0, 'max_value': MAX_MONTH_AMOUNT}}
     
-    def validate_member_id(self, value):
-        try:
-            user = User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("Member not found")
-        return value
+    def validate(self, attrs):
+        attrs['member'] = self.resolve_member(attrs['member_id'])
+        return attrs
 
 class MessSerializer(serializers.ModelSerializer):
     owner = UserBasicSerializer(read_only=True)
-    members = UserBasicSerializer(many=True, read_only=True)
-    managers = UserBasicSerializer(many=True, read_only=True)
+    members = serializers.SerializerMethodField()
+    managers = serializers.SerializerMethodField()
     
     class Meta:
         model = Mess
-        fields = ('id', 'name', 'description', 'owner', 'members', 'managers', 'created_at', 'updated_at')
-        read_only_fields = ('id', 'owner', 'created_at', 'updated_at')
+        fields = (
+            'id', 'name', 'description', 'owner', 'members', 'managers',
+            'member_count', 'manager_count', 'created_at', 'updated_at'
+        )
+        read_only_fields = ('id', 'owner', 'member_count', 'manager_count', 'created_at', 'updated_at')
+    
+    # Both lists come from the one (prefetched) memberships relation
+    def get_members(self, obj):
+        return UserBasicSerializer([m.user for m in obj.memberships.all()], many=True).data
+    
+    def get_managers(self, obj):
+        return UserBasicSerializer(
+            [m.user for m in obj.memberships.all() if m.role in MANAGER_ROLES], many=True
+        ).data
 
 class MessCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mess
         fields = ('name', 'description')
 
-class AddMemberSerializer(serializers.Serializer):
+class AddMemberSerializer(MessLookupMixin, serializers.Serializer):
     phone = serializers.CharField(max_length=15)
     
-    def validate_phone(self, value):
-        try:
-            user = User.objects.get(phone=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User with this phone number not found")
-        return value
+    def validate(self, attrs):
+        users = self.resolve_users(phones=[attrs['phone']])
+        if not users:
+            raise serializers.ValidationError({'phone': "User with this phone number not found"})
+        if getattr(users[0], 'is_mess_member', False):
+            raise serializers.ValidationError({'phone': "User is already a member"})
+        attrs['user'] = users[0]
+        return attrs
 
-class AddManagerSerializer(serializers.Serializer):
+class AddManagerSerializer(MessLookupMixin, serializers.Serializer):
     user_id = serializers.IntegerField()
     
-    def validate_user_id(self, value):
+    def validate(self, attrs):
+        attrs['user'] = self.resolve_member(attrs['user_id'], field='user_id')
+        return attrs
+
+MAX_BULK_MEMBERS = 500
+
+class BulkPhonesSerializer(serializers.Serializer):
+    phones = serializers.ListField(
+        child=serializers.CharField(max_length=15), allow_empty=False, max_length=MAX_BULK_MEMBERS
+    )
+
+class BulkUserIdsSerializer(serializers.Serializer):
+    user_ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=MAX_BULK_MEMBERS
+    )
+
+class MealMatrixSerializer(serializers.Serializer):
+    """A packed month of meals; the view passes ``mess`` and ``month_bounds`` in the context."""
+    members = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=MAX_BULK_MEMBERS
+    )
+    cells = serializers.CharField()
+    encoding = serializers.ChoiceField(choices=matrix.ENCODINGS, default='2bit')
+    
+    def validate(self, attrs):
+        members = attrs['members']
+        if len(set(members)) != len(members):
+            raise serializers.ValidationError({'members': "Duplicate member IDs"})
+        mess = self.context['mess']
+        start, end = self.context['month_bounds']
+        not_members = set(members) - set(mess.roles_of(members))
+        if not_members:
+            # Former members still in the month are listed by the GET, so
+            # a matrix read and written back round-trips
+            not_members -= matrix.listed_members(mess.id, start, end)
+        if not_members:
+            raise serializers.ValidationError({'members': f"Not members of this mess: {sorted(not_members)}"})
         try:
-            user = User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("User not found")
-        return value
+            attrs['cells'] = matrix.unpack(attrs['cells'], len(members) * (end - start).days, attrs['encoding'])
+        except ValueError as exc:
+            raise serializers.ValidationError({'cells': str(exc)})
+        return attrs
 
 class MealSerializer(serializers.ModelSerializer):
     member = UserBasicSerializer(read_only=True)
     added_by = UserBasicSerializer(read_only=True)
+    scheduled = serializers.SerializerMethodField()
     
     class Meta:
         model = Meal
-        fields = ('id', 'mess', 'member', 'date', 'meal_count', 'added_by', 'created_at')
+        fields = ('id', 'mess', 'member', 'date', 'meal_count', 'scheduled', 'added_by', 'created_at')
         read_only_fields = ('id', 'mess', 'added_by', 'created_at')
+    
+    def get_scheduled(self, obj):
+        # Days filled in from a default schedule have no stored row
+        return obj.pk is None
 
-class MealCreateSerializer(serializers.ModelSerializer):
+class MealCreateSerializer(MessLookupMixin, serializers.ModelSerializer):
     member_id = serializers.IntegerField()
     
     class Meta:
         model = Meal
         fields = ('date', 'member_id', 'meal_count')
     
-    def validate_member_id(self, value):
-        try:
-            user = User.objects.get(id=value)
-        except User.DoesNotExist:
-            raise serializers.ValidationError("Member not found")
-        return value
+    def validate(self, attrs):
+        attrs['member'] = self.resolve_member(attrs['member_id'])
+        return attrs
+
+class MealScheduleSerializer(serializers.ModelSerializer):
+    member = UserBasicSerializer(read_only=True)
+    weekday_meals = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = MealSchedule
+        fields = ('id', 'mess', 'member', 'starts_on', 'weekday_meals', 'created_at')
+    
+    def get_weekday_meals(self, obj):
+        return [int(meals) for meals in obj.weekday_meals]
+
+class MealScheduleCreateSerializer(MessLookupMixin, serializers.Serializer):
+    member_id = serializers.IntegerField()
+    # Monday first
+    weekday_meals = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=3), min_length=7, max_length=7
+    )
+    starts_on = serializers.DateField(required=False)
+    
+    def validate(self, attrs):
+        attrs['member'] = self.resolve_member(attrs['member_id'])
+        attrs['weekday_meals'] = ''.join(str(meals) for meals in attrs['weekday_meals'])
+        return attrs
 
 class MemberMealSummarySerializer(serializers.ModelSerializer):
     member = UserBasicSerializer(read_only=True)
@@ -146,38 +285,96 @@ class MonthlyCalculationSerializer(serializers.ModelSerializer):
         read_only_fields = ('id', 'mess', 'calculated_by', 'calculated_at')
     
     def get_member_meals(self, obj):
-        return {str(summary.member.id): summary.total_meals for summary in obj.member_summaries.all()}
+        return {str(summary.member_id): summary.total_meals for summary in obj.member_summaries.all()}
     
     def get_member_costs(self, obj):
-        return {str(summary.member.id): float(summary.total_cost) for summary in obj.member_summaries.all()}
+        return {str(summary.member_id): str(summary.total_cost) for summary in obj.member_summaries.all()}
     
     def get_member_contributions(self, obj):
-        return {str(summary.member.id): float(summary.contributed_amount) for summary in obj.member_summaries.all()}
+        return {str(summary.member_id): str(summary.contributed_amount) for summary in obj.member_summaries.all()}
     
     def get_member_balances(self, obj):
-        return {str(summary.member.id): float(summary.balance) for summary in obj.member_summaries.all()}
+        return {str(summary.member_id): str(summary.balance) for summary in obj.member_summaries.all()}
+
+def clean_member_contributions(value):
+    if not value or len(value) == 0:
+        raise serializers.ValidationError("At least one member contribution is required")
+    
+    seen = set()
+    for contribution in value:
+        if 'member_id' not in contribution or 'amount' not in contribution:
+            raise serializers.ValidationError("Each contribution must have 'member_id' and 'amount'")
+        
+        try:
+            contribution['member_id'] = int(contribution['member_id'])
+        except (TypeError, ValueError):
+            raise serializers.ValidationError(f"Invalid member ID {contribution['member_id']!r}")
+        # One contribution row per member and month
+        if contribution['member_id'] in seen:
+            raise serializers.ValidationError(f"Duplicate contribution for member {contribution['member_id']}")
+        seen.add(contribution['member_id'])
+        
+        try:
+            paisa = to_paisa(contribution['amount'])
+        except ValueError:
+            raise serializers.ValidationError(f"Invalid amount for member {contribution['member_id']}")
+        if not 0 <= paisa <= MAX_MONTH_PAISA:
+            raise serializers.ValidationError(
+                f"Amount for member {contribution['member_id']} must be between 0 and {MAX_MONTH_AMOUNT}"
+            )
+    
+    return value
 
-class MonthlyCalculationCreateSerializer(serializers.Serializer):
+class MonthlyCalculationCreateSerializer(MessLookupMixin, serializers.Serializer):
     member_contributions = serializers.ListField(
         child=serializers.DictField(),
         help_text="List of member contributions: [{'member_id': 1, 'amount': 2100}, ...]"
     )
-    extra_cost = serializers.DecimalField(max_digits=10, decimal_places=2, default=0)
+    extra_cost = serializers.DecimalField(
+        max_digits=10, decimal_places=2, default=0, min_value=0, max_value=MAX_MONTH_AMOUNT
+    )
     
     def validate_member_contributions(self, value):
-        if not value or len(value) == 0:
-            raise serializers.ValidationError("At least one member contribution is required")
-        
-        for contribution in value:
-            if 'member_id' not in contribution or 'amount' not in contribution:
-                raise serializers.ValidationError("Each contribution must have 'member_id' and 'amount'")
-            
-            try:
-                User.objects.get(id=contribution['member_id'])
-            except User.DoesNotExist:
-                raise serializers.ValidationError(f"Member with ID {contribution['member_id']} not found")
-        
-        return value
+        return clean_member_contributions(value)
+    
+    def validate(self, attrs):
+        total = to_paisa(attrs['extra_cost']) + sum(
+            to_paisa(contribution['amount']) for contribution in attrs['member_contributions']
+        )
+        if total > MAX_MONTH_PAISA:
+            raise serializers.ValidationError(
+                {'member_contributions': f"Contributions plus extra cost must not exceed {MAX_MONTH_AMOUNT}"}
+            )
+        # Resolve every referenced member in one query
+        member_ids = {contribution['member_id'] for contribution in attrs['member_contributions']}
+        attrs['members'] = self.resolve_members(member_ids, 'member_contributions')
+        return attrs
+
+MAX_SIMULATION_SCENARIOS = 50
+
+class CalculationScenarioSerializer(serializers.Serializer):
+    # Left out: the contributions already saved for the month
+    member_contributions = serializers.ListField(child=serializers.DictField(), required=False)
+    extra_cost = serializers.DecimalField(
+        max_digits=10, decimal_places=2, default=0, min_value=0, max_value=MAX_MONTH_AMOUNT
+    )
+    
+    def validate_member_contributions(self, value):
+        return clean_member_contributions(value)
+
+class CalculationSimulationSerializer(MessLookupMixin, serializers.Serializer):
+    scenarios = CalculationScenarioSerializer(many=True, allow_empty=False, max_length=MAX_SIMULATION_SCENARIOS)
+    
+    def validate(self, attrs):
+        # Every scenario's members checked with one query
+        member_ids = {
+            contribution['member_id']
+            for scenario in attrs['scenarios']
+            for contribution in scenario.get('member_contributions', ())
+        }
+        if member_ids:
+            self.resolve_members(member_ids, 'scenarios')
+        return attrs
 # class MemberRequestSerializer(serializers.ModelSerializer):
 #     class Meta:
 #         model = MemberRequest
@@ -290,7 +487,7 @@ class MonthlyCalculationCreateSerializer(serializers.Serializer):
 #         return {str(summary.member.id): summary.total_meals for summary in obj.member_summaries.all()}
     
 #     def get_member_costs(self, obj):
-#         return {str(summary.member.id): float(summary.total_cost) for summary in obj.member_summaries.all()}
+#         return {str(summary.member.id): str(summary.total_cost) for summary in obj.member_summaries.all()}
 
 # class MonthlyCalculationCreateSerializer(serializers.Serializer):
 #     bazaar_cost = serializers.DecimalField(max_digits=10, decimal_places=2)
@@ -0,0 +1,194 @@
+"""
+Integer money engine for monthly calculations.
+
+All amounts are handled in paisa (1/100 taka) as plain ints so the math is
+exact and cheap. Decimals only appear at the edges: parsing request values
+with ``to_paisa`` and writing model fields with ``from_paisa``.
+"""
+import heapq
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from typing import NamedTuple
+
+PAISA_PER_TAKA = 100
+_CENT = Decimal('0.01')
+
+
+def to_paisa(value):
+    """Convert a taka amount (str, int, float or Decimal) to integer paisa."""
+    if type(value) is int:
+        return value * PAISA_PER_TAKA
+    if type(value) is str:
+        whole, dot, fraction = value.strip().partition('.')
+        negative = whole.startswith('-')
+        digits = whole[1:] if negative else whole
+        if digits.isdigit() and (not dot or (fraction.isdigit() and len(fraction) <= 2)):
+            paisa = int(digits) * PAISA_PER_TAKA + int(fraction.ljust(2, '0') or 0)
+            return -paisa if negative else paisa
+    try:
+        amount = Decimal(str(value))
+        if not amount.is_finite():
+            raise ValueError
+        # quantize itself fails once the exponent exceeds the context precision
+        return int(amount.quantize(_CENT, rounding=ROUND_HALF_UP) * PAISA_PER_TAKA)
+    except (InvalidOperation, ValueError, TypeError):
+        raise ValueError(f"Invalid amount: {value!r}")
+
+
+def from_paisa(paisa):
+    """Convert integer paisa back to a 2-place Decimal for DecimalFields."""
+    return Decimal(paisa).scaleb(-2).quantize(_CENT)
+
+
+def divide_round(numerator, denominator):
+    """Integer division rounded half away from zero."""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+def allocate(total, weights):
+    """
+    Split ``total`` paisa proportionally to ``weights`` (largest remainder).
+
+    The shares always sum exactly to ``total``. Leftover paisa go to the
+    largest fractional remainders, ties broken by position, so the result is
+    deterministic for a given input order.
+    """
+    weight_sum = sum(weights)
+    if weight_sum <= 0:
+        return [0] * len(weights)
+
+    shares = []
+    remainders = []
+    for weight in weights:
+        share, remainder = divmod(total * weight, weight_sum)
+        shares.append(share)
+        remainders.append(remainder)
+
+    leftover = total - sum(shares)
+    if leftover:
+        order = sorted(range(len(weights)), key=lambda i: (-remainders[i], i))
+        for i in order[:leftover]:
+            shares[i] += 1
+    return shares
+
+
+class Settlement(NamedTuple):
+    bazaar_cost: int
+    extra_cost: int
+    total_cost: int
+    total_meals: int
+    cost_per_meal: int
+    member_meals: dict
+    member_costs: dict
+    member_contributions: dict
+    member_balances: dict
+
+
+def settle(member_meals, member_contributions, extra_cost=0):
+    """
+    Compute a month's settlement for every member in one pass.
+
+    ``member_meals`` maps member id -> meal count and ``member_contributions``
+    maps member id -> paisa. Members appearing in either mapping get a row;
+    balance is contribution minus cost (positive = should receive).
+    """
+    member_ids = list(member_meals)
+    member_ids.extend(m for m in member_contributions if m not in member_meals)
+
+    meals = [member_meals.get(m, 0) for m in member_ids]
+    contributions = [member_contributions.get(m, 0) for m in member_ids]
+
+    bazaar_cost = sum(contributions)
+    total_cost = bazaar_cost + extra_cost
+    total_meals = sum(meals)
+    cost_per_meal = divide_round(total_cost, total_meals) if total_meals > 0 else 0
+    costs = allocate(total_cost, meals)
+
+    return Settlement(
+        bazaar_cost=bazaar_cost,
+        extra_cost=extra_cost,
+        total_cost=total_cost,
+        total_meals=total_meals,
+        cost_per_meal=cost_per_meal,
+        member_meals=dict(zip(member_ids, meals)),
+        member_costs=dict(zip(member_ids, costs)),
+        member_contributions=dict(zip(member_ids, contributions)),
+        member_balances={
+            m: paid - cost for m, paid, cost in zip(member_ids, contributions, costs)
+        },
+    )
+
+
+def settle_many(member_meals, scenarios):
+    """
+    ``settle`` for each ``(member_contributions, extra_cost)`` scenario over
+    the same month of meals, as a preview.
+
+    The member order and meal vector are built once; each scenario only adds
+    its contributors without meals (who always get a zero cost) and spreads
+    its total over the shared vector, and scenarios with the same total cost
+    share that allocation. Each result equals ``settle`` on the same inputs.
+    """
+    base_ids = list(member_meals)
+    base_meals = [member_meals[m] for m in base_ids]
+    total_meals = sum(base_meals)
+    allocations = {}
+
+    results = []
+    for member_contributions, extra_cost in scenarios:
+        member_ids = base_ids + [m for m in member_contributions if m not in member_meals]
+        meals = base_meals + [0] * (len(member_ids) - len(base_ids))
+        contributions = [member_contributions.get(m, 0) for m in member_ids]
+
+        bazaar_cost = sum(contributions)
+        total_cost = bazaar_cost + extra_cost
+        if total_cost not in allocations:
+            allocations[total_cost] = allocate(total_cost, base_meals)
+        costs = allocations[total_cost] + [0] * (len(member_ids) - len(base_ids))
+
+        results.append(Settlement(
+            bazaar_cost=bazaar_cost,
+            extra_cost=extra_cost,
+            total_cost=total_cost,
+            total_meals=total_meals,
+            cost_per_meal=divide_round(total_cost, total_meals) if total_meals > 0 else 0,
+            member_meals=dict(zip(member_ids, meals)),
+            member_costs=dict(zip(member_ids, costs)),
+            member_contributions=dict(zip(member_ids, contributions)),
+            member_balances={
+                m: paid - cost for m, paid, cost in zip(member_ids, contributions, costs)
+            },
+        ))
+    return results
+
+
+def plan_transfers(balances):
+    """
+    Greedy list of payments that clears ``balances`` (member id -> paisa).
+
+    The largest debtor always pays the largest creditor, which settles at
+    least one member per transfer, so there are at most n - 1 payments.
+    Whatever cannot be matched between members (e.g. an extra cost nobody
+    fronted) is paid to or from the mess itself, shown as ``None``.
+    """
+    creditors = [(-amount, member) for member, amount in balances.items() if amount > 0]
+    debtors = [(amount, member) for member, amount in balances.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        credit, creditor = heapq.heappop(creditors)
+        debt, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debt)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debt > amount:
+            heapq.heappush(debtors, (debt + amount, debtor))
+
+    transfers.extend((debtor, None, -debt) for debt, debtor in sorted(debtors))
+    transfers.extend((None, creditor, -credit) for credit, creditor in sorted(creditors))
+    return transfers
@@ -0,0 +1,85 @@
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from myproject import sharding
+from .dashboard import touch
+from .mess_cache import invalidate
+from .models import Mess, Membership, MANAGER_ROLES
+
+User = get_user_model()
+
+# User fields that appear in cached mess payloads (UserBasicSerializer)
+PAYLOAD_USER_FIELDS = {'email', 'phone', 'first_name', 'last_name'}
+# User fields only ever read on default, so saving just these isn't copied to shards
+DEFAULT_ONLY_USER_FIELDS = {'password', 'last_login', 'token_version'}
+SHARD_COPY_FIELDS = [
+    field.name for field in User._meta.concrete_fields if not field.primary_key and field.name != 'password'
+]
+
+
+@receiver(pre_delete, sender=User)
+def release_memberships(sender, instance, using, **kwargs):
+    # Cascade deletes bypass Membership.delete, so adjust the counters of
+    # every mess the user belonged to before the rows disappear (on each
+    # shard, as the user's copy there is deleted)
+    with sharding.use(using):
+        memberships = Membership.objects.using(using).filter(user=instance)
+        mess_ids = list(memberships.values_list('mess_id', flat=True))
+        manager_mess_ids = list(memberships.filter(role__in=MANAGER_ROLES).values_list('mess_id', flat=True))
+        Mess.objects.using(using).filter(id__in=mess_ids).update(member_count=F('member_count') - 1)
+        Mess.objects.using(using).filter(id__in=manager_mess_ids).update(manager_count=F('manager_count') - 1)
+        touch(mess_ids)
+        invalidate(mess_ids)
+
+
+@receiver(post_save, sender=User)
+def refresh_member_payloads(sender, instance, created, update_fields=None, **kwargs):
+    # A renamed member or new phone shows up in every mess they belong to
+    if created or (update_fields is not None and not PAYLOAD_USER_FIELDS & set(update_fields)):
+        return
+    invalidate([
+        mess_id
+        for mess_ids in sharding.fan_out(
+            lambda alias: list(Membership.objects.filter(user=instance).values_list('mess_id', flat=True))
+        )
+        for mess_id in mess_ids
+    ])
+
+
+def shard_copy(user):
+    """The row a shard keeps for a user: everything but the password."""
+    copy = User(**{field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields})
+    copy.password = ''
+    return copy
+
+
+def copy_users_to_shards(users):
+    for alias in sharding.shards():
+        if alias != DEFAULT_DB_ALIAS:
+            User.objects.using(alias).bulk_create(
+                [shard_copy(user) for user in users],
+                update_conflicts=True, unique_fields=['id'], update_fields=SHARD_COPY_FIELDS,
+            )
+
+
+@receiver(post_save, sender=User)
+def copy_user_to_shards(sender, instance, using, update_fields=None, **kwargs):
+    # Shards join memberships, meals and contributions to their own copy of
+    # the users table
+    if using != DEFAULT_DB_ALIAS or not sharding.enabled():
+        return
+    if update_fields is not None and set(update_fields) <= DEFAULT_ONLY_USER_FIELDS:
+        return
+    copy_users_to_shards([instance])
+
+
+@receiver(post_delete, sender=User)
+def delete_user_from_shards(sender, instance, using, **kwargs):
+    # Deleting each copy cascades to the user's rows on that shard
+    if using != DEFAULT_DB_ALIAS or not sharding.enabled():
+        return
+    for alias in sharding.shards():
+        if alias != DEFAULT_DB_ALIAS:
+            User.objects.using(alias).filter(pk=instance.pk).delete()
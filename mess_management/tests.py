@@ -1,3 +1,1323 @@
-from django.test import TestCase
+import random
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.admin.sites import AdminSite
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.test import APIClient
+
+from myproject import db_routers, sharding
+from myproject.querycheck import QueryDetectorMixin
+
+from .admin import ChangeLogEntryAdmin, MealAdmin, MemberContributionAdmin
+from . import history, matrix, mess_cache
+from .dashboard import _mess_key, current_tokens, get_dashboard
+from .management.commands import check_query_plans
+from .models import (
+    MANAGER_ROLES, ROLE_MANAGER, ROLE_MEMBER, ROLE_OWNER, ChangeLogEntry, Meal, MealSchedule, Membership, Mess,
+    MemberContribution, MemberRequest, MessShard, MonthlyCalculation,
+)
+from .schedules import effective_days, load, meal_totals, scheduled_meals
+from .serializers import MAX_BULK_MEMBERS
+from .settlement import allocate, divide_round, from_paisa, plan_transfers, settle, to_paisa
+from .views import MAX_BULK_REQUESTS, decide_member_requests
+
+User = get_user_model()
+
+# Generated cases per property; every test seeds its own generator so a
+# failure reproduces exactly
+CASES = 500
+
+
+def make_user(i):
+    return User.objects.create_user(
+        username=f"user{i}@example.com", email=f"user{i}@example.com", password='test-pass-123',
+        phone=f"0170000{i:04d}", first_name=f"User{i}", last_name='Test',
+    )
+
+
+class SettlementPropertyTests(SimpleTestCase):
+    """Invariants of the integer paisa engine over random inputs."""
+
+    def test_to_paisa_round_trips_every_amount(self):
+        rng = random.Random(1)
+        for _ in range(CASES):
+            paisa = rng.randint(-10 ** 9, 10 ** 9)
+            amount = from_paisa(paisa)
+            self.assertEqual(to_paisa(amount), paisa)
+            self.assertEqual(to_paisa(str(amount)), paisa)
+            self.assertEqual(to_paisa(float(amount)), paisa)
+
+    def test_to_paisa_string_fast_path_matches_decimal(self):
+        rng = random.Random(2)
+        for _ in range(CASES):
+            text = f"{rng.choice(['', '-'])}{rng.randint(0, 10 ** 6)}"
+            if rng.random() < 0.7:
+                text += '.' + str(rng.randint(0, 99)).zfill(rng.choice([1, 2]))[:rng.choice([1, 2])]
+            expected = int((Decimal(text) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+            self.assertEqual(to_paisa(text), expected, text)
+
+    def test_to_paisa_rejects_garbage(self):
+        for value in ('', 'abc', '1.2.3', 'NaN', 'Infinity', None, '1e', '--5', '-', '-.', '- 5', '-+5',
+                      '1e26', '1e30', '-1e30', Decimal('1e40')):
+            with self.assertRaises(ValueError, msg=repr(value)):
+                to_paisa(value)
+
+    def test_divide_round_is_half_away_from_zero(self):
+        rng = random.Random(3)
+        for _ in range(CASES):
+            numerator = rng.randint(-10 ** 8, 10 ** 8)
+            denominator = rng.randint(1, 10 ** 4)
+            expected = int((Decimal(numerator) / Decimal(denominator)).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+            self.assertEqual(divide_round(numerator, denominator), expected)
+
+    def test_allocate_sums_exactly_and_stays_proportional(self):
+        rng = random.Random(4)
+        for _ in range(CASES):
+            weights = [rng.choice([0, rng.randint(0, 93)]) for _ in range(rng.randint(1, 60))]
+            total = rng.randint(0, 10 ** 8)
+            shares = allocate(total, weights)
+            weight_sum = sum(weights)
+            if weight_sum == 0:
+                self.assertEqual(shares, [0] * len(weights))
+                continue
+            self.assertEqual(sum(shares), total)
+            for share, weight in zip(shares, weights):
+                # Within one paisa of the exact proportional share
+                self.assertLess(abs(share * weight_sum - total * weight), weight_sum)
+                if weight == 0:
+                    self.assertEqual(share, 0)
+            self.assertEqual(allocate(total, weights), shares)
+
+    def test_settle_balances_account_for_every_paisa(self):
+        rng = random.Random(5)
+        for _ in range(CASES):
+            member_meals = {m: rng.randint(0, 93) for m in range(1, rng.randint(1, 40))}
+            contributions = {m: rng.randint(0, 500000) for m in rng.sample(range(1, 50), rng.randint(0, 20))}
+            extra_cost = rng.randint(0, 100000)
+            result = settle(member_meals, contributions, extra_cost)
+
+            self.assertEqual(set(result.member_costs), set(member_meals) | set(contributions))
+            self.assertEqual(result.bazaar_cost, sum(contributions.values()))
+            self.assertEqual(result.total_cost, result.bazaar_cost + extra_cost)
+            self.assertEqual(result.total_meals, sum(member_meals.values()))
+            if result.total_meals:
+                self.assertEqual(sum(result.member_costs.values()), result.total_cost)
+                self.assertEqual(sum(result.member_balances.values()), -extra_cost)
+            for member_id, cost in result.member_costs.items():
+                self.assertEqual(result.member_balances[member_id], result.member_contributions[member_id] - cost)
+                if not member_meals.get(member_id):
+                    self.assertEqual(cost, 0)
+
+    def test_plan_transfers_clears_every_balance(self):
+        rng = random.Random(6)
+        for _ in range(CASES):
+            balances = {m: rng.randint(-100000, 100000) for m in range(1, rng.randint(1, 30))}
+            transfers = plan_transfers(balances)
+            remaining = dict(balances)
+            for debtor, creditor, amount in transfers:
+                self.assertGreater(amount, 0)
+                if debtor is not None:
+                    remaining[debtor] += amount
+                if creditor is not None:
+                    remaining[creditor] -= amount
+            self.assertEqual(set(remaining.values()) - {0}, set())
+            member_transfers = [t for t in transfers if t[0] is not None and t[1] is not None]
+            self.assertLessEqual(len(member_transfers), max(len(balances) - 1, 0))
+
+
+def materialize(schedules_by_member, entries, start, end):
+    """The reference: walk every member-day and store a row wherever there are meals."""
+    rows = {}
+    for member_id, schedules in schedules_by_member.items():
+        day = start
+        while day < end:
+            meals = scheduled_meals(schedules, day)
+            if meals:
+                rows[member_id, day] = meals
+            day += timedelta(days=1)
+    for member_id, day, meal_count in entries:
+        rows[member_id, day] = meal_count
+    return rows
+
+
+class MealScheduleEquivalenceTests(SimpleTestCase):
+    """Schedules plus exception entries against a fully materialized month."""
+    members = 30
+    # Share of member-days entered differently from the schedule, and of
+    # members who enter every day by hand
+    exception_rate = 0.1
+    unscheduled_rate = 0.05
+
+    def random_month(self, rng):
+        start = date(rng.randint(2020, 2030), rng.randint(1, 12), 1)
+        end = (start + timedelta(days=32)).replace(day=1)
+
+        schedules_by_member = {}
+        for member_id in range(1, self.members + 1):
+            # Schedules from before the month, some changing it mid-month
+            starts = []
+            if rng.random() >= self.unscheduled_rate:
+                starts = sorted({start - timedelta(days=rng.randint(0, 60))} | {
+                    start + timedelta(days=rng.randint(-40, 35)) for _ in range(rng.randint(0, 2))
+                })
+            schedules_by_member[member_id] = [
+                (day, ''.join(str(rng.choice((0, 1, 2, 2, 3))) for _ in range(7))) for day in starts
+            ]
+
+        entries = []
+        for member_id, schedules in schedules_by_member.items():
+            day = start
+            while day < end:
+                if not schedules or rng.random() < self.exception_rate:
+                    meals = rng.randint(0, 3)
+                    # add_meal never stores an entry equal to the schedule
+                    if meals != scheduled_meals(schedules, day):
+                        entries.append((member_id, day, meals))
+                day += timedelta(days=1)
+        return schedules_by_member, entries, start, end
+
+    def test_totals_and_days_match_materialized_month(self):
+        rng = random.Random(7)
+        stored_rows = materialized_rows = 0
+        for case in range(CASES):
+            schedules_by_member, entries, start, end = self.random_month(rng)
+            rows = materialize(schedules_by_member, entries, start, end)
+            expected = {}
+            for (member_id, _), meals in rows.items():
+                expected[member_id] = expected.get(member_id, 0) + meals
+
+            self.assertEqual(meal_totals(schedules_by_member, entries, start, end), expected, f"case {case}")
+            days = {
+                (member_id, day): meals
+                for member_id, member_days in effective_days(schedules_by_member, entries, start, end).items()
+                for day, meals in member_days.items()
+            }
+            self.assertEqual(days, rows, f"case {case}")
+
+            stored_rows += len(entries) + sum(len(s) for s in schedules_by_member.values())
+            materialized_rows += len(rows)
+        # The point of schedules: far fewer rows than one per member-day
+        self.assertLess(stored_rows, materialized_rows / 2)
+
+
+
+class MealScheduleChangeTests(TestCase):
+    """Changing a schedule once entries exist only changes days that aren't settled yet."""
+
+    def setUp(self):
+        self.owner, self.member = make_user(0), make_user(1)
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.mess = Mess.objects.create(name='Test mess', owner=self.owner)
+        self.mess.add_members([self.member.id])
+        self.today = timezone.localdate()
+        self.start = self.today - timedelta(days=40)
+        MealSchedule.objects.create(
+            mess=self.mess, member=self.member, starts_on=self.start, weekday_meals='2222222', created_by=self.owner,
+        )
+
+    def effective(self, start, end):
+        schedules, entries = load([self.mess.id], start, end)
+        days = effective_days(schedules.get(self.mess.id, {}), entries.get(self.mess.id, []), start, end)
+        return {day: days.get(self.member.id, {}).get(day, 0) for day in
+                (start + timedelta(days=i) for i in range((end - start).days))}
+
+    def set_schedule(self, starts_on, weekday_meals):
+        return self.client.post(f"/api/mess/{self.mess.id}/schedules/", {
+            'member_id': self.member.id, 'starts_on': str(starts_on), 'weekday_meals': weekday_meals,
+        }, format='json')
+
+    def add_meal(self, day, meal_count):
+        return self.client.post(f"/api/mess/{self.mess.id}/meals/", {
+            'member_id': self.member.id, 'date': str(day), 'meal_count': meal_count,
+        }, format='json')
+
+    def test_backdated_change_keeps_past_days(self):
+        # One exception, and one entry add_meal skips because it equals the schedule
+        self.add_meal(self.start + timedelta(days=12), 3)
+        self.add_meal(self.start + timedelta(days=15), 2)
+        horizon = self.today + timedelta(days=20)
+        before = self.effective(self.start, horizon)
+
+        self.assertIn(self.set_schedule(self.start + timedelta(days=10), [1] * 7).status_code, (200, 201))
+
+        after = self.effective(self.start, horizon)
+        for day, meals in after.items():
+            if day < self.today:
+                self.assertEqual(meals, before[day], day)
+            else:
+                self.assertEqual(meals, 1, day)
+        self.assertFalse(ChangeLogEntry.objects.filter(day__lt=self.today, new_value=1).exists())
+
+    def test_change_keeps_calculated_month(self):
+        month = self.today.strftime('%Y-%m')
+        response = self.client.post(f"/api/mess/{self.mess.id}/calculate/{month}/", {
+            'member_contributions': [{'member_id': self.member.id, 'amount': '100'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        month_start = self.today.replace(day=1)
+        next_month = (month_start + timedelta(days=32)).replace(day=1)
+        before = self.effective(month_start, next_month)
+
+        self.set_schedule(self.today, [0] * 7)
+
+        self.assertEqual(self.effective(month_start, next_month), before)
+        self.assertEqual(set(self.effective(next_month, next_month + timedelta(days=10)).values()), {0})
+
+    def test_removed_member_gets_no_later_meals(self):
+        MealSchedule.objects.create(
+            mess=self.mess, member=self.member, starts_on=self.today + timedelta(days=10),
+            weekday_meals='3333333', created_by=self.owner,
+        )
+        self.mess.remove_members([self.member.id])
+        later = self.effective(self.today, self.today + timedelta(days=30))
+        self.assertEqual(set(later.values()), {0})
+
+
+
+class MatrixPackingTests(SimpleTestCase):
+    def test_round_trips_both_encodings(self):
+        rng = random.Random(8)
+        for _ in range(CASES):
+            cells = bytearray(rng.randint(0, 3) for _ in range(rng.randint(0, 200)))
+            for encoding in matrix.ENCODINGS:
+                self.assertEqual(matrix.unpack(matrix.pack(cells, encoding), len(cells), encoding), cells)
+
+    def test_byte_encoding_keeps_unchanged_marker(self):
+        cells = bytearray([0, matrix.UNCHANGED, 3])
+        self.assertEqual(matrix.unpack(matrix.pack(cells, 'byte'), 3, 'byte'), cells)
+
+    def test_rejects_malformed_cells(self):
+        for data, count, encoding in (
+            ('not base64!', 4, '2bit'),
+            (matrix.pack([1] * 8), 12, '2bit'),
+            (matrix.pack([1] * 4, 'byte'), 5, 'byte'),
+            (matrix.pack([1, 4, 0], 'byte'), 3, 'byte'),
+        ):
+            with self.assertRaises(ValueError):
+                matrix.unpack(data, count, encoding)
+
+
+class MealMatrixTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(i) for i in range(4)]
+        self.owner, self.scheduled, self.unscheduled, self.former = self.users
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.mess = Mess.objects.create(name='Test mess', owner=self.owner)
+        self.mess.add_members([user.id for user in self.users[1:]])
+        MealSchedule.objects.create(
+            mess=self.mess, member=self.scheduled, starts_on=date(2025, 1, 1), weekday_meals='2222200',
+            created_by=self.owner,
+        )
+        Meal.objects.create(mess=self.mess, member=self.former, date=date(2025, 3, 3), meal_count=1,
+                            added_by=self.owner)
+        self.mess.remove_members([self.former.id])
+        self.url = f"/api/mess/{self.mess.id}/meals/2025-03/matrix/"
+
+    def test_unchanged_matrix_writes_nothing(self):
+        body = self.client.get(self.url).json()
+        self.assertIn(self.former.id, body['members'])
+        response = self.client.post(self.url, {'members': body['members'], 'cells': body['cells']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'stored': 0, 'cleared': 0})
+        self.assertEqual(Meal.objects.count(), 1)
+        self.assertFalse(ChangeLogEntry.objects.exists())
+
+    def test_changed_cells_are_stored_and_cleared(self):
+        body = self.client.get(self.url).json()
+        members, days = body['members'], body['days']
+        cells = matrix.unpack(body['cells'], len(members) * days)
+        row = members.index(self.unscheduled.id) * days
+        cells[row + 4] = 3
+        # 2025-03-03 is a Monday; the former member's entry back to nothing
+        cells[members.index(self.former.id) * days + 2] = 0
+        response = self.client.post(self.url, {'members': members, 'cells': matrix.pack(cells)}, format='json')
+        self.assertEqual(response.json(), {'stored': 2, 'cleared': 0})
+        self.assertEqual(
+            set(Meal.objects.values_list('member_id', 'date', 'meal_count')),
+            {(self.unscheduled.id, date(2025, 3, 5), 3), (self.former.id, date(2025, 3, 3), 0)},
+        )
+
+        # Writing the schedule's own value clears an entry instead of storing it
+        cells = bytearray([matrix.UNCHANGED]) * days
+        cells[2] = 2
+        Meal.objects.create(mess=self.mess, member=self.scheduled, date=date(2025, 3, 3), meal_count=3,
+                            added_by=self.owner)
+        response = self.client.post(self.url, {
+            'members': [self.scheduled.id], 'cells': matrix.pack(cells, 'byte'), 'encoding': 'byte',
+        }, format='json')
+        self.assertEqual(response.json(), {'stored': 0, 'cleared': 1})
+        self.assertFalse(Meal.objects.filter(member=self.scheduled).exists())
+
+    def test_strangers_are_rejected(self):
+        stranger = make_user(9)
+        response = self.client.post(self.url, {'members': [stranger.id], 'cells': matrix.pack([0] * 31)}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class CalculateMonthTests(TestCase):
+    def setUp(self):
+        self.users = [make_user(i) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        self.mess = Mess.objects.create(name='Test mess', owner=self.users[0])
+        self.mess.add_members([self.users[1].id, self.users[2].id])
+        self.url = f"/api/mess/{self.mess.id}/calculate/2025-03/"
+
+    def test_duplicate_member_contributions_are_rejected(self):
+        response = self.client.post(self.url, {'member_contributions': [
+            {'member_id': self.users[1].id, 'amount': '100'},
+            {'member_id': self.users[1].id, 'amount': '50'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MemberContribution.objects.exists())
+        self.assertFalse(MonthlyCalculation.objects.exists())
+
+    def test_out_of_range_amounts_are_rejected(self):
+        member = self.users[1].id
+        # Rejected by both calculate and simulate
+        invalid = [
+            {'member_contributions': [{'member_id': member, 'amount': amount}]}
+            for amount in ('1e30', '1e26', '1e12', '1000000', '-5', '-0.01')
+        ] + [
+            {'extra_cost': extra_cost, 'member_contributions': [{'member_id': member, 'amount': '10'}]}
+            for extra_cost in ('-1', '1e12')
+        ]
+        for body in invalid:
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post(self.url, body, format='json').status_code, 400)
+                response = self.client.post(f"{self.url}simulate/", {'scenarios': [body]}, format='json')
+                self.assertEqual(response.status_code, 400)
+        # Each amount fits, but the month's total could not be stored
+        too_large = [
+            {'extra_cost': '600000', 'member_contributions': [{'member_id': member, 'amount': '500000'}]},
+            {'member_contributions': [
+                {'member_id': member, 'amount': '999999.99'}, {'member_id': self.users[2].id, 'amount': '0.01'},
+            ]},
+        ]
+        for body in too_large:
+            with self.subTest(body=body):
+                self.assertEqual(self.client.post(self.url, body, format='json').status_code, 400)
+        self.assertFalse(MonthlyCalculation.objects.exists())
+
+    def test_largest_month_is_stored(self):
+        response = self.client.post(self.url, {'extra_cost': '0.99', 'member_contributions': [
+            {'member_id': self.users[1].id, 'amount': '999999'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['calculation']['total_cost'], '999999.99')
+
+    def test_amounts_are_stored_to_the_paisa(self):
+        response = self.client.post(self.url, {'extra_cost': '10.01', 'member_contributions': [
+            {'member_id': self.users[1].id, 'amount': '100.10'},
+            {'member_id': self.users[2].id, 'amount': '0.2'},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        calculation = response.json()['calculation']
+        self.assertEqual(calculation['bazaar_cost'], '100.30')
+        self.assertEqual(calculation['total_cost'], '110.31')
+        self.assertEqual(calculation['member_contributions'], {
+            str(self.users[1].id): '100.10', str(self.users[2].id): '0.20',
+        })
+        self.assertEqual(
+            sorted(MemberContribution.objects.values_list('amount', flat=True)),
+            [Decimal('0.20'), Decimal('100.10')],
+        )
+
+    def test_settlement_amounts_are_decimal_strings(self):
+        Meal.objects.bulk_create([
+            Meal(mess=self.mess, member=user, date='2025-03-01', meal_count=1, added_by=self.users[0])
+            for user in self.users
+        ])
+        self.client.post(self.url, {'member_contributions': [
+            {'member_id': self.users[1].id, 'amount': '100.10'},
+        ]}, format='json')
+        transfers = self.client.get(f"/api/mess/{self.mess.id}/settlement/2025-03/").json()['transfers']
+        self.assertTrue(transfers)
+        for transfer in transfers:
+            self.assertIsInstance(transfer['amount'], str)
+        # 100.10 over three meals is 33.37 + 33.37 + 33.36; the payer is owed the rest
+        self.assertEqual(sum(Decimal(t['amount']) for t in transfers), Decimal('66.73'))
+
+    def test_simulation_amounts_are_decimal_strings(self):
+        response = self.client.post(f"{self.url}simulate/", {'scenarios': [{'member_contributions': [
+            {'member_id': self.users[1].id, 'amount': '100.10'},
+        ]}]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        result = response.json()['scenarios'][0]
+        for field in ('member_costs', 'member_contributions', 'member_balances'):
+            for amount in result[field].values():
+                self.assertIsInstance(amount, str)
+        self.assertEqual(result['member_contributions'][str(self.users[1].id)], '100.10')
+        for transfer in result['transfers']:
+            self.assertIsInstance(transfer['amount'], str)
+
+
+class MealEventsTests(TestCase):
+    def test_wsgi_request_is_refused(self):
+        owner = make_user(0)
+        mess = Mess.objects.create(name='Test mess', owner=owner)
+        response = self.client.get(f"/api/mess/{mess.id}/events/")
+        self.assertEqual(response.status_code, 501)
+
+
+class ChangeLoggedAdminTests(TestCase):
+    def setUp(self):
+        self.user = make_user(0)
+        self.mess = Mess.objects.create(name='Test mess', owner=self.user)
+        self.request = RequestFactory().post('/admin/')
+        self.request.user = self.user
+
+    def test_meal_delete_is_recorded(self):
+        meal = Meal.objects.create(
+            mess=self.mess, member=self.user, date=date(2025, 3, 5), meal_count=2, added_by=self.user,
+        )
+        MealAdmin(Meal, AdminSite()).delete_model(self.request, meal)
+        entry = ChangeLogEntry.objects.get()
+        self.assertEqual((entry.kind, entry.month, entry.day), ('meal', '2025-03', date(2025, 3, 5)))
+        self.assertEqual((entry.old_value, entry.new_value), (Decimal('2'), None))
+
+    def test_contribution_delete_is_recorded(self):
+        contribution = MemberContribution.objects.create(
+            mess=self.mess, member=self.user, month='2025-03', amount=Decimal('120.50'), added_by=self.user,
+        )
+        MemberContributionAdmin(MemberContribution, AdminSite()).delete_queryset(self.request, MemberContribution.objects.all())
+        entry = ChangeLogEntry.objects.get()
+        self.assertEqual((entry.kind, entry.month, entry.day), ('contribution', '2025-03', None))
+        self.assertEqual((entry.old_value, entry.new_value), (Decimal('120.50'), None))
+        self.assertFalse(MemberContribution.objects.filter(pk=contribution.pk).exists())
+
+    def assertChanged(self, change, *events):
+        before = current_tokens([_mess_key(self.mess.id)])
+        with mock.patch('mess_management.events.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            change()
+        self.assertNotEqual(current_tokens([_mess_key(self.mess.id)]), before)
+        self.assertEqual([call.args for call in publish.call_args_list], [(self.mess.id, event) for event in events])
+
+    def test_meal_edits_refresh_dashboards_and_publish(self):
+        model_admin = MealAdmin(Meal, AdminSite())
+        meal = Meal(mess=self.mess, member=self.user, date=date(2025, 3, 5), meal_count=3, added_by=self.user)
+        self.assertChanged(
+            lambda: model_admin.save_model(self.request, meal, SimpleNamespace(initial={}), False),
+            {'type': 'meal', 'member_id': self.user.id, 'date': '2025-03-05', 'meal_count': 3},
+        )
+        self.assertChanged(
+            lambda: model_admin.delete_model(self.request, meal), {'type': 'meals', 'month': '2025-03'},
+        )
+
+    def test_contribution_edits_refresh_dashboards_and_publish(self):
+        model_admin = MemberContributionAdmin(MemberContribution, AdminSite())
+        contribution = MemberContribution.objects.create(
+            mess=self.mess, member=self.user, month='2025-03', amount=Decimal('100'), added_by=self.user,
+        )
+        contribution.amount = Decimal('120.50')
+        self.assertChanged(
+            lambda: model_admin.save_model(self.request, contribution, SimpleNamespace(initial={'amount': Decimal('100')}), True),
+            {'type': 'contribution', 'member_id': self.user.id, 'month': '2025-03', 'amount': '120.50'},
+        )
+        self.assertChanged(
+            lambda: model_admin.delete_queryset(self.request, MemberContribution.objects.all()),
+            {'type': 'contribution', 'member_id': self.user.id, 'month': '2025-03', 'amount': None},
+        )
+
+    def test_change_log_is_read_only(self):
+        self.user.is_superuser = self.user.is_staff = True
+        entry = ChangeLogEntry.objects.create(mess=self.mess, kind='meal', month='2025-03', day=date(2025, 3, 5))
+        model_admin = ChangeLogEntryAdmin(ChangeLogEntry, AdminSite())
+        self.assertFalse(model_admin.has_add_permission(self.request))
+        self.assertFalse(model_admin.has_change_permission(self.request, entry))
+        self.assertFalse(model_admin.has_delete_permission(self.request, entry))
+        self.assertNotIn('delete_selected', model_admin.get_actions(self.request))
+
+
+class MemberRequestDecisionTests(TestCase):
+    url = '/api/members/requests/bulk/'
+
+    def setUp(self):
+        self.admin = make_user(0)
+        self.admin.groups.add(Group.objects.create(name='Super_Admin'))
+        self.users = [make_user(i) for i in range(1, 6)]
+        self.requests = [
+            MemberRequest.objects.create(
+                user=user, first_name=user.first_name, last_name=user.last_name, email=user.email,
+                phone=user.phone, tran_id=f"tran-{user.id}",
+            )
+            for user in self.users
+        ]
+        MemberRequest.objects.filter(pk=self.requests[4].pk).update(status='Rejected')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def ids(self, *indexes):
+        return [self.requests[i].pk for i in indexes]
+
+    def approved_user_ids(self):
+        return set(User.objects.filter(groups__name=settings.MEMBER_REQUEST_APPROVED_GROUP).values_list('id', flat=True))
+
+    def test_decide_returns_only_the_requests_it_changed(self):
+        versions = dict(User.objects.values_list('id', 'token_version'))
+        rows = decide_member_requests(self.ids(0, 1, 1, 4) + [10 ** 6], 'Approved')
+        self.assertEqual(sorted(rows), [(self.requests[0].pk, self.users[0].id), (self.requests[1].pk, self.users[1].id)])
+        self.assertEqual(self.approved_user_ids(), {self.users[0].id, self.users[1].id})
+        # Their tokens carry the old groups
+        for user in User.objects.filter(id__in=[self.users[0].id, self.users[1].id]):
+            self.assertEqual(user.token_version, versions[user.id] + 1)
+        self.assertEqual(User.objects.get(pk=self.users[2].pk).token_version, versions[self.users[2].id])
+        # Already decided requests are never processed twice
+        self.assertEqual(decide_member_requests(self.ids(0, 1), 'Rejected'), [])
+        self.assertEqual(decide_member_requests([], 'Approved'), [])
+
+    def test_approving_a_user_already_in_the_group(self):
+        group = Group.objects.create(name=settings.MEMBER_REQUEST_APPROVED_GROUP)
+        self.users[2].groups.add(group)
+        self.assertEqual(len(decide_member_requests(self.ids(2, 3), 'Approved')), 2)
+        self.assertEqual(self.approved_user_ids(), {self.users[2].id, self.users[3].id})
+
+    def test_bulk_approve_reports_updated_and_skipped(self):
+        response = self.client.post(self.url, {'ids': self.ids(0, 1, 0, 4) + [10 ** 6]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], self.ids(0, 1))
+        self.assertEqual(response.data['skipped'], self.ids(4) + [10 ** 6])
+        self.assertEqual(response.data['message'], '2 requests approved')
+        self.assertEqual(
+            dict(MemberRequest.objects.values_list('pk', 'status')),
+            dict(zip(self.ids(0, 1, 2, 3, 4), ['Approved', 'Approved', 'Pending', 'Pending', 'Rejected'])),
+        )
+
+    def test_bulk_reject_adds_no_group(self):
+        response = self.client.post(self.url, {'ids': self.ids(2, 3), 'status': 'Rejected'}, format='json')
+        self.assertEqual(response.data['updated'], self.ids(2, 3))
+        self.assertEqual(self.approved_user_ids(), set())
+
+    def test_bulk_rejects_bad_input(self):
+        for data in ({'ids': []}, {'ids': 'x'}, {'ids': ['a']}, {'ids': self.ids(0), 'status': 'Pending'},
+                     {'ids': list(range(1, MAX_BULK_REQUESTS + 2))}):
+            with self.subTest(data=data):
+                self.assertEqual(self.client.post(self.url, data, format='json').status_code, 400)
+        self.assertEqual(MemberRequest.objects.filter(status='Pending').count(), 4)
+
+    def test_only_super_admins_decide(self):
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.post(self.url, {'ids': self.ids(0)}, format='json').status_code, 403)
+        response = self.client.patch(f"/api/members/request/{self.requests[0].pk}/approve/", {'status': 'Approved'}, format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_single_approve_goes_through_the_same_path(self):
+        url = f"/api/members/request/{self.requests[0].pk}/approve/"
+        response = self.client.patch(url, {'status': 'Approved'}, format='json')
+        self.assertEqual(response.data['request']['status'], 'Approved')
+        self.assertEqual(self.approved_user_ids(), {self.users[0].id})
+        # Deciding again changes nothing; Pending reopens it
+        response = self.client.patch(url, {'status': 'Rejected'}, format='json')
+        self.assertEqual(response.data['request']['status'], 'Approved')
+        response = self.client.patch(url, {'status': 'Pending'}, format='json')
+        self.assertEqual(MemberRequest.objects.get(pk=self.requests[0].pk).status, 'Pending')
+
+
+class BulkMembershipActionTests(QueryDetectorMixin, TestCase):
+    def setUp(self):
+        self.users = [make_user(i) for i in range(8)]
+        self.owner = self.users[0]
+        self.mess = Mess.objects.create(name='Test mess', owner=self.owner)
+        self.mess.add_members([user.id for user in self.users[1:4]])
+        self.mess.set_managers([self.users[1].id])
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.url = f"/api/mess/{self.mess.id}/"
+
+    def post(self, action, data, user=None):
+        if user is not None:
+            self.client.force_authenticate(user)
+        return self.client.post(f"{self.url}{action}/", data, format='json')
+
+    def counts(self):
+        mess = Mess.objects.get(pk=self.mess.pk)
+        return mess.member_count, mess.manager_count
+
+    def test_add_members_reports_each_phone(self):
+        phones = [self.users[4].phone, self.users[5].phone, self.users[4].phone, self.users[2].phone, '01799999999']
+        with self.assertNoRepeatedQueries():
+            response = self.post('bulk_add_members', {'phones': phones}, user=self.users[1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'added': [self.users[4].id, self.users[5].id],
+            'already_members': [self.users[2].id],
+            'not_found': ['01799999999'],
+        })
+        self.assertEqual(self.counts(), (6, 2))
+
+    def test_remove_members_never_removes_the_owner(self):
+        ids = [self.owner.id, self.users[1].id, self.users[3].id, self.users[6].id]
+        response = self.post('bulk_remove_members', {'user_ids': ids}, user=self.users[1])
+        self.assertEqual(response.data, {
+            'removed': [self.users[1].id, self.users[3].id], 'not_members': [self.users[6].id],
+        })
+        self.assertEqual(self.counts(), (2, 1))
+
+    def test_add_managers(self):
+        ids = [self.owner.id, self.users[1].id, self.users[2].id, self.users[2].id, self.users[6].id]
+        response = self.post('bulk_add_managers', {'user_ids': ids})
+        self.assertEqual(response.data, {
+            'added': [self.users[2].id],
+            'already_managers': [self.owner.id, self.users[1].id],
+            'not_members': [self.users[6].id],
+        })
+        self.assertEqual(self.counts(), (4, 3))
+
+    def test_remove_managers_never_demotes_the_owner(self):
+        ids = [self.owner.id, self.users[1].id, self.users[2].id]
+        response = self.post('bulk_remove_managers', {'user_ids': ids})
+        self.assertEqual(response.data, {'removed': [self.users[1].id], 'not_managers': [self.users[2].id]})
+        self.assertEqual(self.counts(), (4, 1))
+
+    def test_permissions(self):
+        member, manager = self.users[2], self.users[1]
+        self.assertEqual(self.post('bulk_add_members', {'phones': [self.users[5].phone]}, user=member).status_code, 403)
+        self.assertEqual(self.post('bulk_remove_members', {'user_ids': [self.users[3].id]}, user=member).status_code, 403)
+        self.assertEqual(self.post('bulk_add_managers', {'user_ids': [member.id]}, user=manager).status_code, 403)
+        self.assertEqual(self.post('bulk_remove_managers', {'user_ids': [manager.id]}, user=manager).status_code, 403)
+        # Outsiders don't see the mess at all
+        self.assertEqual(self.post('bulk_add_members', {'phones': ['x']}, user=self.users[7]).status_code, 404)
+        self.assertEqual(self.counts(), (4, 2))
+
+    def test_rejects_empty_and_oversized_lists(self):
+        self.assertEqual(self.post('bulk_add_members', {'phones': []}).status_code, 400)
+        self.assertEqual(self.post('bulk_remove_members', {'user_ids': ['x']}).status_code, 400)
+        too_many = list(range(1, MAX_BULK_MEMBERS + 2))
+        self.assertEqual(self.post('bulk_add_managers', {'user_ids': too_many}).status_code, 400)
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    """Reads go to the replica only for safe requests of users who haven't written lately."""
+
+    def setUp(self):
+        cache.clear()
+        self.router = db_routers.ReplicaRouter()
+        self.factory = RequestFactory()
+        self.user = SimpleNamespace(id=1, is_authenticated=True)
+
+    def with_replica(self):
+        return mock.patch.object(db_routers, 'settings', SimpleNamespace(
+            DATABASES={'default': {}, 'replica': {}}, REPLICA_PIN_SECONDS=5,
+        ))
+
+    def request(self, method, user=None):
+        """(database the view's reads went to, response) for one request through the middleware."""
+        routed = []
+
+        def view(request):
+            # DRF authenticates inside the view
+            if user is not None:
+                request.user = user
+            routed.append(self.router.db_for_read(Meal))
+            return 'response'
+
+        request = getattr(self.factory, method.lower())('/api/mess/')
+        db_routers.ReplicaRoutingMiddleware(view)(request)
+        return routed[0]
+
+    def test_safe_requests_read_from_the_replica(self):
+        with self.with_replica():
+            for method in ('GET', 'HEAD', 'OPTIONS'):
+                self.assertEqual(self.request(method, self.user), 'replica')
+
+    def test_writes_pin_the_user_to_the_primary(self):
+        other = SimpleNamespace(id=2, is_authenticated=True)
+        with self.with_replica():
+            self.assertIsNone(self.request('POST', self.user))
+            self.assertEqual(self.request('GET', self.user), 'default')
+            self.assertEqual(self.request('GET', other), 'replica')
+            # Once the pin expires the replica has caught up
+            cache.delete(db_routers._pin_key(self.user.id))
+            self.assertEqual(self.request('GET', self.user), 'replica')
+            for method in ('PUT', 'PATCH', 'DELETE'):
+                cache.clear()
+                self.request(method, self.user)
+                self.assertEqual(self.request('GET', self.user), 'default')
+
+    def test_unknown_users_read_from_the_primary(self):
+        with self.with_replica():
+            self.assertEqual(self.request('GET'), 'default')
+            self.assertEqual(self.request('GET', SimpleNamespace(id=None, is_authenticated=False)), 'default')
+            # Loading a session user would itself query; until something has, reads stay on the primary
+            lazy = SimpleLazyObject(lambda: self.user)
+            self.assertEqual(self.request('GET', lazy), 'default')
+            lazy.id
+            self.assertEqual(self.request('GET', lazy), 'replica')
+
+    def test_without_a_replica_nothing_is_routed_or_pinned(self):
+        self.assertNotIn('replica', settings.DATABASES)
+        self.assertIsNone(self.request('GET', self.user))
+        self.assertIsNone(self.request('POST', self.user))
+        self.assertIsNone(cache.get(db_routers._pin_key(self.user.id)))
+
+    def test_outside_a_request_and_for_writes(self):
+        with self.with_replica():
+            self.assertIsNone(self.router.db_for_read(Meal))
+            self.assertEqual(self.router.db_for_write(Meal), 'default')
+            self.assertFalse(self.router.allow_migrate('replica', 'mess_management'))
+            self.assertTrue(self.router.allow_migrate('default', 'mess_management'))
+
+
+class MessCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        mess_cache.local.clear()
+        mess_cache.stats.clear()
+        self.users = [make_user(i) for i in range(3)]
+        self.mess = Mess.objects.create(name='Test mess', owner=self.users[0])
+        self.build = mock.Mock(side_effect=lambda ids: {item_id: f"value {item_id}" for item_id in ids})
+        self.keys = {1: 'test_key_1', 2: 'test_key_2'}
+
+    def test_builds_once_and_fills_both_tiers(self):
+        expected = {1: 'value 1', 2: 'value 2'}
+        self.assertEqual(mess_cache._get_or_build(self.keys, self.build), expected)
+        self.assertEqual(self.build.call_count, 1)
+        self.assertEqual(mess_cache._get_or_build(self.keys, self.build), expected)
+        mess_cache.local.clear()
+        self.assertEqual(mess_cache._get_or_build(self.keys, self.build), expected)
+        self.assertEqual(self.build.call_count, 1)
+        self.assertEqual(
+            {name: mess_cache.stats[name] for name in ('builds', 'hits_local', 'hits_shared')},
+            {'builds': 2, 'hits_local': 2, 'hits_shared': 2},
+        )
+        self.assertEqual(cache.get_many(['test_key_1_lock', 'test_key_2_lock']), {})
+
+    def test_waits_for_the_process_holding_the_lock(self):
+        cache.add('test_key_1_lock', 1)
+        # The other process finishes while this one polls
+        with mock.patch.object(mess_cache.time, 'sleep', side_effect=lambda _: cache.set('test_key_1', 'theirs')):
+            result = mess_cache._get_or_build(self.keys, self.build)
+        self.assertEqual(result, {1: 'theirs', 2: 'value 2'})
+        self.build.assert_called_once_with({2})
+        self.assertEqual(mess_cache.stats['lock_waits'], 1)
+        self.assertEqual(mess_cache.local.get('test_key_1'), 'theirs')
+
+    def test_builds_itself_when_the_lock_holder_gives_up(self):
+        cache.add('test_key_1_lock', 1)
+        with mock.patch.object(mess_cache, 'LOCK_WAIT', 0.05):
+            result = mess_cache._get_or_build({1: 'test_key_1'}, self.build)
+        self.assertEqual(result, {1: 'value 1'})
+        self.build.assert_called_once_with([1])
+        self.assertEqual(cache.get('test_key_1'), 'value 1')
+
+    def test_failed_build_releases_its_locks(self):
+        with self.assertRaises(RuntimeError):
+            mess_cache._get_or_build(self.keys, mock.Mock(side_effect=RuntimeError))
+        self.assertEqual(cache.get_many(['test_key_1_lock', 'test_key_2_lock']), {})
+
+    def member_ids(self):
+        return [member['id'] for member in mess_cache.payloads([self.mess.id])[self.mess.id]['members']]
+
+    def test_model_changes_replace_the_tokens(self):
+        self.assertEqual(self.member_ids(), [self.users[0].id])
+        self.assertEqual(mess_cache.mess_ids_for(self.users[1].id), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mess.add_members([self.users[1].id])
+        self.assertEqual(self.member_ids(), [self.users[0].id, self.users[1].id])
+        self.assertEqual(mess_cache.mess_ids_for(self.users[1].id), [self.mess.id])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.users[1].first_name = 'Renamed'
+            self.users[1].save()
+        self.assertEqual(mess_cache.payloads([self.mess.id])[self.mess.id]['members'][1]['first_name'], 'Renamed')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mess.remove_members([self.users[1].id])
+        self.assertEqual(mess_cache.mess_ids_for(self.users[1].id), [])
+        self.assertEqual(self.member_ids(), [self.users[0].id])
+
+    def test_nothing_changes_before_commit(self):
+        self.member_ids()
+        with self.captureOnCommitCallbacks(execute=False):
+            self.mess.add_members([self.users[1].id])
+        self.assertEqual(self.member_ids(), [self.users[0].id])
+
+    def test_api_writes_show_up_in_api_reads(self):
+        owner, member = APIClient(), APIClient()
+        owner.force_authenticate(self.users[0])
+        member.force_authenticate(self.users[1])
+        url = f"/api/mess/{self.mess.id}/"
+        self.assertEqual(owner.get(url).data['member_count'], 1)
+        self.assertEqual(member.get(url).status_code, 404)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            owner.post(f"{url}bulk_add_members/", {'phones': [self.users[1].phone]}, format='json')
+        self.assertEqual(owner.get(url).data['member_count'], 2)
+        self.assertEqual([mess['id'] for mess in member.get('/api/mess/').data['results']], [self.mess.id])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            owner.patch(url, {'name': 'Renamed mess'}, format='json')
+        self.assertEqual(member.get(url).data['name'], 'Renamed mess')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            owner.post(f"{url}bulk_remove_members/", {'user_ids': [self.users[1].id]}, format='json')
+        self.assertEqual(member.get(url).status_code, 404)
+        self.assertEqual(owner.get(url).data['member_count'], 1)
+
+
+class DashboardTests(TestCase):
+    url = '/api/mess/dashboard/?month=2025-03'
+
+    def setUp(self):
+        cache.clear()
+        self.users = [make_user(i) for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        self.mess = self.create_mess('A mess')
+
+    def create_mess(self, name):
+        mess = Mess.objects.create(name=name, owner=self.users[0])
+        mess.add_members([self.users[1].id])
+        # 20 meals for users[0], 10 for users[1]
+        Meal.objects.bulk_create([
+            Meal(mess=mess, member=user, date=date(2025, 3, day), meal_count=meals, added_by=self.users[0])
+            for user, meals in ((self.users[0], 2), (self.users[1], 1)) for day in range(1, 11)
+        ])
+        MemberContribution.objects.bulk_create([
+            MemberContribution(mess=mess, member=self.users[0], month='2025-03', amount=Decimal('400'), added_by=self.users[0]),
+            MemberContribution(mess=mess, member=self.users[1], month='2025-03', amount=Decimal('50'), added_by=self.users[0]),
+        ])
+        return mess
+
+    def dashboard(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return {mess['id']: mess for mess in response.data['messes']}
+
+    def queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.dashboard()
+        return len(queries)
+
+    def calculate(self, mess, month='2025-02', extra_cost=0):
+        MonthlyCalculation.objects.create(
+            mess=mess, month=month, bazaar_cost=0, extra_cost=extra_cost, total_cost=extra_cost, total_meals=0,
+            cost_per_meal=0, calculated_by=self.users[0],
+        )
+
+    def test_query_count_does_not_grow_with_messes(self):
+        self.calculate(self.mess)
+        one = self.queries()
+        for i in range(4):
+            self.calculate(self.create_mess(f"Mess {i}"))
+        self.assertEqual(self.queries(), one)
+        self.assertEqual(len(self.dashboard()), 5)
+
+    def test_projected_balance_before_calculation_excludes_extra_cost(self):
+        mess = self.dashboard()[self.mess.id]
+        self.assertEqual((mess['meals'], mess['mess_meals']), (20, 30))
+        self.assertEqual((mess['contribution'], mess['mess_contributions']), ('400.00', '450.00'))
+        self.assertIsNone(mess['projected_extra_cost'])
+        # 450 over 30 meals: 15.00 a meal, 300.00 for 20 of them
+        self.assertEqual((mess['projected_cost_per_meal'], mess['projected_balance']), ('15.00', '100.00'))
+        self.assertIsNone(mess['last_calculation'])
+
+    def test_projected_balance_includes_the_calculated_extra_cost(self):
+        MonthlyCalculation.objects.create(
+            mess=self.mess, month='2025-03', bazaar_cost=Decimal('450'), extra_cost=Decimal('90'),
+            total_cost=Decimal('540'), total_meals=30, cost_per_meal=Decimal('18'), calculated_by=self.users[0],
+        )
+        # A later calculation is the latest but not this month's
+        self.calculate(self.mess, '2025-04', Decimal('7'))
+        mess = self.dashboard()[self.mess.id]
+        self.assertEqual(mess['projected_extra_cost'], '90.00')
+        # 540 over 30 meals: 18.00 a meal, 360.00 for 20 of them
+        self.assertEqual((mess['projected_cost_per_meal'], mess['projected_balance']), ('18.00', '40.00'))
+        self.assertEqual(mess['last_calculation']['month'], '2025-04')
+
+    def test_cached_until_a_write_commits(self):
+        first = self.dashboard()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_dashboard(self.users[0], '2025-03', (date(2025, 3, 1), date(2025, 4, 1))), {
+                'month': '2025-03', 'messes': list(first.values()),
+            })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f"/api/mess/{self.mess.id}/meals/", {
+                'member_id': self.users[0].id, 'date': '2025-03-11', 'meal_count': 3,
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.dashboard()[self.mess.id]['meals'], 23)
+
+        # Joining another mess changes the user's token
+        other = Mess.objects.create(name='B mess', owner=self.users[2])
+        with self.captureOnCommitCallbacks(execute=False):
+            other.add_members([self.users[0].id])
+        self.assertNotIn(other.id, self.dashboard())
+        with self.captureOnCommitCallbacks(execute=True):
+            other.remove_members([self.users[0].id])
+            other.add_members([self.users[0].id])
+        self.assertIn(other.id, self.dashboard())
+
+
+class ChangeHistoryTests(TestCase):
+    def setUp(self):
+        self.owner, self.member, self.outsider = make_user(0), make_user(1), make_user(2)
+        self.mess = Mess.objects.create(name='Test mess', owner=self.owner)
+        self.mess.add_members([self.member.id])
+        rng = random.Random(11)
+        history.record([
+            history.meal_change(
+                self.mess.id, rng.choice([self.owner.id, self.member.id]), date(2025, 3, 1) + timedelta(days=i % 28),
+                Decimal(i % 3), Decimal(i % 3 + 1), self.owner,
+            ) if i % 4 else history.contribution_change(
+                self.mess.id, self.member.id, '2025-04', Decimal(i), Decimal(i + 1), self.owner,
+            )
+            for i in range(53)
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.member)
+        self.url = f"/api/mess/{self.mess.id}/history/"
+
+    def pages(self, **params):
+        ids, before = [], None
+        while True:
+            query = dict(params, **({'before': before} if before else {}))
+            response = self.client.get(self.url, query)
+            self.assertEqual(response.status_code, 200)
+            ids.append([change['id'] for change in response.data['changes']])
+            before = response.data['next_before']
+            if before is None:
+                return ids
+
+    def test_pages_walk_every_entry_once_newest_first(self):
+        pages = self.pages(limit=10)
+        self.assertEqual([len(page) for page in pages], [10, 10, 10, 10, 10, 3])
+        expected = list(ChangeLogEntry.objects.filter(mess=self.mess).order_by('-id').values_list('id', flat=True))
+        self.assertEqual([entry_id for page in pages for entry_id in page], expected)
+
+    def test_exact_multiple_has_no_empty_last_page(self):
+        ChangeLogEntry.objects.filter(id__in=ChangeLogEntry.objects.order_by('id').values('id')[:3]).delete()
+        self.assertEqual([len(page) for page in self.pages(limit=25)], [25, 25])
+
+    def test_filters_apply_to_every_page(self):
+        pages = self.pages(limit=7, kind='meal', member_id=self.member.id, month='2025-03')
+        expected = ChangeLogEntry.objects.filter(
+            mess=self.mess, kind='meal', member=self.member, month='2025-03',
+        ).order_by('-id')
+        self.assertEqual([entry_id for page in pages for entry_id in page], list(expected.values_list('id', flat=True)))
+
+    def test_limit_is_clamped(self):
+        response = self.client.get(self.url, {'limit': 0})
+        self.assertEqual(len(response.data['changes']), 1)
+        entries, next_before = history.page(self.mess.id, limit=10 ** 6)
+        self.assertEqual((len(entries), next_before), (53, None))
+
+    def test_rejects_bad_parameters_and_outsiders(self):
+        self.assertEqual(self.client.get(self.url, {'before': 'x'}).status_code, 400)
+        self.client.force_authenticate(self.outsider)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+
+
+class CompactHistoryTests(TestCase):
+    def setUp(self):
+        self.owner, self.member = make_user(0), make_user(1)
+        self.mess = Mess.objects.create(name='Test mess', owner=self.owner)
+
+    def meal(self, member, day, old, new):
+        history.record([history.meal_change(self.mess.id, member.id, day, old, new, self.owner)])
+
+    def test_folds_each_member_and_day_to_one_entry(self):
+        day = date(2025, 3, 5)
+        self.meal(self.owner, day, None, Decimal(1))
+        self.meal(self.owner, day, Decimal(1), Decimal(3))
+        self.meal(self.owner, day, Decimal(3), Decimal(2))
+        self.meal(self.member, day, None, Decimal(2))
+        self.meal(self.owner, day + timedelta(days=1), Decimal(0), Decimal(1))
+        history.record([
+            history.contribution_change(self.mess.id, self.owner.id, '2025-03', None, Decimal('10'), self.owner),
+            history.contribution_change(self.mess.id, self.owner.id, '2025-03', Decimal('10'), None, self.owner),
+        ])
+        # Another month is left alone
+        self.meal(self.owner, date(2025, 4, 1), None, Decimal(1))
+        self.meal(self.owner, date(2025, 4, 1), Decimal(1), Decimal(2))
+        newest = ChangeLogEntry.objects.filter(member=self.owner, day=day).latest('id')
+
+        self.assertEqual(history.compact(self.mess.id, '2025-03'), 3)
+
+        folded = ChangeLogEntry.objects.get(member=self.owner, day=day)
+        self.assertEqual(folded.id, newest.id)
+        self.assertEqual((folded.old_value, folded.new_value, folded.changes), (None, Decimal(2), 3))
+        contribution = ChangeLogEntry.objects.get(kind='contribution')
+        self.assertEqual((contribution.old_value, contribution.new_value, contribution.changes), (None, None, 2))
+        self.assertEqual(ChangeLogEntry.objects.filter(month='2025-03').count(), 4)
+        self.assertEqual(ChangeLogEntry.objects.filter(month='2025-04').count(), 2)
+
+    def test_compacting_twice_keeps_the_totals(self):
+        day = date(2025, 3, 5)
+        for old, new in ((None, 1), (1, 2)):
+            self.meal(self.owner, day, old, Decimal(new))
+        history.compact(self.mess.id, '2025-03')
+        self.meal(self.owner, day, Decimal(2), Decimal(3))
+        self.assertEqual(history.compact(self.mess.id, '2025-03'), 1)
+        self.assertEqual(history.compact(self.mess.id, '2025-03'), 0)
+        folded = ChangeLogEntry.objects.get()
+        self.assertEqual((folded.old_value, folded.new_value, folded.changes), (None, Decimal(3), 3))
+
+
+class MembershipCounterTests(TestCase):
+    """member_count/manager_count always equal what the Membership rows say."""
+
+    def setUp(self):
+        self.users = [make_user(i) for i in range(8)]
+        self.mess = Mess.objects.create(name='Test mess', owner=self.users[0])
+
+    def assertCountsMatch(self, mess=None):
+        mess = Mess.objects.get(pk=(mess or self.mess).pk)
+        memberships = Membership.objects.filter(mess=mess)
+        self.assertEqual(
+            (mess.member_count, mess.manager_count),
+            (memberships.count(), memberships.filter(role__in=MANAGER_ROLES).count()),
+        )
+        return mess.member_count, mess.manager_count
+
+    def test_new_mess_counts_its_owner(self):
+        self.assertEqual(self.assertCountsMatch(), (1, 1))
+
+    def test_add_remove_promote(self):
+        ids = [user.id for user in self.users]
+        self.assertEqual(self.mess.add_members(ids[1:5]), (ids[1:5], []))
+        self.assertEqual(self.mess.add_members(ids[3:6]), ([ids[5]], ids[3:5]))
+        self.assertEqual(self.assertCountsMatch(), (6, 1))
+        self.assertEqual(self.mess.set_managers(ids[1:3] + [ids[7]]), ids[1:3])
+        self.assertEqual(self.mess.set_managers(ids[1:3]), [])
+        self.assertEqual(self.assertCountsMatch(), (6, 3))
+        # The owner is never removed or demoted
+        self.assertEqual(self.mess.remove_members([ids[0], ids[2], ids[4]]), [ids[2], ids[4]])
+        self.assertEqual(self.mess.set_managers([ids[0], ids[1]], is_manager=False), [ids[1]])
+        self.assertEqual(self.assertCountsMatch(), (4, 1))
+
+    def test_random_operations(self):
+        rng = random.Random(7)
+        ids = [user.id for user in self.users]
+        for _ in range(100):
+            chosen = rng.sample(ids, rng.randint(1, 4))
+            operation = rng.choice(['add', 'remove', 'promote', 'demote'])
+            if operation == 'add':
+                self.mess.add_members(chosen)
+            elif operation == 'remove':
+                self.mess.remove_members(chosen)
+            else:
+                self.mess.set_managers(chosen, is_manager=operation == 'promote')
+            self.assertCountsMatch()
+
+    def test_single_row_edits(self):
+        membership = Membership.objects.create(mess=self.mess, user=self.users[1])
+        self.assertEqual(self.assertCountsMatch(), (2, 1))
+        membership.role = ROLE_MANAGER
+        membership.save()
+        self.assertEqual(self.assertCountsMatch(), (2, 2))
+        membership.delete()
+        self.assertEqual(self.assertCountsMatch(), (1, 1))
+
+    def test_user_delete_releases_memberships(self):
+        other = Mess.objects.create(name='Other mess', owner=self.users[1])
+        for mess in (self.mess, other):
+            mess.add_members([self.users[2].id, self.users[3].id])
+            mess.set_managers([self.users[2].id])
+        self.users[2].delete()
+        self.assertEqual(self.assertCountsMatch(self.mess), (2, 1))
+        self.assertEqual(self.assertCountsMatch(other), (2, 1))
+
+    def test_backfill_from_the_old_join_tables(self):
+        with connection.cursor() as cursor:
+            for table in ('messes_members', 'messes_managers'):
+                cursor.execute(f"CREATE TABLE {table} (id integer PRIMARY KEY, mess_id integer, user_id integer)")
+            cursor.executemany('INSERT INTO messes_members (mess_id, user_id) VALUES (%s, %s)', [
+                (self.mess.id, self.users[0].id), (self.mess.id, self.users[1].id), (self.mess.id, self.users[2].id),
+            ])
+            cursor.executemany('INSERT INTO messes_managers (mess_id, user_id) VALUES (%s, %s)', [
+                (self.mess.id, self.users[0].id), (self.mess.id, self.users[2].id), (self.mess.id, self.users[3].id),
+            ])
+        # users[2] already joined as a plain member; the counters drifted
+        Membership.objects.bulk_create([Membership(mess=self.mess, user=self.users[2])])
+        Mess.objects.filter(pk=self.mess.pk).update(member_count=0, manager_count=9)
+
+        for _ in range(2):
+            out = StringIO()
+            call_command('backfill_memberships', stdout=out)
+            self.assertEqual(dict(Membership.objects.filter(mess=self.mess).values_list('user_id', 'role')), {
+                self.users[0].id: ROLE_OWNER, self.users[1].id: ROLE_MEMBER,
+                self.users[2].id: ROLE_MANAGER, self.users[3].id: ROLE_MANAGER,
+            })
+            self.assertEqual(self.assertCountsMatch(), (4, 3))
+        # Re-running changes nothing
+        self.assertIn('Created 0 memberships, promoted 0', out.getvalue())
+
+
+@unittest.skipUnless(sharding.enabled(), 'run with DJANGO_SETTINGS_MODULE=myproject.test_shard_settings')
+class ShardingTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        sharding._locations.clear()
+        self.users = [make_user(i) for i in range(4)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def tearDown(self):
+        sharding._locations.clear()
+
+    def create_messes(self, count):
+        for i in range(count):
+            response = self.client.post('/api/mess/', {'name': f"Mess {i}", 'description': ''}, format='json')
+            self.assertEqual(response.status_code, 201)
+        return list(MessShard.objects.order_by('id').values_list('id', 'alias'))
+
+    def test_users_are_copied_without_passwords(self):
+        for alias in ('shard_1', 'shard_2'):
+            copy = User.objects.using(alias).get(pk=self.users[1].pk)
+            self.assertEqual((copy.email, copy.password), (self.users[1].email, ''))
+        self.users[1].first_name = 'Renamed'
+        self.users[1].save()
+        self.assertEqual(User.objects.using('shard_2').get(pk=self.users[1].pk).first_name, 'Renamed')
+        # Fields only read on default aren't copied
+        self.users[1].last_login = timezone.now()
+        self.users[1].save(update_fields=['last_login'])
+        self.assertIsNone(User.objects.using('shard_2').get(pk=self.users[1].pk).last_login)
+
+    def test_messes_live_on_their_shard_only(self):
+        placed = self.create_messes(8)
+        self.assertEqual({alias for _, alias in placed}, {'shard_1', 'shard_2'})
+        for mess_id, alias in placed:
+            self.assertEqual(sharding.shard_for(mess_id), alias)
+            other = 'shard_2' if alias == 'shard_1' else 'shard_1'
+            self.assertTrue(Membership.objects.using(alias).filter(mess_id=mess_id, user=self.users[0]).exists())
+            self.assertFalse(Mess.objects.using(other).filter(pk=mess_id).exists())
+            self.assertFalse(Mess.objects.using('default').filter(pk=mess_id).exists())
+
+    @override_settings(SHARD_STRATEGY='lookup')
+    def test_lookup_strategy_fills_the_least_loaded_shard(self):
+        aliases = [alias for _, alias in self.create_messes(4)]
+        self.assertEqual(sorted(aliases), ['shard_1', 'shard_1', 'shard_2', 'shard_2'])
+        sharding._locations.clear()
+        for mess_id, alias in MessShard.objects.values_list('id', 'alias'):
+            self.assertEqual(sharding.shard_for(mess_id), alias)
+
+    def test_requests_are_routed_to_the_mess_shard(self):
+        placed = self.create_messes(6)
+        one = placed[0]
+        other = next(pair for pair in placed if pair[1] != one[1])
+        for mess_id, alias in (one, other):
+            response = self.client.post(f"/api/mess/{mess_id}/meals/", {
+                'member_id': self.users[0].id, 'date': '2025-03-05', 'meal_count': 3,
+            }, format='json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(Meal.objects.using(alias).filter(mess_id=mess_id).count(), 1)
+            self.assertEqual(ChangeLogEntry.objects.using(alias).filter(mess_id=mess_id).count(), 1)
+            response = self.client.get(f"/api/mess/{mess_id}/meals/2025-03/")
+            self.assertEqual(len(response.data['meals']), 1)
+        self.assertEqual(Meal.objects.using(one[1]).count() + Meal.objects.using(other[1]).count(), 2)
+        # Outside a request nothing is selected
+        self.assertEqual(sharding.current_db(), 'default')
+
+    def test_fan_out_visits_every_shard(self):
+        placed = self.create_messes(6)
+        self.assertEqual(sharding.fan_out(lambda alias: (alias, sharding.current_db())), [
+            ('shard_1', 'shard_1'), ('shard_2', 'shard_2'),
+        ])
+        self.assertEqual(
+            sorted(mess_id for ids in sharding.fan_out(lambda alias: list(Mess.objects.values_list('id', flat=True)))
+                   for mess_id in ids),
+            [mess_id for mess_id, _ in placed],
+        )
+        # The mess list merges both shards
+        response = self.client.get('/api/mess/')
+        self.assertEqual(sorted(mess['id'] for mess in response.data['results']), [mess_id for mess_id, _ in placed])
+
+    def test_user_delete_reaches_every_shard(self):
+        placed = self.create_messes(6)
+        for mess_id, alias in placed:
+            with sharding.atomic(mess_id):
+                Mess.objects.get(pk=mess_id).add_members([self.users[1].id, self.users[2].id])
+        self.users[1].delete()
+        for alias in ('shard_1', 'shard_2'):
+            self.assertFalse(User.objects.using(alias).filter(pk=self.users[1].pk).exists())
+            self.assertFalse(Membership.objects.using(alias).filter(user_id=self.users[1].pk).exists())
+        for mess_id, alias in placed:
+            self.assertEqual(Mess.objects.using(alias).get(pk=mess_id).member_count, 2)
+
+    def test_sync_shard_users_restores_missing_copies(self):
+        User.objects.using('shard_2').filter(pk=self.users[3].pk).delete()
+        call_command('sync_shard_users', stdout=StringIO())
+        self.assertTrue(User.objects.using('shard_2').filter(pk=self.users[3].pk).exists())
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'EXPLAIN output is PostgreSQL-specific')
+class QueryPlanTests(TestCase):
+    """The hot queries checked by ``check_query_plans`` use the index added for each."""
+
+    def setUp(self):
+        user = make_user(0)
+        Mess.objects.create(name='Test mess', owner=user)
+        with connection.cursor() as cursor:
+            # An almost empty table always looks cheapest to scan; this asks
+            # whether the index is usable for the query shape at all
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def test_hot_queries_use_their_indexes(self):
+        for index_name, queryset in check_query_plans.Command().plan_cases():
+            with self.subTest(index=index_name):
+                self.assertIn(index_name, queryset.explain())
+
+
+class EndpointQueryTests(QueryDetectorMixin, TestCase):
+    """The read and calculation endpoints run a fixed number of queries, not one per member."""
+    members = 12
+
+    def setUp(self):
+        self.users = [make_user(i) for i in range(self.members)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        for i in range(3):
+            mess = Mess.objects.create(name=f"Test mess {i}", owner=self.users[0])
+            mess.add_members([user.id for user in self.users[1:]])
+        self.mess = mess
+        self.mess.set_managers([user.id for user in self.users[1:4]])
+        Meal.objects.bulk_create([
+            Meal(mess=self.mess, member=user, date=date(2025, 3, day), meal_count=day % 4, added_by=self.users[0])
+            for user in self.users for day in range(1, 8)
+        ])
+
+    def test_mess_list(self):
+        with self.assertNoRepeatedQueries():
+            response = self.client.get('/api/mess/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_mess_retrieve(self):
+        with self.assertNoRepeatedQueries():
+            response = self.client.get(f"/api/mess/{self.mess.id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['members']), self.members)
+
+    def test_meals(self):
+        with self.assertNoRepeatedQueries():
+            response = self.client.get(f"/api/mess/{self.mess.id}/meals/2025-03/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['meals']), self.members * 7)
+
+    def test_calculation(self):
+        url = f"/api/mess/{self.mess.id}/calculate/2025-03/"
+        with self.assertNoRepeatedQueries():
+            response = self.client.post(url, {'extra_cost': '99.99', 'member_contributions': [
+                {'member_id': user.id, 'amount': '250.50'} for user in self.users[:6]
+            ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        with self.assertNoRepeatedQueries():
+            response = self.client.get(f"/api/mess/{self.mess.id}/calculation/2025-03/")
+        self.assertEqual(len(response.json()['calculation']['member_summaries']), self.members)
@@ -9,10 +9,17 @@ urlpatterns = [
     path('', include(router.urls)),
     path('mess/<int:mess_id>/meals/', views.add_meal, name='add_meal'),
     path('mess/<int:mess_id>/meals/<str:month>/', views.get_meals, name='get_meals'),
+    path('mess/<int:mess_id>/meals/<str:month>/matrix/', views.meal_matrix, name='meal_matrix'),
+    path('mess/<int:mess_id>/schedules/', views.manage_meal_schedules, name='manage_meal_schedules'),
     path('mess/<int:mess_id>/calculate/<str:month>/', views.calculate_month, name='calculate_month'),
+    path('mess/<int:mess_id>/calculate/<str:month>/simulate/', views.simulate_month, name='simulate_month'),
     path('mess/<int:mess_id>/calculation/<str:month>/', views.get_calculation, name='get_calculation'),
+    path('mess/<int:mess_id>/events/', views.meal_events, name='meal_events'),
+    path('mess/<int:mess_id>/settlement/<str:month>/', views.get_settlement, name='get_settlement'),
     path('mess/<int:mess_id>/contributions/<str:month>/', views.manage_contributions, name='manage_contributions'),
+    path('mess/<int:mess_id>/history/', views.change_history, name='change_history'),
     path("members/request/<int:pk>/approve/", views.approve_member_request, name="approve_member_request"),
+    path("members/requests/bulk/", views.bulk_decide_member_requests, name="bulk_decide_member_requests"),
     path("members/all-requests/", views.all_member_requests, name="all_member_requests"),
     path("members/become-member/", views.become_member_request, name="become_member_request"),
 ]
\ No newline at end of file
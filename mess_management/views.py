@@ -4,16 +4,34 @@ from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 from django.shortcuts import get_object_or_404
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from datetime import datetime
-from .models import Mess, Meal, MonthlyCalculation, MemberMealSummary,MemberRequest,MemberContribution
+from django.conf import settings
+from django.contrib.auth.models import Group
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
+from datetime import date, datetime
+import asyncio
+import json
+import os
+from .models import Mess, Meal, MealSchedule, MonthlyCalculation, MemberMealSummary,MemberRequest,MemberContribution,Membership,MANAGER_ROLES
 from .serializers import (
     MessSerializer, MessCreateSerializer, AddMemberSerializer, AddManagerSerializer,
     MealSerializer, MealCreateSerializer, MonthlyCalculationSerializer,
-    MonthlyCalculationCreateSerializer,MemberRequestSerializer,MemberContributionSerializer,MemberContributionCreateSerializer
+    MonthlyCalculationCreateSerializer,MemberRequestSerializer,MemberContributionSerializer,MemberContributionCreateSerializer,
+    BulkPhonesSerializer, BulkUserIdsSerializer, MealScheduleSerializer, MealScheduleCreateSerializer,
+    MealMatrixSerializer, ChangeLogEntrySerializer, CalculationSimulationSerializer
 )
 from rest_framework.permissions import IsAuthenticated
-from decimal import Decimal
+from .settlement import settle, settle_many, plan_transfers, to_paisa, from_paisa
+from .events import hub, ensure_listener, publish_on_commit
+from .dashboard import get_dashboard, touch
+from .schedules import meal_totals_for, month_meals, pin_settled_days, redundant_entries, scheduled_meals_on
+from . import history, matrix, mess_cache
+from myproject import sharding
+from myproject.tracing import serialize
+from accounts.authentication import CachedJWTAuthentication, has_group, revoke_tokens_for_users
 User = get_user_model()
 
 @api_view(['GET', 'POST'])
@@ -36,50 +54,126 @@ def become_member_request(request):
             serializer.save(user=user)
             return Response({
                 "message": "Member request submitted successfully",
-                "request": serializer.data
+                "request": serialize(serializer)
             }, status=status.HTTP_201_CREATED)
         return Response({"error": serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
     
     elif request.method == "GET":
         # List member requests for the logged-in user
-        requests = MemberRequest.objects.filter(user=user)
+        requests = MemberRequest.objects.filter(user=user).select_related('user').order_by('-created_at')
         serializer = MemberRequestSerializer(requests, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return Response(serialize(serializer), status=status.HTTP_200_OK)
     
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def all_member_requests(request):
-    requests = MemberRequest.objects.all()
+    requests = MemberRequest.objects.select_related('user').order_by('-created_at')
+    if request.query_params.get('status'):
+        requests = requests.filter(status=request.query_params['status'])
     serializer = MemberRequestSerializer(requests, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return Response(serialize(serializer), status=status.HTTP_200_OK)
+
+MAX_BULK_REQUESTS = 1000
+
+def decide_member_requests(ids, new_status):
+    """
+    Move still-pending requests to Approved/Rejected and apply the effects.
+
+    One UPDATE ... WHERE status = 'Pending' ... RETURNING both claims and
+    loads the rows, so concurrent calls never process a request twice.
+    Approved users get MEMBER_REQUEST_APPROVED_GROUP with one bulk insert.
+    Returns the (request_id, user_id) pairs that changed.
+    """
+    ids = sorted(set(ids))
+    if not ids:
+        return []
+    table = connection.ops.quote_name(MemberRequest._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET status = %s WHERE status = %s AND id IN ({placeholders}) "
+                f"RETURNING id, user_id",
+                [new_status, 'Pending', *ids]
+            )
+            rows = cursor.fetchall()
+        
+        if new_status == 'Approved' and rows:
+            group, _ = Group.objects.get_or_create(name=settings.MEMBER_REQUEST_APPROVED_GROUP)
+            user_ids = {user_id for _, user_id in rows}
+            UserGroup = User.groups.through
+            UserGroup.objects.bulk_create(
+                [UserGroup(user_id=user_id, group_id=group.id) for user_id in user_ids],
+                ignore_conflicts=True
+            )
+            # Group names live in the users' tokens
+            revoke_tokens_for_users(user_ids)
+    return rows
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def bulk_decide_member_requests(request):
+    if not has_group(request.user, "Super_Admin"):
+        return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
+    
+    ids = request.data.get("ids")
+    new_status = request.data.get("status", "Approved")
+    if new_status not in ["Approved", "Rejected"]:
+        return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
+    if not isinstance(ids, list) or not ids or len(ids) > MAX_BULK_REQUESTS:
+        return Response(
+            {"error": f"ids must be a list of 1 to {MAX_BULK_REQUESTS} request IDs"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        ids = [int(pk) for pk in ids]
+    except (TypeError, ValueError):
+        return Response({"error": "ids must be integers"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    updated = sorted(pk for pk, _ in decide_member_requests(ids, new_status))
+    return Response({
+        "message": f"{len(updated)} requests {new_status.lower()}",
+        "updated": updated,
+        "skipped": sorted(set(ids) - set(updated)),
+    }, status=status.HTTP_200_OK)
 
 @api_view(['PATCH'])
 @permission_classes([permissions.IsAuthenticated])
 def approve_member_request(request, pk):
+    if not has_group(request.user, "Super_Admin"):
+        return Response({"error": "Permission denied"}, status=status.HTTP_403_FORBIDDEN)
+    
     try:
         member_request = MemberRequest.objects.get(pk=pk)
     except MemberRequest.DoesNotExist:
         return Response({"error": "Not found"}, status=status.HTTP_404_NOT_FOUND)
 
     new_status = request.data.get("status", "Approved")
-    if new_status not in ["Pending", "Approved"]:
+    if new_status not in ["Pending", "Approved", "Rejected"]:
         return Response({"error": "Invalid status"}, status=status.HTTP_400_BAD_REQUEST)
 
-    member_request.status = new_status
-    member_request.save()
+    if new_status == "Pending":
+        member_request.status = new_status
+        member_request.save()
+    elif decide_member_requests([member_request.pk], new_status):
+        member_request.status = new_status
     return Response({
         "message": "Status updated",
-        "request": MemberRequestSerializer(member_request).data
+        "request": serialize(MemberRequestSerializer(member_request))
     }, status=status.HTTP_200_OK)
 
 class MessViewSet(ModelViewSet):
     serializer_class = MessSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Detail routes are routed to the shard of the mess in the URL
+    mess_url_kwarg = 'pk'
     
     def get_queryset(self):
-        return Mess.objects.filter(members=self.request.user).prefetch_related(
-            'members', 'managers', 'owner'
-        )
+        queryset = Mess.objects.filter(members=self.request.user)
+        if self.action and self.action.startswith('bulk_'):
+            # Bulk actions answer with a diff and never serialize the mess
+            return queryset
+        return mess_cache.with_members(queryset)
     
     def get_serializer_class(self):
         if self.action == 'create':
@@ -89,37 +183,63 @@ class MessViewSet(ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
     
+    # list/retrieve answer from mess_cache: the user's mess ids, then one
+    # cached payload per mess
+    def list(self, request, *args, **kwargs):
+        mess_ids = mess_cache.mess_ids_for(request.user.id)
+        page = self.paginate_queryset(mess_ids)
+        shown = page if page is not None else mess_ids
+        found = mess_cache.payloads(shown)
+        data = [found[mess_id] for mess_id in shown if mess_id in found]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+    
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            mess_id = int(kwargs['pk'])
+        except ValueError:
+            raise Http404
+        if mess_id not in mess_cache.mess_ids_for(request.user.id):
+            raise Http404
+        payload = mess_cache.payloads([mess_id]).get(mess_id)
+        if payload is None:
+            raise Http404
+        return Response(payload)
+    
+    @action(detail=False, methods=['get'])
+    def cache_stats(self, request):
+        # Counters of the worker process that served this request
+        if not has_group(request.user, 'Super_Admin'):
+            return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
+        return Response({'pid': os.getpid(), **mess_cache.get_stats()}, status=status.HTTP_200_OK)
+    
+    @action(detail=False, methods=['get'])
+    def dashboard(self, request):
+        # Everything the app's first screen needs for all of the user's
+        # messes, instead of one list call plus three calls per mess
+        month = request.query_params.get('month') or date.today().strftime('%Y-%m')
+        month_bounds = month_range(month)
+        if month_bounds is None:
+            return invalid_month_response()
+        return Response(get_dashboard(request.user, month, month_bounds), status=status.HTTP_200_OK)
+    
     @action(detail=True, methods=['post'])
     def add_member(self, request, pk=None):
         mess = self.get_object()
         
         # Check if user is manager
-        if not mess.managers.filter(id=request.user.id).exists():
+        if not mess.is_manager(request.user):
             return Response(
                 {'error': 'Only managers can add members'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        serializer = AddMemberSerializer(data=request.data)
+        serializer = AddMemberSerializer(data=request.data, context={'mess': mess})
         if serializer.is_valid():
-            phone = serializer.validated_data['phone']
-            try:
-                user = User.objects.get(phone=phone)
-                if mess.members.filter(id=user.id).exists():
-                    return Response(
-                        {'error': 'User is already a member'}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                mess.members.add(user)
-                mess_serializer = MessSerializer(mess)
-                return Response({'mess': mess_serializer.data}, status=status.HTTP_200_OK)
-            
-            except User.DoesNotExist:
-                return Response(
-                    {'error': 'User with this phone number not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
+            mess.add_members([serializer.validated_data['user'].id])
+            mess_serializer = MessSerializer(self.get_object())
+            return Response({'mess': serialize(mess_serializer)}, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -134,28 +254,89 @@ class MessViewSet(ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        serializer = AddManagerSerializer(data=request.data)
+        serializer = AddManagerSerializer(data=request.data, context={'mess': mess})
         if serializer.is_valid():
-            user_id = serializer.validated_data['user_id']
-            try:
-                user = User.objects.get(id=user_id)
-                if not mess.members.filter(id=user.id).exists():
-                    return Response(
-                        {'error': 'User is not a member of this mess'}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                mess.managers.add(user)
-                mess_serializer = MessSerializer(mess)
-                return Response({'mess': mess_serializer.data}, status=status.HTTP_200_OK)
-            
-            except User.DoesNotExist:
-                return Response(
-                    {'error': 'User not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
+            mess.set_managers([serializer.validated_data['user'].id])
+            mess_serializer = MessSerializer(self.get_object())
+            return Response({'mess': serialize(mess_serializer)}, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Bulk membership actions: each list is resolved and diffed against the
+    # memberships with one query each, written with one bulk statement, and
+    # answered with a compact diff instead of the whole mess.
+    
+    @action(detail=True, methods=['post'])
+    def bulk_add_members(self, request, pk=None):
+        mess = self.get_object()
+        if not mess.is_manager(request.user):
+            return Response({'error': 'Only managers can add members'}, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = BulkPhonesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        phones = set(serializer.validated_data['phones'])
+        users = dict(User.objects.filter(phone__in=phones).values_list('phone', 'id'))
+        added, existing = mess.add_members(users.values())
+        return Response({
+            'added': added,
+            'already_members': existing,
+            'not_found': sorted(phones - users.keys()),
+        }, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['post'])
+    def bulk_remove_members(self, request, pk=None):
+        mess = self.get_object()
+        if not mess.is_manager(request.user):
+            return Response({'error': 'Only managers can remove members'}, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = BulkUserIdsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_ids = serializer.validated_data['user_ids']
+        removed = mess.remove_members(user_ids)
+        return Response({
+            'removed': removed,
+            'not_members': sorted(set(user_ids) - set(removed) - {mess.owner_id}),
+        }, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['post'])
+    def bulk_add_managers(self, request, pk=None):
+        mess = self.get_object()
+        if mess.owner != request.user:
+            return Response({'error': 'Only owner can add managers'}, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = BulkUserIdsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_ids = set(serializer.validated_data['user_ids'])
+        added = mess.set_managers(user_ids)
+        roles = mess.roles_of(user_ids)
+        return Response({
+            'added': added,
+            'already_managers': sorted(u for u, role in roles.items() if role in MANAGER_ROLES and u not in added),
+            'not_members': sorted(user_ids - roles.keys()),
+        }, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['post'])
+    def bulk_remove_managers(self, request, pk=None):
+        mess = self.get_object()
+        if mess.owner != request.user:
+            return Response({'error': 'Only owner can remove managers'}, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = BulkUserIdsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        user_ids = serializer.validated_data['user_ids']
+        removed = mess.set_managers(user_ids, is_manager=False)
+        return Response({
+            'removed': removed,
+            'not_managers': sorted(set(user_ids) - set(removed) - {mess.owner_id}),
+        }, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -163,64 +344,209 @@ def add_meal(request, mess_id):
     mess = get_object_or_404(Mess, id=mess_id)
     
     # Check if user is manager
-    if not mess.managers.filter(id=request.user.id).exists():
+    if not mess.is_manager(request.user):
         return Response(
             {'error': 'Only managers can add meals'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    serializer = MealCreateSerializer(data=request.data)
+    serializer = MealCreateSerializer(data=request.data, context={'mess': mess})
     if serializer.is_valid():
-        member_id = serializer.validated_data['member_id']
-        try:
-            member = User.objects.get(id=member_id)
-            if not mess.members.filter(id=member.id).exists():
-                return Response(
-                    {'error': 'User is not a member of this mess'}, 
-                    status=status.HTTP_400_BAD_REQUEST
+        member = serializer.validated_data['member']
+        day = serializer.validated_data['date']
+        meal_count = serializer.validated_data['meal_count']
+        with sharding.atomic(mess.id):
+            entry = Meal.objects.select_for_update().filter(mess=mess, member=member, date=day)
+            previous = entry.values_list('meal_count', flat=True).first()
+            if meal_count == scheduled_meals_on(mess.id, member.id, day):
+                # Same as the member's schedule: no entry needed
+                stored = None
+                if previous is not None:
+                    entry.delete()
+            else:
+                stored = meal_count
+                Meal.objects.bulk_create(
+                    [Meal(mess=mess, member=member, date=day, meal_count=meal_count, added_by=request.user)],
+                    update_conflicts=True, unique_fields=['mess', 'member', 'date'],
+                    update_fields=['meal_count', 'added_by'],
                 )
-            
-            # Create or update meal
-            meal, created = Meal.objects.update_or_create(
-                mess=mess,
-                member=member,
-                date=serializer.validated_data['date'],
-                defaults={
-                    'meal_count': serializer.validated_data['meal_count'],
-                    'added_by': request.user
-                }
-            )
-            
-            return Response({'success': True}, status=status.HTTP_200_OK)
-            
-        except User.DoesNotExist:
-            return Response(
-                {'error': 'Member not found'}, 
-                status=status.HTTP_404_NOT_FOUND
-            )
+            history.record([history.meal_change(mess.id, member.id, day, previous, stored, request.user)])
+        touch([mess.id])
+        publish_on_commit(mess.id, {
+            'type': 'meal',
+            'member_id': member.id,
+            'date': str(day),
+            'meal_count': meal_count,
+        })
+        
+        return Response({'success': True}, status=status.HTTP_200_OK)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def month_range(month):
+    """
+    (first day, first day of next month) for a 'YYYY-MM' string, or None.
+
+    Filtering meals with date__gte/date__lt instead of date__startswith lets
+    the database use the (mess, date) index rather than casting every date.
+    """
+    try:
+        start = datetime.strptime(month, '%Y-%m').date()
+    except ValueError:
+        return None
+    if start.month == 12:
+        return start, start.replace(year=start.year + 1, month=1)
+    return start, start.replace(month=start.month + 1)
+
+def invalid_month_response():
+    return Response({'error': 'Invalid month, expected YYYY-MM'}, status=status.HTTP_400_BAD_REQUEST)
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def get_meals(request, mess_id, month):
     mess = get_object_or_404(Mess, id=mess_id)
     
     # Check if user is member
-    if not mess.members.filter(id=request.user.id).exists():
+    if not mess.is_member(request.user):
         return Response(
             {'error': 'Not a member of this mess'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    # Get meals for the month
-    meals = Meal.objects.filter(
-        mess=mess,
-        date__startswith=month
-    ).select_related('member', 'added_by')
+    month_bounds = month_range(month)
+    if month_bounds is None:
+        return invalid_month_response()
+    
+    # Stored entries plus the days filled in from default schedules
+    meals = month_meals(mess.id, *month_bounds)
     
     serializer = MealSerializer(meals, many=True)
-    return Response({'meals': serializer.data}, status=status.HTTP_200_OK)
+    return Response({'meals': serialize(serializer)}, status=status.HTTP_200_OK)
+
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
+def meal_matrix(request, mess_id, month):
+    # Compact alternative to get_meals/add_meal for slow connections: the
+    # month as a member header plus one packed base64 cell string
+    mess = get_object_or_404(Mess, id=mess_id)
+    
+    if not mess.is_member(request.user):
+        return Response(
+            {'error': 'Not a member of this mess'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    month_bounds = month_range(month)
+    if month_bounds is None:
+        return invalid_month_response()
+    days = (month_bounds[1] - month_bounds[0]).days
+    
+    if request.method == 'GET':
+        encoding = request.query_params.get('encoding', '2bit')
+        if encoding not in matrix.ENCODINGS:
+            return Response({'error': f"encoding must be one of {', '.join(matrix.ENCODINGS)}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        member_ids = Membership.objects.filter(mess=mess).values_list('user_id', flat=True)
+        members, cells = matrix.build_matrix(mess.id, *month_bounds, member_ids)
+        return Response({
+            'month': month,
+            'days': days,
+            'members': members,
+            'encoding': encoding,
+            'cells': matrix.pack(cells, encoding),
+        }, status=status.HTTP_200_OK)
+    
+    if not mess.is_manager(request.user):
+        return Response(
+            {'error': 'Only managers can add meals'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    serializer = MealMatrixSerializer(data=request.data, context={'mess': mess, 'month_bounds': month_bounds})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    stored, cleared = matrix.write_matrix(
+        mess.id, *month_bounds, serializer.validated_data['members'],
+        serializer.validated_data['cells'], request.user
+    )
+    if stored or cleared:
+        touch([mess.id])
+        publish_on_commit(mess.id, {'type': 'meals', 'month': month})
+    return Response({'stored': stored, 'cleared': cleared}, status=status.HTTP_200_OK)
+
+@api_view(['GET', 'POST'])
+@permission_classes([permissions.IsAuthenticated])
+def manage_meal_schedules(request, mess_id):
+    mess = get_object_or_404(Mess, id=mess_id)
+    
+    if not mess.is_member(request.user):
+        return Response(
+            {'error': 'Not a member of this mess'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    if request.method == 'GET':
+        schedules = MealSchedule.objects.filter(mess=mess).select_related('member').order_by('member_id', 'starts_on')
+        serializer = MealScheduleSerializer(schedules, many=True)
+        return Response({'schedules': serialize(serializer)}, status=status.HTTP_200_OK)
+    
+    if not mess.is_manager(request.user):
+        return Response(
+            {'error': 'Only managers can set meal schedules'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    serializer = MealScheduleCreateSerializer(data=request.data, context={'mess': mess})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    member = serializer.validated_data['member']
+    starts_on = serializer.validated_data.get('starts_on') or date.today()
+    weekday_meals = serializer.validated_data['weekday_meals']
+    with sharding.atomic(mess.id):
+        # Past and calculated days keep the meals they had
+        pin_settled_days(mess.id, member.id, starts_on, weekday_meals, request.user)
+        schedule, created = MealSchedule.objects.update_or_create(
+            mess=mess,
+            member=member,
+            starts_on=starts_on,
+            defaults={'weekday_meals': weekday_meals, 'created_by': request.user}
+        )
+        # Entries that now match the schedule are no longer exceptions
+        redundant = redundant_entries(mess.id, member.id, starts_on, weekday_meals)
+        removed = list(redundant.values_list('date', 'meal_count'))
+        redundant.delete()
+        history.record([
+            history.meal_change(mess.id, member.id, day, meal_count, None, request.user)
+            for day, meal_count in removed
+        ])
+    touch([mess.id])
+    publish_on_commit(mess.id, {
+        'type': 'schedule',
+        'member_id': member.id,
+        'starts_on': str(starts_on),
+        'weekday_meals': [int(meals) for meals in weekday_meals],
+    })
+    
+    schedule.member = member
+    return Response(
+        serialize(MealScheduleSerializer(schedule)),
+        status=status.HTTP_201_CREATED if created else status.HTTP_200_OK
+    )
+
+def calculation_queryset():
+    # Everything MonthlyCalculationSerializer reads, in three queries
+    return MonthlyCalculation.objects.select_related('calculated_by').prefetch_related(
+        Prefetch('member_summaries', queryset=MemberMealSummary.objects.select_related('member'))
+    )
+
+def serialize_transfers(transfers):
+    return [{'from': debtor, 'to': creditor, 'amount': amount} for debtor, creditor, amount in transfers]
+
+def contribution_paisa(member_contributions_data):
+    """{member_id: paisa} from validated contribution entries (one per member)."""
+    return {contrib_data['member_id']: to_paisa(contrib_data['amount']) for contrib_data in member_contributions_data}
 
 @api_view(['POST'])
 @permission_classes([permissions.IsAuthenticated])
@@ -228,121 +554,261 @@ def calculate_month(request, mess_id, month):
     mess = get_object_or_404(Mess, id=mess_id)
     
     # Check if user is manager
-    if not mess.managers.filter(id=request.user.id).exists():
+    if not mess.is_manager(request.user):
         return Response(
             {'error': 'Only managers can calculate monthly costs'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
-    serializer = MonthlyCalculationCreateSerializer(data=request.data)
+    month_bounds = month_range(month)
+    if month_bounds is None:
+        return invalid_month_response()
+    
+    serializer = MonthlyCalculationCreateSerializer(data=request.data, context={'mess': mess})
     if serializer.is_valid():
         member_contributions_data = serializer.validated_data['member_contributions']
-        extra_cost = serializer.validated_data['extra_cost']
+        members = serializer.validated_data['members']
+        extra_cost = to_paisa(serializer.validated_data['extra_cost'])
         
-        # Calculate total bazaar cost from individual contributions
-        # total_bazaar_cost = sum(float(contrib['amount']) for contrib in member_contributions_data)
-        # total_cost = total_bazaar_cost + extra_cost
-        total_bazaar_cost = sum(Decimal(contrib['amount']) for contrib in member_contributions_data)
-        extra_cost = Decimal(extra_cost)  # ensure extra_cost is Decimal
-        total_cost = total_bazaar_cost + extra_cost
-
+        # Effective meals for the month: schedules merged with entries
+        member_meals = meal_totals_for([mess.id], *month_bounds)[mess.id]
         
-        # Get all meals for the month
-        meals = Meal.objects.filter(
-            mess=mess,
-            date__startswith=month
-        ).values('member').annotate(
-            total_meals=Sum('meal_count')
-        )
-        
-        # Calculate totals
-        total_meals = sum(meal['total_meals'] for meal in meals)
-        # cost_per_meal = total_cost / total_meals if total_meals > 0 else 0
-        cost_per_meal = (total_cost / total_meals) if total_meals > 0 else Decimal("0")
+        # All money math happens in integer paisa
+        result = settle(member_meals, contribution_paisa(member_contributions_data), extra_cost)
         
-        # Create or update calculation
-        calculation, created = MonthlyCalculation.objects.update_or_create(
-            mess=mess,
-            month=month,
-            defaults={
-                'bazaar_cost': total_bazaar_cost,
-                'extra_cost': extra_cost,
-                'total_cost': total_cost,
-                'total_meals': total_meals,
-                'cost_per_meal': cost_per_meal,
-                'calculated_by': request.user
-            }
-        )
-        
-        # Delete existing member summaries and contributions
-        MemberMealSummary.objects.filter(calculation=calculation).delete()
-        MemberContribution.objects.filter(mess=mess, month=month).delete()
-        
-        # Create member contributions
-        contributions_dict = {}
-        for contrib_data in member_contributions_data:
-            member = User.objects.get(id=contrib_data['member_id'])
-            # amount = float(contrib_data['amount'])
-            amount = Decimal(contrib_data['amount'])
-
-            
-            MemberContribution.objects.create(
+        # Calculation, contributions, their history and the summaries change together
+        with sharding.atomic(mess.id):
+            # Create or update calculation
+            calculation, created = MonthlyCalculation.objects.update_or_create(
                 mess=mess,
-                member=member,
                 month=month,
-                amount=amount,
-                description=contrib_data.get('description', ''),
-                added_by=request.user
-            )
-            contributions_dict[member.id] = amount
-        
-        # Create member summaries
-        for meal in meals:
-            member = User.objects.get(id=meal['member'])
-            member_cost = meal['total_meals'] * cost_per_meal
-            contributed_amount = contributions_dict.get(member.id, 0)
-            balance = contributed_amount - member_cost  # positive = should receive, negative = should pay
-            
-            MemberMealSummary.objects.create(
-                calculation=calculation,
-                member=member,
-                total_meals=meal['total_meals'],
-                total_cost=member_cost,
-                contributed_amount=contributed_amount,
-                balance=balance
+                defaults={
+                    'bazaar_cost': from_paisa(result.bazaar_cost),
+                    'extra_cost': from_paisa(result.extra_cost),
+                    'total_cost': from_paisa(result.total_cost),
+                    'total_meals': result.total_meals,
+                    'cost_per_meal': from_paisa(result.cost_per_meal),
+                    'calculated_by': request.user,
+                    'transfer_plan': serialize_transfers(plan_transfers(result.member_balances)),
+                }
             )
         
-        calculation_serializer = MonthlyCalculationSerializer(calculation)
-        return Response({'calculation': calculation_serializer.data}, status=status.HTTP_200_OK)
+            # Delete existing member summaries and contributions
+            MemberMealSummary.objects.filter(calculation=calculation).delete()
+            contributions = MemberContribution.objects.filter(mess=mess, month=month)
+            previous = dict(contributions.values_list('member_id', 'amount'))
+            contributions.delete()
+        
+            # Create member contributions
+            contributions = MemberContribution.objects.bulk_create([
+                MemberContribution(
+                    mess=mess,
+                    member=members[contrib_data['member_id']],
+                    month=month,
+                    amount=from_paisa(to_paisa(contrib_data['amount'])),
+                    description=contrib_data.get('description', ''),
+                    added_by=request.user
+                )
+                for contrib_data in member_contributions_data
+            ])
+            amounts = {contribution.member_id: contribution.amount for contribution in contributions}
+            history.record([
+                history.contribution_change(mess.id, member_id, month, previous.get(member_id), amounts.get(member_id), request.user)
+                for member_id in sorted(previous.keys() | amounts.keys())
+            ])
+        
+            # Create member summaries
+            MemberMealSummary.objects.bulk_create([
+                MemberMealSummary(
+                    calculation=calculation,
+                    member_id=member_id,
+                    total_meals=result.member_meals[member_id],
+                    total_cost=from_paisa(member_cost),
+                    contributed_amount=from_paisa(result.member_contributions[member_id]),
+                    balance=from_paisa(result.member_balances[member_id])
+                )
+                for member_id, member_cost in result.member_costs.items()
+            ])
+        
+        touch([mess.id])
+        publish_on_commit(mess.id, {'type': 'calculation', 'month': month})
+        
+        calculation_serializer = MonthlyCalculationSerializer(calculation_queryset().get(id=calculation.id))
+        return Response({'calculation': serialize(calculation_serializer)}, status=status.HTTP_200_OK)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+def simulation_payload(result):
+    # Same figures as a saved calculation and its settlement, from memory;
+    # every amount is the exact Decimal as a string
+    return {
+        'bazaar_cost': str(from_paisa(result.bazaar_cost)),
+        'extra_cost': str(from_paisa(result.extra_cost)),
+        'total_cost': str(from_paisa(result.total_cost)),
+        'total_meals': result.total_meals,
+        'cost_per_meal': str(from_paisa(result.cost_per_meal)),
+        'member_meals': {str(member_id): meals for member_id, meals in result.member_meals.items()},
+        'member_costs': {str(member_id): str(from_paisa(paisa)) for member_id, paisa in result.member_costs.items()},
+        'member_contributions': {
+            str(member_id): str(from_paisa(paisa)) for member_id, paisa in result.member_contributions.items()
+        },
+        'member_balances': {
+            str(member_id): str(from_paisa(paisa)) for member_id, paisa in result.member_balances.items()
+        },
+        'transfers': [
+            {'from': debtor, 'to': creditor, 'amount': str(from_paisa(amount))}
+            for debtor, creditor, amount in plan_transfers(result.member_balances)
+        ],
+    }
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def simulate_month(request, mess_id, month):
+    # calculate_month's numbers for a batch of what-if inputs, without saving
+    # anything: meals are totalled once and every scenario settled in memory
+    mess = get_object_or_404(Mess, id=mess_id)
+    
+    if not mess.is_manager(request.user):
+        return Response(
+            {'error': 'Only managers can calculate monthly costs'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    month_bounds = month_range(month)
+    if month_bounds is None:
+        return invalid_month_response()
+    
+    serializer = CalculationSimulationSerializer(data=request.data, context={'mess': mess})
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    member_meals = meal_totals_for([mess.id], *month_bounds)[mess.id]
+    saved = None
+    scenarios = []
+    for scenario in serializer.validated_data['scenarios']:
+        if 'member_contributions' in scenario:
+            contributions = contribution_paisa(scenario['member_contributions'])
+        else:
+            if saved is None:
+                saved = {
+                    member_id: to_paisa(amount)
+                    for member_id, amount in MemberContribution.objects.filter(
+                        mess=mess, month=month
+                    ).order_by('id').values_list('member_id', 'amount')
+                }
+            contributions = saved
+        scenarios.append((contributions, to_paisa(scenario['extra_cost'])))
+    
+    return Response({
+        'month': month,
+        'scenarios': [simulation_payload(result) for result in settle_many(member_meals, scenarios)],
+    }, status=status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([permissions.IsAuthenticated])
 def get_calculation(request, mess_id, month):
     mess = get_object_or_404(Mess, id=mess_id)
     
     # Check if user is member
-    if not mess.members.filter(id=request.user.id).exists():
+    if not mess.is_member(request.user):
         return Response(
             {'error': 'Not a member of this mess'}, 
             status=status.HTTP_403_FORBIDDEN
         )
     
     try:
-        calculation = MonthlyCalculation.objects.get(mess=mess, month=month)
+        calculation = calculation_queryset().get(mess=mess, month=month)
         serializer = MonthlyCalculationSerializer(calculation)
-        return Response({'calculation': serializer.data}, status=status.HTTP_200_OK)
+        return Response({'calculation': serialize(serializer)}, status=status.HTTP_200_OK)
     except MonthlyCalculation.DoesNotExist:
         return Response({'calculation': None}, status=status.HTTP_200_OK)
 
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def get_settlement(request, mess_id, month):
+    mess = get_object_or_404(Mess, id=mess_id)
+    
+    # Check if user is member
+    if not mess.is_member(request.user):
+        return Response(
+            {'error': 'Not a member of this mess'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    try:
+        calculation = MonthlyCalculation.objects.get(mess=mess, month=month)
+    except MonthlyCalculation.DoesNotExist:
+        return Response({'transfers': None}, status=status.HTTP_200_OK)
+    
+    # Calculations saved before plans were cached get theirs built once here
+    if calculation.transfer_plan is None:
+        balances = {
+            member_id: to_paisa(balance)
+            for member_id, balance in calculation.member_summaries.values_list('member_id', 'balance')
+        }
+        calculation.transfer_plan = serialize_transfers(plan_transfers(balances))
+        calculation.save(update_fields=['transfer_plan'])
+    
+    transfers = [
+        {'from': t['from'], 'to': t['to'], 'amount': str(from_paisa(t['amount']))}
+        for t in calculation.transfer_plan
+    ]
+    return Response({'transfers': transfers}, status=status.HTTP_200_OK)
+
+def authenticate_event_stream(request, mess_id):
+    # EventSource can't set headers, so the access token may come as ?token=
+    auth = CachedJWTAuthentication()
+    header = auth.get_header(request)
+    raw_token = auth.get_raw_token(header) if header else request.GET.get('token')
+    if not raw_token:
+        return None, JsonResponse({'error': 'Authentication credentials were not provided'}, status=401)
+    try:
+        user = auth.get_user(auth.get_validated_token(raw_token))
+    except Exception:
+        return None, JsonResponse({'error': 'Invalid token'}, status=401)
+    if not Membership.objects.filter(mess_id=mess_id, user_id=user.id).exists():
+        return None, JsonResponse({'error': 'Not a member of this mess'}, status=403)
+    return user, None
+
+async def meal_events(request, mess_id):
+    """Server-Sent Events stream of meal, contribution and calculation changes."""
+    # A WSGI server buffers the endless stream and holds a worker thread
+    # forever, so refuse instead of hanging (see gunicorn.conf.py)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {'error': 'Live events need the ASGI server (GUNICORN_WORKER_CLASS=uvicorn)'}, status=501
+        )
+    user, error = await sync_to_async(authenticate_event_stream)(request, mess_id)
+    if error is not None:
+        return error
+    ensure_listener()
+    
+    async def stream():
+        loop, queue = subscriber = hub.subscribe(mess_id)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            hub.unsubscribe(mess_id, subscriber)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @api_view(['GET', 'POST'])
 @permission_classes([permissions.IsAuthenticated])
 def manage_contributions(request, mess_id, month):
     mess = get_object_or_404(Mess, id=mess_id)
     
     # Check if user is member
-    if not mess.members.filter(id=request.user.id).exists():
+    if not mess.is_member(request.user):
         return Response(
             {'error': 'Not a member of this mess'}, 
             status=status.HTTP_403_FORBIDDEN
@@ -356,49 +822,73 @@ def manage_contributions(request, mess_id, month):
         ).select_related('member', 'added_by')
         
         serializer = MemberContributionSerializer(contributions, many=True)
-        return Response({'contributions': serializer.data}, status=status.HTTP_200_OK)
+        return Response({'contributions': serialize(serializer)}, status=status.HTTP_200_OK)
     
     elif request.method == 'POST':
         # Only managers can add contributions
-        if not mess.managers.filter(id=request.user.id).exists():
+        if not mess.is_manager(request.user):
             return Response(
                 {'error': 'Only managers can add contributions'}, 
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        serializer = MemberContributionCreateSerializer(data=request.data)
+        serializer = MemberContributionCreateSerializer(data=request.data, context={'mess': mess})
         if serializer.is_valid():
-            member_id = serializer.validated_data['member_id']
-            try:
-                member = User.objects.get(id=member_id)
-                if not mess.members.filter(id=member.id).exists():
-                    return Response(
-                        {'error': 'User is not a member of this mess'}, 
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-                
-                # Create or update contribution
-                contribution, created = MemberContribution.objects.update_or_create(
-                    mess=mess,
-                    member=member,
-                    month=month,
-                    defaults={
-                        'amount': serializer.validated_data['amount'],
-                        'description': serializer.validated_data.get('description', ''),
-                        'added_by': request.user
-                    }
-                )
-                
-                return Response({'success': True}, status=status.HTTP_200_OK)
-                
-            except User.DoesNotExist:
-                return Response(
-                    {'error': 'Member not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
+            # Create or update contribution
+            member = serializer.validated_data['member']
+            amount = serializer.validated_data['amount']
+            with sharding.atomic(mess.id):
+                previous = MemberContribution.objects.select_for_update().filter(
+                    mess=mess, member=member, month=month
+                ).values_list('amount', flat=True).first()
+                MemberContribution.objects.bulk_create(
+                    [MemberContribution(
+                        mess=mess, member=member, month=month, amount=amount,
+                        description=serializer.validated_data.get('description', ''), added_by=request.user,
+                    )],
+                    update_conflicts=True, unique_fields=['mess', 'member', 'month'],
+                    update_fields=['amount', 'description', 'added_by'],
                 )
+                history.record([history.contribution_change(mess.id, member.id, month, previous, amount, request.user)])
+            touch([mess.id])
+            publish_on_commit(mess.id, {
+                'type': 'contribution',
+                'member_id': member.id,
+                'month': month,
+                'amount': str(amount),
+            })
+            
+            return Response({'success': True}, status=status.HTTP_200_OK)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def change_history(request, mess_id):
+    mess = get_object_or_404(Mess, id=mess_id)
+    
+    if not mess.is_member(request.user):
+        return Response(
+            {'error': 'Not a member of this mess'}, 
+            status=status.HTTP_403_FORBIDDEN
+        )
+    
+    params = request.query_params
+    try:
+        before = int(params['before']) if params.get('before') else None
+        member_id = int(params['member_id']) if params.get('member_id') else None
+        limit = int(params.get('limit') or 50)
+    except ValueError:
+        return Response({'error': 'before, member_id and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    entries, next_before = history.page(
+        mess.id, before=before, limit=limit, kind=params.get('kind'), member_id=member_id, month=params.get('month')
+    )
+    return Response({
+        'changes': serialize(ChangeLogEntrySerializer(entries, many=True)),
+        'next_before': next_before,
+    }, status=status.HTTP_200_OK)
+    
 # @api_view(['GET', 'POST'])
 # @permission_classes([IsAuthenticated])
 # def become_member_request(request):
@@ -478,7 +968,7 @@ def manage_contributions(request, mess_id, month):
 #         mess = self.get_object()
         
 #         # Check if user is manager
-#         if not mess.managers.filter(id=request.user.id).exists():
+#         if not mess.is_manager(request.user):
 #             return Response(
 #                 {'error': 'Only managers can add members'}, 
 #                 status=status.HTTP_403_FORBIDDEN
@@ -547,7 +1037,7 @@ def manage_contributions(request, mess_id, month):
 #     mess = get_object_or_404(Mess, id=mess_id)
     
 #     # Check if user is manager
-#     if not mess.managers.filter(id=request.user.id).exists():
+#     if not mess.is_manager(request.user):
 #         return Response(
 #             {'error': 'Only managers can add meals'}, 
 #             status=status.HTTP_403_FORBIDDEN
@@ -591,7 +1081,7 @@ def manage_contributions(request, mess_id, month):
 #     mess = get_object_or_404(Mess, id=mess_id)
     
 #     # Check if user is member
-#     if not mess.members.filter(id=request.user.id).exists():
+#     if not mess.is_member(request.user):
 #         return Response(
 #             {'error': 'Not a member of this mess'}, 
 #             status=status.HTTP_403_FORBIDDEN
@@ -612,7 +1102,7 @@ def manage_contributions(request, mess_id, month):
 #     mess = get_object_or_404(Mess, id=mess_id)
     
 #     # Check if user is manager
-#     if not mess.managers.filter(id=request.user.id).exists():
+#     if not mess.is_manager(request.user):
 #         return Response(
 #             {'error': 'Only managers can calculate monthly costs'}, 
 #             status=status.HTTP_403_FORBIDDEN
@@ -676,7 +1166,7 @@ def manage_contributions(request, mess_id, month):
 #     mess = get_object_or_404(Mess, id=mess_id)
     
 #     # Check if user is member
-#     if not mess.members.filter(id=request.user.id).exists():
+#     if not mess.is_member(request.user):
 #         return Response(
 #             {'error': 'Not a member of this mess'}, 
 #             status=status.HTTP_403_FORBIDDEN
@@ -696,7 +1186,7 @@ def manage_contributions(request, mess_id, month):
 #     mess = get_object_or_404(Mess, id=mess_id)
     
 #     # Check if user is member
-#     if not mess.members.filter(id=request.user.id).exists():
+#     if not mess.is_member(request.user):
 #         return Response(
 #             {'error': 'Not a member of this mess'}, 
 #             status=status.HTTP_403_FORBIDDEN
@@ -714,7 +1204,7 @@ def manage_contributions(request, mess_id, month):
     
 #     elif request.method == 'POST':
 #         # Only managers can add contributions
-#         if not mess.managers.filter(id=request.user.id).exists():
+#         if not mess.is_manager(request.user):
 #             return Response(
 #                 {'error': 'Only managers can add contributions'}, 
 #                 status=status.HTTP_403_FORBIDDEN
@@ -0,0 +1,89 @@
+"""
+Read-replica routing.
+
+``ReplicaRoutingMiddleware`` marks safe (GET/HEAD/OPTIONS) requests as
+replica-eligible; ``ReplicaRouter`` then sends their reads to the ``replica``
+alias when one is configured. After a user makes a write request, their reads
+stay on the primary for ``REPLICA_PIN_SECONDS`` so they always see their own
+writes despite replication lag.
+"""
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.functional import LazyObject, empty
+
+REPLICA = 'replica'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_routing = ContextVar('db_routing', default=None)
+
+
+def _pin_key(user_id):
+    return f"db_pin_{user_id}"
+
+
+def pin_to_primary(user_id):
+    cache.set(_pin_key(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+
+def _resolved_user(request):
+    """
+    The request's user if something already loaded it, else None.
+
+    AuthenticationMiddleware's lazy user is never evaluated here: loading it
+    queries the database, which would ask the router again.
+    """
+    user = getattr(request, 'user', None)
+    if isinstance(user, LazyObject):
+        return None if user._wrapped is empty else user._wrapped
+    return user
+
+
+def _is_pinned(state):
+    # The user is only known once DRF (or a session lookup) has loaded it;
+    # until then reads stay on the primary
+    user = _resolved_user(state['request'])
+    if user is None or not user.is_authenticated:
+        return True
+    if 'pinned' not in state:
+        state['pinned'] = bool(cache.get(_pin_key(user.id)))
+    return state['pinned']
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is None or not state['read_only'] or REPLICA not in settings.DATABASES:
+            return None
+        if _is_pinned(state):
+            return 'default'
+        return REPLICA
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+class ReplicaRoutingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _routing.set({'request': request, 'read_only': request.method in SAFE_METHODS})
+        try:
+            response = self.get_response(request)
+        finally:
+            _routing.reset(token)
+
+        if request.method not in SAFE_METHODS and REPLICA in settings.DATABASES:
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                pin_to_primary(user.id)
+        return response
@@ -0,0 +1,138 @@
+"""
+Repeated-query (N+1) and slow-query detection for development and CI.
+
+``QueryDetector`` groups the queries run on every connection by their
+normalized SQL fingerprint (see ``myproject.tracing.fingerprint``) and
+remembers the first project frame that issued each shape. A shape run
+``QUERY_REPEAT_THRESHOLD`` or more times, or any query slower than
+``SLOW_QUERY_MS``, is reported with that frame.
+
+``QueryDetectorMiddleware`` checks every request when ``QUERY_DETECTOR`` is
+'log' (warnings on the ``myproject.querycheck`` logger) or 'raise'
+(``RepeatedQueriesError``, e.g. to fail a CI test run); ``QueryDetectorMixin``
+gives test cases ``assertNoRepeatedQueries()``.
+"""
+import logging
+import sys
+import time
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+from .tracing import fingerprint
+
+logger = logging.getLogger(__name__)
+
+_SKIP_FILES = (__file__, str(Path(__file__).with_name('tracing.py')))
+
+
+class RepeatedQueriesError(AssertionError):
+    pass
+
+
+def _project_frame():
+    """'path:line in function' of the innermost caller in project code (not site-packages)."""
+    base = str(settings.BASE_DIR)
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(base) and 'site-packages' not in filename and filename not in _SKIP_FILES:
+            return f"{Path(filename).relative_to(base)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class QueryDetector:
+    def __init__(self, threshold=None, slow_ms=None):
+        self.threshold = threshold or settings.QUERY_REPEAT_THRESHOLD
+        self.slow_ms = slow_ms if slow_ms is not None else settings.SLOW_QUERY_MS
+        self.groups = {}
+        self.slow = []
+        self._stack = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for alias in connections:
+            self._stack.enter_context(connections[alias].execute_wrapper(self._record))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stack.close()
+        return False
+
+    def _record(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            statement, digest = fingerprint(sql)
+            group = self.groups.get(digest)
+            if group is None:
+                group = self.groups[digest] = {'sql': statement, 'count': 0, 'ms': 0.0, 'frame': _project_frame()}
+            group['count'] += 1
+            group['ms'] += elapsed_ms
+            if self.slow_ms and elapsed_ms >= self.slow_ms:
+                self.slow.append({'sql': statement, 'ms': elapsed_ms, 'frame': _project_frame()})
+
+    @property
+    def queries(self):
+        return sum(group['count'] for group in self.groups.values())
+
+    @property
+    def repeated(self):
+        return sorted(
+            (group for group in self.groups.values() if group['count'] >= self.threshold),
+            key=lambda group: -group['count'],
+        )
+
+    def problems(self):
+        """One line per repeated shape and per slow query, empty if none."""
+        lines = [
+            f"{group['count']}x ({group['ms']:.1f} ms) at {group['frame'] or '?'}: {group['sql'][:300]}"
+            for group in self.repeated
+        ]
+        lines += [
+            f"slow query ({query['ms']:.1f} ms) at {query['frame'] or '?'}: {query['sql'][:300]}"
+            for query in self.slow
+        ]
+        return lines
+
+
+class QueryDetectorMiddleware:
+    def __init__(self, get_response):
+        if settings.QUERY_DETECTOR not in ('log', 'raise'):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with QueryDetector() as detector:
+            response = self.get_response(request)
+        problems = detector.problems()
+        if problems:
+            message = f"{request.method} {request.path}: {detector.queries} queries\n  " + '\n  '.join(problems)
+            if settings.QUERY_DETECTOR == 'raise':
+                raise RepeatedQueriesError(message)
+            logger.warning(message)
+        return response
+
+
+class QueryDetectorMixin:
+    """
+    TestCase mixin; fixtures made in the test itself also count, so wrap
+    just the code under test:
+
+        with self.assertNoRepeatedQueries():
+            self.client.get(url)
+    """
+
+    @contextmanager
+    def assertNoRepeatedQueries(self, threshold=None, slow_ms=0):
+        with QueryDetector(threshold, slow_ms) as detector:
+            yield detector
+        problems = detector.problems()
+        if problems:
+            raise self.failureException(f"{detector.queries} queries\n  " + '\n  '.join(problems))
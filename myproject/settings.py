@@ -36,9 +36,13 @@ INSTALLED_APPS = [
     'mess_management',
 ]
 MIDDLEWARE = [
+    'myproject.tracing.TracingMiddleware',
+    'myproject.querycheck.QueryDetectorMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
+    'myproject.db_routers.ReplicaRoutingMiddleware',
+    'myproject.sharding.ShardRoutingMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -48,6 +52,28 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = 'myproject.urls'
 
+# Process profile, so short-lived processes only load what they use:
+#   web    - the HTTP app (wsgi/asgi, runserver); the default
+#   cli    - management commands (manage.py's default outside runserver):
+#            every app stays installed for migrate/collectstatic, but the
+#            admin skips autodiscovering each app's admin module
+#   worker - background jobs and data commands that never serve HTTP:
+#            only the apps with models they touch, and no middleware
+DJANGO_PROFILE = config("DJANGO_PROFILE", default="web")
+if DJANGO_PROFILE == 'cli':
+    INSTALLED_APPS[0] = 'django.contrib.admin.apps.SimpleAdminConfig'
+elif DJANGO_PROFILE == 'worker':
+    INSTALLED_APPS = [
+        'django.contrib.auth',
+        'django.contrib.contenttypes',
+        'accounts',
+        'mess_management',
+    ]
+    MIDDLEWARE = []
+    ROOT_URLCONF = 'myproject.worker_urls'
+elif DJANGO_PROFILE != 'web':
+    raise ValueError(f"Unknown DJANGO_PROFILE {DJANGO_PROFILE!r}, expected web, cli or worker")
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -93,11 +119,44 @@ DATABASES = {
       
     }
 }
-print(config("DATABASE_HOST"))
+
+# Optional read replica: safe requests read from it (see myproject/db_routers.py).
+# Point it at the same server as default to try the routing locally.
+if config("DATABASE_REPLICA_HOST", default=""):
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "NAME": config("DATABASE_REPLICA_NAME", default=DATABASES["default"]["NAME"]),
+        "USER": config("DATABASE_REPLICA_USER", default=DATABASES["default"]["USER"]),
+        "PASSWORD": config("DATABASE_REPLICA_PASSWORD", default=DATABASES["default"]["PASSWORD"]),
+        "HOST": config("DATABASE_REPLICA_HOST"),
+        "PORT": config("DATABASE_REPLICA_PORT", default=DATABASES["default"]["PORT"]),
+        "TEST": {"MIRROR": "default"},
+    }
+
+# Databases holding mess data, each mess with its meals, contributions and
+# calculations on one of them (see myproject/sharding.py). Extra aliases copy
+# default's settings; override per shard with DATABASE_<ALIAS>_NAME/HOST/...
+SHARDS = config("DATABASE_SHARDS", default="default", cast=Csv())
+for alias in SHARDS:
+    if alias not in DATABASES:
+        DATABASES[alias] = {
+            **DATABASES["default"],
+            **{
+                setting: config(f"DATABASE_{alias.upper()}_{setting}", default=DATABASES["default"][setting])
+                for setting in ("NAME", "USER", "PASSWORD", "HOST", "PORT")
+            },
+        }
+# 'hash' (consistent-hash ring) or 'lookup' (least loaded shard, recorded per mess)
+SHARD_STRATEGY = config("SHARD_STRATEGY", default="hash")
+
+DATABASE_ROUTERS = ['myproject.sharding.ShardRouter', 'myproject.db_routers.ReplicaRouter']
+
+# After a write, that user's reads stay on the primary for this long
+REPLICA_PIN_SECONDS = config("REPLICA_PIN_SECONDS", default=5, cast=int)
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -106,7 +165,88 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 20
+    'PAGE_SIZE': 20,
+    'DEFAULT_THROTTLE_RATES': {
+        'signin': config("THROTTLE_SIGNIN", default="20/min"),
+        'signin_email': config("THROTTLE_SIGNIN_EMAIL", default="10/min"),
+        'signup': config("THROTTLE_SIGNUP", default="10/hour"),
+        'signup_email': config("THROTTLE_SIGNUP_EMAIL", default="3/hour"),
+        'refresh_token': config("THROTTLE_REFRESH_TOKEN", default="30/min"),
+    },
+}
+
+# Cache (throttle counters, sign-in lockouts). LocMem is per process, so use a
+# shared backend when running more than one worker (check --deploy warns).
+CACHES = {
+    'default': {
+        'BACKEND': config("CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': config("CACHE_LOCATION", default="mess-default"),
+    }
+}
+
+# Failed sign-ins per email before further attempts are rejected unhashed
+SIGNIN_MAX_FAILURES = config("SIGNIN_MAX_FAILURES", default=5, cast=int)
+SIGNIN_LOCKOUT_SECONDS = config("SIGNIN_LOCKOUT_SECONDS", default=900, cast=int)
+
+# Group granted to users whose member request is approved
+MEMBER_REQUEST_APPROVED_GROUP = config("MEMBER_REQUEST_APPROVED_GROUP", default="Member")
+
+# Live meal board fan-out: 'local' (single process) or 'postgres' (LISTEN/NOTIFY)
+MESS_EVENTS_BACKEND = config("MESS_EVENTS_BACKEND", default="local")
+
+# How long authenticated users and their token versions are served from cache
+AUTH_USER_CACHE_TTL = config("AUTH_USER_CACHE_TTL", default=60, cast=int)
+TOKEN_VERSION_CACHE_TTL = config("TOKEN_VERSION_CACHE_TTL", default=300, cast=int)
+# Upper bound on how long a dashboard entry lives; writes invalidate it sooner
+DASHBOARD_CACHE_TTL = config("DASHBOARD_CACHE_TTL", default=600, cast=int)
+# Serialized messes for the mess list/detail: shared-cache lifetime, and the
+# size and lifetime of each process's in-memory copy in front of it
+MESS_CACHE_TTL = config("MESS_CACHE_TTL", default=3600, cast=int)
+MESS_CACHE_LOCAL_SIZE = config("MESS_CACHE_LOCAL_SIZE", default=2000, cast=int)
+MESS_CACHE_LOCAL_TTL = config("MESS_CACHE_LOCAL_TTL", default=60, cast=int)
+
+# Request tracing: spans appended as JSON lines to this file for a sampled
+# share (0-1) of requests; empty turns tracing off
+TRACING_FILE = config("TRACING_FILE", default="")
+TRACING_SAMPLE_RATE = config("TRACING_SAMPLE_RATE", default=1.0, cast=float)
+
+# Per-request N+1 / slow query detection: 'log', 'raise' or '' (off; the
+# default unless DEBUG)
+QUERY_DETECTOR = config("QUERY_DETECTOR", default="log" if DEBUG else "")
+# Same-shape queries in one request that count as an N+1
+QUERY_REPEAT_THRESHOLD = config("QUERY_REPEAT_THRESHOLD", default=5, cast=int)
+SLOW_QUERY_MS = config("SLOW_QUERY_MS", default=100, cast=int)
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'plain': {
+            'format': '%(asctime)s %(levelname)s %(name)s [%(process)d] %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'plain',
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': config("LOG_LEVEL", default="INFO"),
+    },
+    'loggers': {
+        # Drop the console handler Django's default config attaches here;
+        # records reach the root one above, so each line is written once
+        'django': {
+            'handlers': [],
+            'propagate': True,
+        },
+        # DEBUG here logs every SQL query (only while settings.DEBUG is on)
+        'django.db.backends': {
+            'level': config("DB_LOG_LEVEL", default="INFO"),
+        },
+    },
 }
 
 # Password validation
@@ -132,8 +272,10 @@ AUTH_USER_MODEL = 'accounts.User'
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # Rotation and revocation are done by accounts.views.refresh_token
+    # against accounts.models.RevokedToken, not simplejwt's blacklist app
     'ROTATE_REFRESH_TOKENS': True,
-    'BLACKLIST_AFTER_ROTATION': True,
+    'BLACKLIST_AFTER_ROTATION': False,
     'UPDATE_LAST_LOGIN': True,
 
     'ALGORITHM': 'HS256',
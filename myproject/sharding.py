@@ -0,0 +1,220 @@
+"""
+Horizontal sharding of mess data by mess id.
+
+Each mess lives on one of the ``SHARDS`` database aliases together with
+everything that belongs to it (memberships, meals, schedules,
+contributions, calculations and their summaries, change history). Users,
+groups and member requests stay on ``default``; user rows are also copied to
+every other shard (see ``mess_management.signals``) so foreign keys and
+``select_related`` joins keep working inside a shard.
+
+Mess ids are allocated from the ``MessShard`` directory on ``default`` so
+they are unique across shards. ``SHARD_STRATEGY`` picks where a mess goes:
+
+- 'hash': a consistent-hash ring over ``SHARDS``; no lookups, and adding a
+  shard only moves the messes that land on its part of the ring.
+- 'lookup': new messes go to the least loaded shard and the directory row is
+  the mapping, so existing messes never move unless their row is changed.
+
+Queries on sharded models go to the shard selected for the current context:
+``ShardRoutingMiddleware`` selects it from the view's ``mess_id`` URL
+argument, ``atomic(mess_id)`` selects it and opens the transaction there, and
+``fan_out`` runs a function once per shard for per-user reads such as the
+mess list. Outside any of these (admin, management commands) they go to
+``default``. With ``SHARDS`` left at ``['default']`` the router stays out of
+the way entirely.
+"""
+import bisect
+import hashlib
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+SHARDED_MODELS = {
+    ('mess_management', 'mess'),
+    ('mess_management', 'membership'),
+    ('mess_management', 'meal'),
+    ('mess_management', 'mealschedule'),
+    ('mess_management', 'monthlycalculation'),
+    ('mess_management', 'membercontribution'),
+    ('mess_management', 'membermealsummary'),
+    ('mess_management', 'changelogentry'),
+}
+DIRECTORY_MODEL = ('mess_management', 'messshard')
+RING_POINTS = 64
+
+_shard = ContextVar('db_shard', default=None)
+# Directory lookups; a mess only changes shard if its row is edited by hand
+_locations = {}
+MAX_LOCATIONS = 100000
+
+
+def enabled():
+    return list(settings.SHARDS) != [DEFAULT_DB_ALIAS]
+
+
+def shards():
+    return list(settings.SHARDS)
+
+
+def _key(model):
+    return (model._meta.app_label, model._meta.model_name)
+
+
+def is_sharded(model):
+    return _key(model) in SHARDED_MODELS
+
+
+def _hash(value):
+    return int.from_bytes(hashlib.sha1(str(value).encode()).digest()[:8], 'big')
+
+
+@lru_cache(maxsize=8)
+def _ring(aliases):
+    points = sorted((_hash(f"{alias}-{i}"), alias) for alias in aliases for i in range(RING_POINTS))
+    return [point for point, _ in points], [alias for _, alias in points]
+
+
+def ring_shard(mess_id):
+    """The shard the consistent-hash ring assigns to a mess id."""
+    points, aliases = _ring(tuple(settings.SHARDS))
+    return aliases[bisect.bisect(points, _hash(mess_id)) % len(aliases)]
+
+
+def shard_for(mess_id):
+    """Database alias holding a mess (``default`` when sharding is off or the id is unknown)."""
+    if mess_id is None or not enabled():
+        return DEFAULT_DB_ALIAS
+    if settings.SHARD_STRATEGY == 'hash':
+        return ring_shard(mess_id)
+    alias = _locations.get(mess_id)
+    if alias is None:
+        from mess_management.models import MessShard
+        alias = MessShard.objects.filter(id=mess_id).values_list('alias', flat=True).first()
+        if alias is None:
+            return DEFAULT_DB_ALIAS
+        if len(_locations) >= MAX_LOCATIONS:
+            _locations.clear()
+        _locations[mess_id] = alias
+    return alias
+
+
+def allocate_mess_id():
+    """Reserve a new mess id in the directory and record its shard."""
+    # Imported here because the models import this module
+    from django.db.models import Count
+    from mess_management.models import MessShard
+
+    if settings.SHARD_STRATEGY == 'hash':
+        entry = MessShard.objects.create(alias='')
+        entry.alias = ring_shard(entry.id)
+        entry.save(update_fields=['alias'])
+    else:
+        loads = dict(MessShard.objects.values_list('alias').annotate(messes=Count('id')).order_by())
+        entry = MessShard.objects.create(alias=min(settings.SHARDS, key=lambda alias: loads.get(alias, 0)))
+    _locations[entry.id] = entry.alias
+    return entry.id
+
+
+def current_db():
+    """The shard selected for this context, for ``transaction.on_commit`` and friends."""
+    return _shard.get() or DEFAULT_DB_ALIAS
+
+
+@contextmanager
+def use(alias):
+    """Route sharded models to ``alias`` inside the block."""
+    token = _shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _shard.reset(token)
+
+
+@contextmanager
+def atomic(mess_id):
+    """A transaction on the mess's shard, with sharded models routed there."""
+    alias = shard_for(mess_id)
+    with use(alias), transaction.atomic(using=alias):
+        yield
+
+
+def by_shard(mess_ids):
+    """{alias: [mess_id, ...]} for the given ids."""
+    groups = {}
+    for mess_id in mess_ids:
+        groups.setdefault(shard_for(mess_id), []).append(mess_id)
+    return groups
+
+
+def fan_out(func):
+    """[func(alias), ...] with each call routed to one shard in turn."""
+    results = []
+    for alias in settings.SHARDS:
+        with use(alias):
+            results.append(func(alias))
+    return results
+
+
+class ShardRouter:
+    def _db_for_model(self, model, hints):
+        if not enabled():
+            return None
+        key = _key(model)
+        if key == DIRECTORY_MODEL:
+            return DEFAULT_DB_ALIAS
+        if key not in SHARDED_MODELS:
+            return None
+        # Objects of sharded models carry their shard; a user passed as the
+        # hint (e.g. ``Mess(owner=user)``) says nothing about it
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)) and instance._state.db:
+            return instance._state.db
+        return _shard.get() or DEFAULT_DB_ALIAS
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_model(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_model(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if is_sharded(type(obj1)) and is_sharded(type(obj2)) and obj1._state.db != obj2._state.db:
+            return False
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every shard has the full schema; only the directory is default-only
+        if (app_label, model_name) == DIRECTORY_MODEL:
+            return db == DEFAULT_DB_ALIAS
+        return None
+
+
+class ShardRoutingMiddleware:
+    """Selects the shard of the mess named in the URL for the rest of the request."""
+    url_kwarg = 'mess_id'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _shard.set(None)
+        try:
+            return self.get_response(request)
+        finally:
+            _shard.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not enabled():
+            return None
+        # Viewsets name the argument themselves (MessViewSet uses its pk)
+        kwarg = getattr(getattr(view_func, 'cls', None), 'mess_url_kwarg', self.url_kwarg)
+        try:
+            mess_id = int(view_kwargs[kwarg])
+        except (KeyError, TypeError, ValueError):
+            return None
+        _shard.set(shard_for(mess_id))
+        return None
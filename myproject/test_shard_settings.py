@@ -0,0 +1,30 @@
+"""
+Settings for running the sharding tests against two SQLite shards:
+
+    DJANGO_SETTINGS_MODULE=myproject.test_shard_settings python manage.py test mess_management.tests.ShardingTests
+
+Users and the mess directory live on ``default``; messes are spread over
+``shard_1`` and ``shard_2``. Everything else comes from myproject.settings,
+whose required variables get placeholders here.
+"""
+import os
+
+for name in ('SECRET_KEY', 'DATABASE_NAME', 'DATABASE_USER', 'DATABASE_PASSWORD', 'DATABASE_HOST', 'DATABASE_PORT'):
+    os.environ.setdefault(name, 'test')
+os.environ.setdefault('CORS_ALLOWED_ORIGINS', '')
+
+from .settings import *  # noqa: E402,F401,F403
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': f"{alias}.sqlite3",
+        'TEST': {'NAME': f"file:test_{alias}?mode=memory&cache=shared"},
+    }
+    for alias in ('default', 'shard_1', 'shard_2')
+}
+SHARDS = ['shard_1', 'shard_2']
+SHARD_STRATEGY = 'hash'
+# The schema comes from the models, whether or not migrations were generated
+MIGRATION_MODULES = {'accounts': None, 'mess_management': None}
+PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
@@ -0,0 +1,229 @@
+"""
+Optional request tracing.
+
+With ``TRACING_FILE`` set, ``TracingMiddleware`` traces a ``TRACING_SAMPLE_RATE``
+share of requests and, once each finishes, appends one JSON line per span to
+that file: the request, authentication and permission checks, every SQL query
+(as a normalized fingerprint), serialization and rendering. Records use
+OpenTelemetry's span field names (traceId, spanId, parentSpanId,
+startTimeUnixNano, ...) so OTLP tooling can load them.
+
+When tracing is off the middleware drops out of the stack at startup and
+``span``/``traced``/``serialize`` cost one context variable lookup per call
+(see the ``benchmark_tracing`` command).
+"""
+import functools
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+_trace = ContextVar('trace', default=None)
+
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+
+class _Trace:
+    def __init__(self):
+        self.trace_id = _new_id(16)
+        self.stack = []
+        self.records = []
+
+
+class _Span:
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = self.trace.stack
+        self.parent_id = stack[-1] if stack else None
+        self.span_id = _new_id(8)
+        stack.append(self.span_id)
+        self.start = time.time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.time_ns()
+        stack = self.trace.stack
+        # Also drops children that never finished (a render that raised)
+        if self.span_id in stack:
+            del stack[stack.index(self.span_id):]
+        record = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start,
+            'endTimeUnixNano': end,
+            'durationMs': round((end - self.start) / 1e6, 3),
+            'attributes': self.attributes,
+            'status': 'OK',
+        }
+        if exc_type is not None:
+            record['status'] = 'ERROR'
+            record['attributes'] = {**self.attributes, 'exception.type': exc_type.__name__}
+        self.trace.records.append(record)
+        return False
+
+
+class _NoSpan:
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name, **attributes):
+    """Context manager timing a block as a child of the current span; a no-op when not tracing."""
+    trace = _trace.get()
+    if trace is None:
+        return NO_SPAN
+    return _Span(trace, name, attributes)
+
+
+def traced(name=None, **attributes):
+    """Decorator: run the function inside ``span(name or its qualified name)``."""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = _trace.get()
+            if trace is None:
+                return func(*args, **kwargs)
+            with _Span(trace, span_name, dict(attributes)):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def serialize(serializer):
+    """``serializer.data``, timed as a 'serialize' span."""
+    trace = _trace.get()
+    if trace is None:
+        return serializer.data
+    many = getattr(serializer, 'many', False)
+    name = type(serializer.child if many else serializer).__name__
+    with _Span(trace, 'serialize', {'serializer': name, 'many': many}):
+        return serializer.data
+
+
+_NORMALIZE = [
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\bIN \(\?(?:, \?)*\)'), 'IN (...)'),
+    (re.compile(r'(\(\?(?:, \?)*\))(?:, \(\?(?:, \?)*\))+'), r'\1, ...'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """(normalized SQL, short hash): literals and IN/VALUES lists collapsed, so one query shape is one fingerprint."""
+    for pattern, replacement in _NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    sql = sql.strip()
+    return sql, hashlib.sha1(sql.encode()).hexdigest()[:12]
+
+
+def _query_wrapper(alias):
+    def wrapper(execute, sql, params, many, context):
+        statement, digest = fingerprint(sql)
+        attributes = {'db.alias': alias, 'db.statement': statement, 'db.fingerprint': digest}
+        if many:
+            attributes['db.many'] = True
+        with span('db.query', **attributes):
+            return execute(sql, params, many, context)
+    return wrapper
+
+
+class _Writer:
+    """Appends a trace's spans with one write() so concurrent workers don't interleave lines."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.fd = None
+        self.pid = None
+
+    def write(self, trace):
+        if not trace.records:
+            return
+        data = ''.join(json.dumps(record, separators=(',', ':'), default=str) + '\n' for record in trace.records)
+        with self.lock:
+            # Opened in each process on first use, not inherited across fork
+            if self.pid != os.getpid():
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                self.pid = os.getpid()
+            os.write(self.fd, data.encode())
+
+
+class TracingMiddleware:
+    def __init__(self, get_response):
+        if not settings.TRACING_FILE:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = settings.TRACING_SAMPLE_RATE
+        self.writer = _Writer(settings.TRACING_FILE)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        trace = _Trace()
+        token = _trace.set(trace)
+        try:
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(connections[alias].execute_wrapper(_query_wrapper(alias)))
+                with _Span(trace, 'http.request', {'http.method': request.method, 'url.path': request.path}) as root:
+                    response = self.get_response(request)
+                    root.set(**{'http.status_code': response.status_code})
+                    match = request.resolver_match
+                    if match is not None:
+                        root.set(**{'http.route': match.route, 'view': match.view_name})
+                    user = getattr(request, 'user', None)
+                    if user is not None and user.is_authenticated:
+                        root.set(**{'user.id': user.id})
+        finally:
+            _trace.reset(token)
+            self.writer.write(trace)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses render right after this hook returns; the span ends
+        # in a post-render callback
+        trace = _trace.get()
+        if trace is not None:
+            render = _Span(trace, 'render', {'renderer': type(getattr(response, 'accepted_renderer', None)).__name__})
+            render.__enter__()
+
+            def finish(rendered):
+                # A callback's non-None return value would replace the response
+                render.__exit__(None, None, None)
+            response.add_post_render_callback(finish)
+        return response
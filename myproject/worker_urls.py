@@ -0,0 +1,3 @@
+# URLconf for the worker profile: it serves no HTTP, and an empty URLconf
+# keeps the system checks from importing every view (and DRF) at startup.
+urlpatterns = []